@@ -0,0 +1,249 @@
+# backend/admission.py
+"""
+Admission control in front of the DB-bound routes.
+
+Every request is mapped to a priority class by path. Classes share one pool of
+ADMISSION_MAX_INFLIGHT slots but may only fill part of it (browse < standard <
+critical), and a lower class is never admitted while a higher one is waiting for
+capacity (a waiter held back only by its route limit does not count).
+A request that cannot get a slot within its class's queue budget gets a fast
+503 with Retry-After instead of piling onto MySQL. Each client also has a
+token bucket; exceeding it returns 429.
+
+Calls the page routes make to our own /api over loopback carry INTERNAL_HEADER
+and skip admission: the page request already holds a slot.
+
+Replayed traffic (replay.py) comes from one address, so with
+ADMISSION_REPLAY_BYPASS set, requests carrying REPLAY_HEADER skip the
+per-client token bucket (class admission still applies).
+
+Both headers must carry internal_token(), an HMAC of the app's secret_key,
+rather than trusting the source address (behind a reverse proxy on the same
+host every client looks local). is_internal()/is_replay() check them for the
+other modules that let internal calls through.
+"""
+import hashlib
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from flask import current_app, g, jsonify, request
+
+import metrics
+from config import (
+    ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_CLIENT_RATE,
+    ADMISSION_CLIENT_BURST, ADMISSION_MAX_CLIENTS, ADMISSION_REPLAY_BYPASS,
+)
+
+INTERNAL_HEADER = "X-Internal-Request"
+REPLAY_HEADER = "X-Replay"
+_LOOPBACK = ("127.0.0.1", "::1")
+
+
+@lru_cache(maxsize=8)
+def internal_token(secret_key, purpose="internal"):
+    """Value of INTERNAL_HEADER ("internal") or REPLAY_HEADER ("replay") for an app with this secret_key."""
+    return hmac.new(str(secret_key).encode(), f"marketplace:{purpose}".encode(), hashlib.sha256).hexdigest()
+
+
+def _signed(header, purpose):
+    value = request.headers.get(header)
+    return bool(value) and hmac.compare_digest(value, internal_token(current_app.secret_key, purpose))
+
+
+def is_internal():
+    """The request is one of our own loopback calls (page -> /api, warm-up)."""
+    return _signed(INTERNAL_HEADER, "internal")
+
+
+def is_replay():
+    """The request comes from replay.py run with this app's secret_key."""
+    return _signed(REPLAY_HEADER, "replay")
+
+# class -> (share of ADMISSION_MAX_INFLIGHT, max queue wait in seconds); listed high to low priority
+CLASSES = OrderedDict([
+    ("critical", (1.0, 2.0)),
+    ("standard", (0.75, 0.5)),
+    ("browse", (0.5, 0.25)),
+])
+
+# (path prefix, class, per-route concurrency limit or None); first match wins
+ROUTE_RULES = [
+    ("/api/orders/place", "critical", None),
+    ("/api/payments", "critical", None),
+    ("/checkout", "critical", None),
+    ("/pay/", "critical", None),
+    ("/api/admin/ingest", "standard", 1),
+    ("/api/admin/bulk", "standard", 2),
+    ("/api/analytics", "browse", 4),
+    ("/api/recommendations", "browse", None),
+    ("/api/products", "browse", None),
+    ("/api/categories", "browse", None),
+    ("/products", "browse", None),
+]
+EXEMPT_PREFIXES = ("/static/", "/api/admin/metrics", "/healthz/")
+
+
+def classify(path):
+    """(class, route key, route limit) for a request path; route key only for limited routes."""
+    for prefix, cls, limit in ROUTE_RULES:
+        if path.startswith(prefix):
+            return cls, (prefix if limit else None), limit
+    if path == "/":
+        return "browse", None, None
+    return "standard", None, None
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__("server busy, retry shortly")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, capacity=ADMISSION_MAX_INFLIGHT, max_queue=ADMISSION_MAX_QUEUE):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._route_inflight = {}
+        self._waiting = {cls: {} for cls in CLASSES}     # class -> {(route, limit): waiters}
+
+    def _can_enter(self, cls, route, limit):
+        share, _ = CLASSES[cls]
+        if self._inflight >= max(1, int(self.capacity * share)):
+            return False
+        if limit is not None and self._route_inflight.get(route, 0) >= limit:
+            return False
+        for higher in CLASSES:
+            if higher == cls:
+                return True
+            if self._blocks_lower(higher):
+                return False
+        return True
+
+    def _blocks_lower(self, cls):
+        """True if a waiter of `cls` is held back by class capacity. One that only waits
+        for its route limit (a second ingest) must not keep lower classes out."""
+        return any(n and (limit is None or self._route_inflight.get(route, 0) < limit)
+                   for (route, limit), n in self._waiting[cls].items())
+
+    def _queued(self):
+        return sum(n for waiters in self._waiting.values() for n in waiters.values())
+
+    def acquire(self, cls, route=None, limit=None):
+        _, max_wait = CLASSES[cls]
+        started = time.monotonic()
+        with self._cond:
+            if not self._can_enter(cls, route, limit):
+                if self._queued() >= self.max_queue:
+                    raise Overloaded(self._retry_after())
+                deadline = started + max_wait
+                waiters = self._waiting[cls]
+                waiters[(route, limit)] = waiters.get((route, limit), 0) + 1
+                try:
+                    while not self._can_enter(cls, route, limit):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Overloaded(self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    waiters[(route, limit)] -= 1
+                    # our leaving may unblock a lower class
+                    self._cond.notify_all()
+            self._inflight += 1
+            if route is not None:
+                self._route_inflight[route] = self._route_inflight.get(route, 0) + 1
+        return time.monotonic() - started
+
+    def release(self, route=None):
+        with self._cond:
+            self._inflight -= 1
+            if route is not None:
+                self._route_inflight[route] -= 1
+            self._cond.notify_all()
+
+    def _retry_after(self):
+        # rough: one second per full pool's worth of queued work
+        return max(1, math.ceil(self._queued() / max(1, self.capacity)))
+
+    def state(self):
+        with self._cond:
+            return {"inflight": self._inflight, "capacity": self.capacity,
+                    "waiting": {cls: sum(w.values()) for cls, w in self._waiting.items()},
+                    "routes": dict(self._route_inflight)}
+
+
+class TokenBuckets:
+    """Per-client token buckets, LRU-bounded to ADMISSION_MAX_CLIENTS entries."""
+
+    def __init__(self, rate=ADMISSION_CLIENT_RATE, burst=ADMISSION_CLIENT_BURST, max_clients=ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()   # client -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """0 if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+controller = AdmissionController()
+buckets = TokenBuckets()
+
+
+def _reject(status, message, retry_after):
+    if request.path.startswith("/api/"):
+        resp = jsonify({"success": False, "error": message})
+    else:
+        resp = message
+    return resp, status, {"Retry-After": str(int(math.ceil(retry_after)))}
+
+
+def _before_request():
+    path = request.path
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if is_internal():
+        return None
+
+    cls, route, limit = classify(path)
+    replay = ADMISSION_REPLAY_BYPASS and is_replay()
+    wait = 0 if replay else buckets.take(request.remote_addr or "unknown")
+    if wait:
+        metrics.incr(f"admission.{cls}.rate_limited")
+        return _reject(429, "rate limit exceeded", wait)
+
+    try:
+        queued = controller.acquire(cls, route, limit)
+    except Overloaded as e:
+        metrics.incr(f"admission.{cls}.shed")
+        return _reject(503, str(e), e.retry_after)
+    g.admission_route = route
+    metrics.incr(f"admission.{cls}.admitted")
+    metrics.incr(f"admission.{cls}.queue_ms", queued * 1000)
+    return None
+
+
+def _teardown_request(exc):
+    if "admission_route" in g:
+        controller.release(g.pop("admission_route"))
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,318 @@
+# backend/analytics.py
+"""
+Sales analytics over a columnar in-memory snapshot.
+
+A background thread copies order lines into NumPy arrays incrementally: new
+orders are pulled by OrderID high-water mark, and orders with a status change
+since the last refresh (the order_status_changed/cancelled/refunded rows of
+OutboxEvent, tailed by EventID) get their status re-read so later
+cancellations and refunds show up. IDs are assigned at insert but visible at
+commit, so the last ANALYTICS_LATE_WINDOW IDs below each high-water mark are
+re-scanned for rows that committed after a higher one was read. The first
+refresh also loads the orders moved out by archive.py from their files. Reports are vectorized group-bys (np.bincount over integer keys) on
+the arrays and never query MySQL.
+
+With DB_SHARDS set orders and events are pulled from every shard, each with
+its own high-water marks (IDs interleave across shards, SHARD_ID_STRIDE apart,
+so the late window spans that many more IDs); the catalog comes from the main
+database.
+"""
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import archive
+from config import (
+    ANALYTICS_REFRESH_SECONDS, ANALYTICS_BATCH_SIZE, ANALYTICS_LATE_WINDOW, DB_SHARDS, SHARD_ID_STRIDE,
+)
+from db import get_read_connection
+from sharding import each_customer_shard
+
+STATUSES = ["Pending", "Processing", "Shipped", "Delivered", "Cancelled", "Refunded"]
+STATUS_CODE = {s: i for i, s in enumerate(STATUSES)}
+STATUS_EVENTS = ("order_status_changed", "order_cancelled", "order_refunded")
+NOT_SOLD = np.array([STATUS_CODE["Cancelled"], STATUS_CODE["Refunded"]], dtype=np.int8)
+_EPOCH = date(1970, 1, 1)
+
+
+def _day(d):
+    return (d - _EPOCH).days
+
+
+class _Columns:
+    """One immutable generation of the snapshot; replaced wholesale on refresh."""
+
+    def __init__(self):
+        # per order
+        self.order_id = np.empty(0, dtype=np.int64)
+        self.order_day = np.empty(0, dtype=np.int32)
+        self.order_status = np.empty(0, dtype=np.int8)
+        # per order line
+        self.line_order = np.empty(0, dtype=np.int64)    # index into the per-order arrays
+        self.line_variant = np.empty(0, dtype=np.int32)
+        self.line_qty = np.empty(0, dtype=np.int32)
+        self.line_revenue = np.empty(0, dtype=np.float64)
+        # catalog lookups indexed by VariantID / CategoryID
+        self.variant_category = np.empty(0, dtype=np.int32)
+        self.variant_names = {}
+        self.category_names = {}
+        self.hwm = {}       # shard (None unsharded) -> highest OrderID pulled
+        self.event_hwm = {}     # shard -> highest OutboxEvent EventID looked at
+        self.refreshed_at = None
+
+
+def _late_window():
+    return ANALYTICS_LATE_WINDOW * (SHARD_ID_STRIDE if DB_SHARDS else 1)
+
+
+def _append(cols, orders, lines):
+    """Append (OrderID, OrderDate, Status) rows and their (OrderID, VariantID, Quantity, Price) lines."""
+    base = cols.order_id.size
+    position = {oid: base + i for i, (oid, _, _) in enumerate(orders)}
+    # an order that committed after `orders` was read belongs to a later pass
+    lines = [l for l in lines if l[0] in position]
+    cols.order_id = np.concatenate([cols.order_id, np.array([o[0] for o in orders], dtype=np.int64)])
+    cols.order_day = np.concatenate([cols.order_day, np.array([_day(o[1]) for o in orders], dtype=np.int32)])
+    cols.order_status = np.concatenate([cols.order_status, np.array(
+        [STATUS_CODE.get(o[2], 0) for o in orders], dtype=np.int8)])
+    if lines:
+        cols.line_order = np.concatenate([cols.line_order, np.array([position[l[0]] for l in lines], dtype=np.int64)])
+        cols.line_variant = np.concatenate([cols.line_variant, np.array([l[1] for l in lines], dtype=np.int32)])
+        qty = np.array([l[2] for l in lines], dtype=np.int32)
+        cols.line_qty = np.concatenate([cols.line_qty, qty])
+        cols.line_revenue = np.concatenate([cols.line_revenue, qty * np.array([float(l[3]) for l in lines])])
+
+
+class SalesSnapshot:
+    def __init__(self):
+        self._cols = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---------------- refresh (background) ----------------
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Analytics refresh failed:", e)
+            time.sleep(ANALYTICS_REFRESH_SECONDS)
+
+    def refresh(self):
+        old = self._cols or _Columns()
+        new = _Columns()
+        for name in ("order_id", "order_day", "order_status",
+                     "line_order", "line_variant", "line_qty", "line_revenue"):
+            setattr(new, name, getattr(old, name))
+        new.hwm = dict(old.hwm)
+        new.event_hwm = dict(old.event_hwm)
+        new.order_status = new.order_status.copy()
+        conn = get_read_connection()
+        cursor = conn.cursor()
+        try:
+            self._load_catalog(cursor, new)
+        finally:
+            cursor.close()
+            conn.close()
+
+        for shard, conn in zip(sorted(DB_SHARDS) or [None], each_customer_shard(read=True)):
+            cursor = conn.cursor()
+            try:
+                # each order is on one shard, but its events are on the shard it lives on now
+                self._reread_statuses(cursor, new, self._changed_orders(conn, cursor, new, shard))
+                self._pull_orders(conn, cursor, new, shard)
+                if self._cols is None:
+                    self._load_archived(cursor, new)
+                conn.commit()
+            finally:
+                cursor.close()
+
+        new.refreshed_at = time.time()
+        self._cols = new
+
+    def _changed_orders(self, conn, cursor, cols, shard):
+        """OrderIDs with a status change since the last refresh ([] on the first one)."""
+        cursor.execute("SELECT COALESCE(MAX(EventID), 0) FROM OutboxEvent")
+        top = cursor.fetchone()[0]
+        since = cols.event_hwm.get(shard)
+        cols.event_hwm[shard] = top
+        if since is None:
+            return []       # the first pull reads current statuses
+        cursor.execute(f"""
+            SELECT DISTINCT OrderID FROM OutboxEvent
+            WHERE EventID > %s AND EventID <= %s AND EventType IN ({','.join(['%s'] * len(STATUS_EVENTS))})
+        """, (max(0, since - _late_window()), top) + STATUS_EVENTS)
+        changed = [r[0] for r in cursor.fetchall()]
+        conn.commit()
+        return changed
+
+    def _reread_statuses(self, cursor, cols, order_ids):
+        if not order_ids:
+            return
+        reread_idx = np.flatnonzero(np.isin(cols.order_id, np.array(order_ids, dtype=np.int64)))
+        for start in range(0, reread_idx.size, ANALYTICS_BATCH_SIZE):
+            idx = reread_idx[start:start + ANALYTICS_BATCH_SIZE]
+            ids = cols.order_id[idx].tolist()
+            cursor.execute(
+                f"SELECT OrderID, Status FROM Orders WHERE OrderID IN ({','.join(['%s'] * len(ids))})",
+                ids)
+            current = dict(cursor.fetchall())
+            for i, oid in zip(idx, ids):
+                # archived orders are gone from Orders; keep their last known status
+                if oid in current:
+                    cols.order_status[i] = STATUS_CODE.get(current[oid], cols.order_status[i])
+
+    def _load_archived(self, cursor, cols):
+        """Append the archived orders not already pulled (an order archived after the
+        pull above is in both)."""
+        for payload in archive.archived_files(cursor):
+            ids = np.array([o["OrderID"] for o in payload["orders"]], dtype=np.int64)
+            fresh = set(ids[~np.isin(ids, cols.order_id)].tolist())
+            orders = [(o["OrderID"], date.fromisoformat(o["OrderDate"][:10]), o["Status"])
+                      for o in payload["orders"] if o["OrderID"] in fresh]
+            if orders:
+                _append(cols, orders, [(d["OrderID"], d["VariantID"], d["Quantity"], d["Price"])
+                                       for d in payload["details"]])
+
+    def _pull_orders(self, conn, cursor, cols, shard):
+        hwm = cols.hwm.get(shard, 0)
+        # 1. orders below the high-water mark that committed after it was read
+        low = max(0, hwm - _late_window())
+        if hwm > low:
+            cursor.execute("""
+                SELECT OrderID, OrderDate, Status FROM Orders
+                WHERE OrderID > %s AND OrderID <= %s ORDER BY OrderID
+            """, (low, hwm))
+            known = set(cols.order_id[cols.order_id > low].tolist())
+            late = [o for o in cursor.fetchall() if o[0] not in known]
+            if late:
+                ids = [o[0] for o in late]
+                cursor.execute(f"""
+                    SELECT OrderID, VariantID, Quantity, Price FROM OrderDetails
+                    WHERE OrderID IN ({','.join(['%s'] * len(ids))})
+                """, ids)
+                _append(cols, late, cursor.fetchall())
+            conn.commit()
+
+        # 2. new orders past the high-water mark
+        while True:
+            cursor.execute("""
+                SELECT OrderID, OrderDate, Status FROM Orders
+                WHERE OrderID > %s ORDER BY OrderID LIMIT %s
+            """, (hwm, ANALYTICS_BATCH_SIZE))
+            orders = cursor.fetchall()
+            if not orders:
+                break
+            cursor.execute("""
+                SELECT OrderID, VariantID, Quantity, Price FROM OrderDetails
+                WHERE OrderID > %s AND OrderID <= %s
+            """, (hwm, orders[-1][0]))
+            _append(cols, orders, cursor.fetchall())
+            hwm = cols.hwm[shard] = orders[-1][0]
+            conn.commit()
+
+    def _load_catalog(self, cursor, cols):
+        cursor.execute("""
+            SELECT v.VariantID, COALESCE(p.CategoryID, 0), p.Prod_Name, v.Size, v.Color
+            FROM ProductVariant v JOIN Product p ON v.ProductID = p.ProductID
+        """)
+        rows = cursor.fetchall()
+        size = max([r[0] for r in rows], default=0) + 1
+        cols.variant_category = np.zeros(size, dtype=np.int32)
+        for vid, cat, name, vsize, color in rows:
+            cols.variant_category[vid] = cat
+            cols.variant_names[vid] = f"{name} [{vsize}/{color}]"
+        cursor.execute("SELECT CategoryID, CategoryName FROM Category")
+        cols.category_names = dict(cursor.fetchall())
+
+    # ---------------- queries (memory only) ----------------
+    @property
+    def ready(self):
+        return self._cols is not None
+
+    def _sold_lines(self, cols, start=None, end=None):
+        """Boolean mask over lines: not cancelled/refunded and within [start, end]."""
+        order_ok = ~np.isin(cols.order_status, NOT_SOLD)
+        if start is not None:
+            order_ok &= cols.order_day >= _day(start)
+        if end is not None:
+            order_ok &= cols.order_day <= _day(end)
+        return order_ok[cols.line_order]
+
+    def revenue_by_day(self, start=None, end=None):
+        cols = self._cols
+        mask = self._sold_lines(cols, start, end)
+        days = cols.order_day[cols.line_order[mask]]
+        if not days.size:
+            return []
+        keys, inverse = np.unique(days, return_inverse=True)
+        revenue = np.bincount(inverse, weights=cols.line_revenue[mask])
+        units = np.bincount(inverse, weights=cols.line_qty[mask])
+        return [{"date": (np.datetime64(int(d), "D")).item().isoformat(),
+                 "revenue": round(float(r), 2), "units": int(u)}
+                for d, r, u in zip(keys, revenue, units)]
+
+    def revenue_by_category(self, start=None, end=None):
+        cols = self._cols
+        mask = self._sold_lines(cols, start, end)
+        variants = cols.line_variant[mask]
+        # variants created after the last catalog load fall into "uncategorised" (0)
+        known = variants < cols.variant_category.size
+        cats = np.where(known, cols.variant_category[np.where(known, variants, 0)], 0)
+        if not cats.size:
+            return []
+        revenue = np.bincount(cats, weights=cols.line_revenue[mask])
+        units = np.bincount(cats, weights=cols.line_qty[mask])
+        order = np.argsort(-revenue)
+        return [{"category_id": int(c) or None,
+                 "category": cols.category_names.get(int(c), "Uncategorised"),
+                 "revenue": round(float(revenue[c]), 2), "units": int(units[c])}
+                for c in order if units[c] > 0]
+
+    def top_variants(self, limit=10, start=None, end=None, by="revenue"):
+        cols = self._cols
+        mask = self._sold_lines(cols, start, end)
+        variants = cols.line_variant[mask]
+        if not variants.size:
+            return []
+        revenue = np.bincount(variants, weights=cols.line_revenue[mask])
+        units = np.bincount(variants, weights=cols.line_qty[mask])
+        score = revenue if by == "revenue" else units
+        top = np.argsort(-score)[:limit]
+        return [{"variant_id": int(v), "name": cols.variant_names.get(int(v)),
+                 "revenue": round(float(revenue[v]), 2), "units": int(units[v])}
+                for v in top if units[v] > 0]
+
+    def cancellation_rate(self, start=None, end=None):
+        cols = self._cols
+        in_range = np.ones(cols.order_id.size, dtype=bool)
+        if start is not None:
+            in_range &= cols.order_day >= _day(start)
+        if end is not None:
+            in_range &= cols.order_day <= _day(end)
+        total = int(in_range.sum())
+        cancelled = int((in_range & (cols.order_status == STATUS_CODE["Cancelled"])).sum())
+        refunded = int((in_range & (cols.order_status == STATUS_CODE["Refunded"])).sum())
+        return {
+            "orders": total,
+            "cancelled": cancelled,
+            "refunded": refunded,
+            "cancellation_rate": round(cancelled / total, 4) if total else 0.0,
+            "refund_rate": round(refunded / total, 4) if total else 0.0,
+        }
+
+    def info(self):
+        cols = self._cols
+        return {"orders": int(cols.order_id.size), "lines": int(cols.line_qty.size),
+                "high_water_mark": max(cols.hwm.values(), default=0), "refreshed_at": cols.refreshed_at}
+
+
+sales = SalesSnapshot()
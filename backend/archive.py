@@ -0,0 +1,265 @@
+# backend/archive.py
+"""
+Cold-order archival.
+
+Moves closed orders (Delivered/Cancelled/Refunded) older than a cutoff out of
+Orders/OrderDetails/Payment into gzip-compressed columnar JSON files under
+ARCHIVE_DIR, one file per chunk. Each chunk is written and fsynced first, then
+indexed in OrderArchive and deleted from the hot tables in one transaction
+(OrderDetails and Payment go with Orders through ON DELETE CASCADE).
+With DB_SHARDS set each shard is archived in turn, its OrderArchive rows kept
+next to the orders they replace; customers being moved are skipped until the
+next run.
+
+Usage (from the backend directory):
+    python archive.py --before 2025-01-01
+    python archive.py                       # cutoff = today - ARCHIVE_AFTER_DAYS
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_CHUNK_SIZE, DB_SHARDS
+from sharding import each_customer_shard, fence_connection, fence_customers
+
+FORMAT_VERSION = 1
+
+_ORDER_COLUMNS = ["OrderID", "CustomerID", "OrderDate", "Status", "ShippingAddressID", "TotalAmount"]
+_DETAIL_COLUMNS = ["OrderDetailID", "OrderID", "VariantID", "Quantity", "Price",
+                   "ProductName", "ImageURL", "Size", "Color"]
+_PAYMENT_COLUMNS = ["PaymentID", "OrderID", "PaymentMode", "PaymentDate", "Amount", "Status"]
+
+
+def _placeholders(ids):
+    return ",".join(["%s"] * len(ids))
+
+
+def _columnar(rows, columns):
+    """List of dict rows -> {column: [values]} with JSON-safe values."""
+    out = {c: [] for c in columns}
+    for r in rows:
+        for c in columns:
+            v = r.get(c)
+            if isinstance(v, date):
+                v = v.isoformat()
+            elif v is not None and not isinstance(v, (int, str, float)):
+                v = str(v)      # Decimal keeps its exact text
+            out[c].append(v)
+    return out
+
+
+def _rows(table):
+    """{column: [values]} -> list of dict rows."""
+    columns = list(table)
+    return [dict(zip(columns, values)) for values in zip(*(table[c] for c in columns))]
+
+
+def _write_file(path, payload):
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------------- Writing ----------------
+def _archive_chunk(conn, cursor, order_ids, archive_dir):
+    ph = _placeholders(order_ids)
+    cursor.execute(f"""
+        SELECT OrderID, CustomerID, OrderDate, Status, ShippingAddressID, TotalAmount
+        FROM Orders WHERE OrderID IN ({ph}) ORDER BY OrderID
+        FOR UPDATE
+    """, order_ids)
+    orders = cursor.fetchall()
+    # product names are snapshotted so archived history reads like it did when hot
+    cursor.execute(f"""
+        SELECT od.OrderDetailID, od.OrderID, od.VariantID, od.Quantity, od.Price,
+               p.Prod_Name AS ProductName, p.ImageURL, v.Size, v.Color
+        FROM OrderDetails od
+        JOIN ProductVariant v ON od.VariantID = v.VariantID
+        JOIN Product p ON v.ProductID = p.ProductID
+        WHERE od.OrderID IN ({ph}) ORDER BY od.OrderDetailID
+    """, order_ids)
+    details = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT PaymentID, OrderID, PaymentMode, PaymentDate, Amount, Status
+        FROM Payment WHERE OrderID IN ({ph}) ORDER BY PaymentID
+    """, order_ids)
+    payments = cursor.fetchall()
+
+    name = f"orders-{order_ids[0]}-{order_ids[-1]}.json.gz"
+    path = os.path.join(archive_dir, name)
+    _write_file(path, {
+        "format": FORMAT_VERSION,
+        "orders": _columnar(orders, _ORDER_COLUMNS),
+        "details": _columnar(details, _DETAIL_COLUMNS),
+        "payments": _columnar(payments, _PAYMENT_COLUMNS),
+    })
+
+    # same transaction as the locking read above
+    try:
+        cursor.executemany("""
+            INSERT INTO OrderArchive (OrderID, CustomerID, OrderDate, ArchiveFile)
+            VALUES (%s, %s, %s, %s)
+        """, [(o["OrderID"], o["CustomerID"], o["OrderDate"], name) for o in orders])
+        cursor.execute(f"DELETE FROM Orders WHERE OrderID IN ({ph})", order_ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        os.remove(path)
+        raise
+    return len(orders)
+
+
+def archive_orders(before, chunk_size=ARCHIVE_CHUNK_SIZE, archive_dir=ARCHIVE_DIR, pause=0.05):
+    """Archive closed orders dated before `before`. Returns the number moved."""
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+    for shard, conn in zip(sorted(DB_SHARDS) or [None], each_customer_shard()):
+        moved += _archive_database(conn, shard, before, chunk_size, archive_dir, pause)
+    return moved
+
+
+def _archive_database(conn, shard, before, chunk_size, archive_dir, pause):
+    moved = 0
+    last_id = 0
+    cursor = conn.cursor(dictionary=True)
+    try:
+        while True:
+            cursor.execute("""
+                SELECT OrderID, CustomerID FROM Orders
+                WHERE OrderID > %s AND OrderDate < %s AND Status IN ('Delivered', 'Cancelled', 'Refunded')
+                ORDER BY OrderID
+                LIMIT %s
+            """, (last_id, before, chunk_size))
+            rows = cursor.fetchall()
+            conn.commit()   # end the read snapshot before the next chunk
+            if not rows:
+                break
+            last_id = rows[-1]["OrderID"]
+            fence = None
+            try:
+                if shard is not None:
+                    # a move copying these customers must not also keep the orders hot
+                    fence = fence_connection()
+                    allowed = fence_customers(fence, shard, [r["CustomerID"] for r in rows])
+                    rows = [r for r in rows if r["CustomerID"] in allowed]
+                if rows:
+                    moved += _archive_chunk(conn, cursor, [r["OrderID"] for r in rows], archive_dir)
+            finally:
+                if fence is not None:
+                    fence.close()
+            print(f"archived {moved} orders (up to OrderID {last_id})")
+            time.sleep(pause)
+    finally:
+        cursor.close()
+    return moved
+
+
+# ---------------- Reading ----------------
+_file_cache = OrderedDict()     # file name -> parsed payload
+_file_cache_lock = threading.Lock()
+_FILE_CACHE_SIZE = 32
+
+def _read_file(name):
+    with gzip.open(os.path.join(ARCHIVE_DIR, name), "rt", encoding="utf-8") as f:
+        payload = json.load(f)
+    return {
+        "orders": _rows(payload["orders"]),
+        "details": _rows(payload["details"]),
+        "payments": _rows(payload["payments"]),
+    }
+
+
+def _load_file(name):
+    with _file_cache_lock:
+        payload = _file_cache.get(name)
+        if payload is not None:
+            _file_cache.move_to_end(name)
+            return payload
+    payload = _read_file(name)
+    with _file_cache_lock:
+        _file_cache[name] = payload
+        while len(_file_cache) > _FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+    return payload
+
+
+def _history_row(order, details):
+    items = " || ".join(
+        f"{d['ProductName']} [{d['Size']}/{d['Color']}] x{d['Quantity']} @{d['Price']}"
+        for d in details
+    )
+    return {
+        "OrderID": order["OrderID"],
+        "OrderDate": date.fromisoformat(order["OrderDate"]),
+        "Status": order["Status"],
+        "TotalAmount": order["TotalAmount"],
+        "Items": items,
+        "Archived": True,
+    }
+
+
+def archived_order_history(cursor, cust_id):
+    """Archived orders for a customer, shaped like show_order_history rows."""
+    cursor.execute("""
+        SELECT OrderID, ArchiveFile FROM OrderArchive
+        WHERE CustomerID = %s ORDER BY OrderDate DESC
+    """, (cust_id,))
+    index = cursor.fetchall() or []
+    if not index:
+        return []
+    wanted = {r["OrderID"] for r in index}
+    history = []
+    for name in OrderedDict.fromkeys(r["ArchiveFile"] for r in index):
+        payload = _load_file(name)
+        details = {}
+        for d in payload["details"]:
+            if d["OrderID"] in wanted:
+                details.setdefault(d["OrderID"], []).append(d)
+        for o in payload["orders"]:
+            if o["OrderID"] in wanted:
+                history.append(_history_row(o, details.get(o["OrderID"], [])))
+    history.sort(key=lambda r: r["OrderDate"], reverse=True)
+    return history
+
+
+def find_archived_order(cursor, order_id):
+    """(order, details) for an archived order, or (None, []) if it isn't archived."""
+    cursor.execute("SELECT ArchiveFile FROM OrderArchive WHERE OrderID = %s", (order_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None, []
+    payload = _load_file(row["ArchiveFile"] if isinstance(row, dict) else row[0])
+    order = next((o for o in payload["orders"] if o["OrderID"] == order_id), None)
+    details = [d for d in payload["details"] if d["OrderID"] == order_id]
+    return order, details
+
+
+def archived_files(cursor):
+    """Yield the payload of every archive file indexed in this database's OrderArchive
+    (read directly, so a full scan doesn't flush the file cache)."""
+    cursor.execute("SELECT DISTINCT ArchiveFile FROM OrderArchive")
+    names = [r["ArchiveFile"] if isinstance(r, dict) else r[0] for r in cursor.fetchall()]
+    for name in names:
+        try:
+            yield _read_file(name)
+        except OSError as e:
+            print(f"Archive file {name} unreadable:", e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move closed old orders to the cold archive")
+    parser.add_argument("--before", help="archive orders dated before YYYY-MM-DD")
+    parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    cutoff = args.before or (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    total = archive_orders(cutoff, chunk_size=args.chunk_size)
+    print(f"done: {total} orders archived before {cutoff}")
@@ -0,0 +1,420 @@
+# backend/autocomplete.py
+"""
+Search-as-you-type index.
+
+A compressed (radix) trie over normalized product names, category names and
+variant attributes. Product names are indexed from every word start, so
+"shi" finds "Cotton Shirt". Every node stores the top AUTOCOMPLETE_TOP_K
+suggestions of its subtree ordered by popularity, so a lookup is a walk of
+len(prefix) characters plus a slice; no subtree is scanned at query time.
+
+Popularity: units sold (excluding cancelled and refunded orders) plus a fraction of
+product views; a category weighs as much as its products, an attribute
+(Size/Color value) as much as the products that offer it.
+
+The index is built in the background and then kept current from the
+CatalogChange log: changed products are reloaded, their terms replaced and
+the top-K lists recomputed only along the affected trie paths. Categories and
+popularity drift are picked up by a full rebuild every
+AUTOCOMPLETE_REBUILD_SECONDS.
+"""
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from catalog_version import changed_products
+from config import (
+    AUTOCOMPLETE_TOP_K, AUTOCOMPLETE_REFRESH_SECONDS, AUTOCOMPLETE_REBUILD_SECONDS,
+    AUTOCOMPLETE_VIEW_WEIGHT,
+)
+from db import get_read_connection
+from sharding import each_customer_shard
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text):
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+def _terms(label, every_word=True):
+    """Normalized label, plus every suffix that starts at a word boundary."""
+    words = normalize(label).split()
+    if not words:
+        return []
+    if not every_word:
+        return [" ".join(words)]
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class _Node:
+    __slots__ = ("edges", "entries", "top")
+
+    def __init__(self):
+        self.edges = {}         # first char -> [edge label, child]
+        self.entries = None     # entry keys whose term ends here
+        self.top = ()           # best entry keys in this subtree
+
+
+class PrefixIndex:
+    """Radix trie with per-node top-K. Not thread-safe; AutocompleteIndex serializes writers."""
+
+    def __init__(self, k=AUTOCOMPLETE_TOP_K):
+        self.k = k
+        self.root = _Node()
+        self.entries = {}       # key -> [weight, label, terms]
+
+    # ---------------- writes ----------------
+    def _insert(self, term, key):
+        node, i = self.root, 0
+        while i < len(term):
+            edge = node.edges.get(term[i])
+            if edge is None:
+                child = _Node()
+                node.edges[term[i]] = [term[i:], child]
+                node = child
+                break
+            label, child = edge
+            j = 0
+            while j < len(label) and i + j < len(term) and label[j] == term[i + j]:
+                j += 1
+            if j < len(label):
+                # split the edge at the point of divergence
+                mid = _Node()
+                mid.edges[label[j]] = [label[j:], child]
+                mid.top = child.top
+                edge[0], edge[1] = label[:j], mid
+                child = mid
+            node = child
+            i += j
+        if node.entries is None:
+            node.entries = set()
+        node.entries.add(key)
+
+    def _remove(self, term, key):
+        node, path, i = self.root, [(self.root, None)], 0
+        while i < len(term):
+            edge = node.edges.get(term[i])
+            if edge is None or not term.startswith(edge[0], i):
+                return
+            i += len(edge[0])
+            path.append((edge[1], term[i - len(edge[0])]))
+            node = edge[1]
+        if node.entries:
+            node.entries.discard(key)
+            if not node.entries:
+                node.entries = None
+        # prune nodes left without entries or children
+        for depth in range(len(path) - 1, 0, -1):
+            n, first_char = path[depth]
+            if n.entries or n.edges:
+                break
+            del path[depth - 1][0].edges[first_char]
+            path.pop()
+
+    def _path(self, term):
+        """Nodes along term as far as it exists in the trie now, root first."""
+        node, path, i = self.root, [self.root], 0
+        while i < len(term):
+            edge = node.edges.get(term[i])
+            if edge is None or not term.startswith(edge[0], i):
+                break
+            i += len(edge[0])
+            node = edge[1]
+            path.append(node)
+        return path
+
+    def _recompute(self, node):
+        candidates = set(node.entries or ())
+        for _, child in node.edges.values():
+            candidates.update(child.top)
+        entries = self.entries
+        node.top = tuple(sorted(candidates, key=lambda key: (-entries[key][0], entries[key][1]))[:self.k])
+
+    def _recompute_terms(self, terms):
+        # walked only after every mutation: a later insert may have split an edge
+        # above an earlier path. Deepest first, so every node sees its children's final lists
+        touched = {}
+        for term in terms:
+            for depth, node in enumerate(self._path(term)):
+                touched[id(node)] = (depth, node)
+        for _, node in sorted(touched.values(), key=lambda dn: -dn[0]):
+            self._recompute(node)
+
+    def put_many(self, items):
+        """items: [(key, label, weight, terms)]; replaces existing entries with the same key."""
+        touched = set()
+        for key, label, weight, terms in items:
+            old = self.entries.get(key)
+            if old is not None:
+                for term in old[2]:
+                    self._remove(term, key)
+                touched.update(old[2])
+            self.entries[key] = [weight, label, terms]
+            for term in terms:
+                self._insert(term, key)
+            touched.update(terms)
+        self._recompute_terms(touched)
+
+    def remove_many(self, keys):
+        touched = set()
+        for key in keys:
+            old = self.entries.pop(key, None)
+            if old is None:
+                continue
+            for term in old[2]:
+                self._remove(term, key)
+            touched.update(old[2])
+        self._recompute_terms(touched)
+
+    def finish_build(self):
+        """Compute every node's top-K bottom-up after bulk inserts."""
+        stack, order = [self.root], []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for _, child in node.edges.values())
+        for node in reversed(order):
+            self._recompute(node)
+
+    def bulk_insert(self, items):
+        """Insert without maintaining top-K; call finish_build() afterwards."""
+        for key, label, weight, terms in items:
+            self.entries[key] = [weight, label, terms]
+            for term in terms:
+                self._insert(term, key)
+
+    # ---------------- reads ----------------
+    def lookup(self, prefix, limit):
+        node, i = self.root, 0
+        while i < len(prefix):
+            edge = node.edges.get(prefix[i])
+            if edge is None:
+                return ()
+            label, child = edge
+            rest = prefix[i:]
+            if label.startswith(rest):
+                return child.top[:limit]
+            if not rest.startswith(label):
+                return ()
+            node = child
+            i += len(label)
+        return node.top[:limit]
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()           # one writer at a time
+        self._refreshing = False
+        self._position = None     # ChangeCursor
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        # per product: (category, attribute keys) so incremental updates can adjust aggregates
+        self._product_info = {}
+        self._category_products = defaultdict(set)
+        self._attr_products = defaultdict(set)
+        self._product_weight = {}
+        self._category_names = {}
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    # ---------------- loading ----------------
+    @staticmethod
+    def _load_products(cursor, product_ids=None):
+        """({pid: (name, category)}, {pid: {(kind, value)}}, {pid: weight}) for all or some products."""
+        only, params = "", ()
+        if product_ids is not None:
+            only = f"AND v.ProductID IN ({','.join(['%s'] * len(product_ids))})"
+            params = tuple(product_ids)
+        cursor.execute(f"""
+            SELECT p.ProductID, p.Prod_Name, p.CategoryID
+            FROM Product p
+            WHERE 1 = 1 {only.replace('v.', 'p.')}
+        """, params)
+        products = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+        cursor.execute(f"SELECT v.ProductID, v.Size, v.Color FROM ProductVariant v WHERE 1 = 1 {only}", params)
+        attrs = defaultdict(set)
+        for pid, size, color in cursor.fetchall():
+            if size and size != "OS":
+                attrs[pid].add(("size", size))
+            if color and color != "N/A":
+                attrs[pid].add(("color", color))
+        # orders and view history are spread over the customer shards
+        sold, views = Counter(), Counter()
+        for shard_conn in each_customer_shard(read=True):
+            shard_cursor = shard_conn.cursor()
+            try:
+                shard_cursor.execute(f"""
+                    SELECT v.ProductID, SUM(od.Quantity)
+                    FROM OrderDetails od
+                    JOIN Orders o ON od.OrderID = o.OrderID
+                    JOIN ProductVariant v ON od.VariantID = v.VariantID
+                    WHERE o.Status NOT IN ('Cancelled', 'Refunded') {only}
+                    GROUP BY v.ProductID
+                """, params)
+                sold.update({pid: float(n) for pid, n in shard_cursor.fetchall()})
+                shard_cursor.execute(f"""
+                    SELECT v.ProductID, COUNT(*)
+                    FROM ProductViewHistory h
+                    JOIN ProductVariant v ON h.VariantID = v.VariantID
+                    WHERE 1 = 1 {only}
+                    GROUP BY v.ProductID
+                """, params)
+                views.update(dict(shard_cursor.fetchall()))
+            finally:
+                shard_cursor.close()
+        weights = {pid: 1.0 + float(sold.get(pid) or 0) + AUTOCOMPLETE_VIEW_WEIGHT * float(views.get(pid) or 0)
+                   for pid in products}
+        return products, attrs, weights
+
+    def build(self):
+        conn = get_read_connection()
+        cursor = conn.cursor()
+        try:
+            _, position = changed_products(cursor, None)
+            products, attrs, weights = self._load_products(cursor)
+            cursor.execute("SELECT CategoryID, CategoryName FROM Category")
+            categories = dict(cursor.fetchall())
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        category_products = defaultdict(set)
+        attr_products = defaultdict(set)
+        info = {}
+        for pid, (name, cat) in products.items():
+            info[pid] = (cat, attrs.get(pid, set()))
+            if cat is not None:
+                category_products[cat].add(pid)
+            for a in attrs.get(pid, ()):
+                attr_products[a].add(pid)
+
+        index = PrefixIndex()
+        index.bulk_insert(
+            [(("product", pid), name, weights[pid], _terms(name)) for pid, (name, _) in products.items()] +
+            [(("category", cid), cname, sum(weights[p] for p in category_products[cid]), _terms(cname))
+             for cid, cname in categories.items()] +
+            [(("attr", kind, value), f"{kind.title()}: {value}",
+              sum(weights[p] for p in pids), _terms(value, every_word=False))
+             for (kind, value), pids in attr_products.items()]
+        )
+        index.finish_build()
+
+        with self._lock:
+            self._index = index
+            self._position = position
+            self._product_info = info
+            self._category_products = category_products
+            self._attr_products = attr_products
+            self._product_weight = weights
+            self._category_names = categories
+            self._built_at = time.monotonic()
+
+    def refresh(self):
+        """Apply catalog changes since the last build/refresh."""
+        conn = get_read_connection()
+        cursor = conn.cursor()
+        try:
+            changed, position = changed_products(cursor, self._position)
+            if not changed:
+                self._position = position
+                return 0
+            products, attrs, weights = self._load_products(cursor, sorted(changed))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        with self._lock:
+            index = self._index
+            touched_categories, touched_attrs = set(), set()
+            removed = []
+            puts = []
+            for pid in changed:
+                old_cat, old_attrs = self._product_info.pop(pid, (None, set()))
+                if old_cat is not None:
+                    self._category_products[old_cat].discard(pid)
+                    touched_categories.add(old_cat)
+                for a in old_attrs:
+                    self._attr_products[a].discard(pid)
+                    touched_attrs.add(a)
+                if pid not in products:
+                    removed.append(("product", pid))
+                    self._product_weight.pop(pid, None)
+                    continue
+                name, cat = products[pid]
+                self._product_weight[pid] = weights[pid]
+                self._product_info[pid] = (cat, attrs.get(pid, set()))
+                if cat is not None:
+                    self._category_products[cat].add(pid)
+                    touched_categories.add(cat)
+                for a in attrs.get(pid, ()):
+                    self._attr_products[a].add(pid)
+                    touched_attrs.add(a)
+                puts.append((("product", pid), name, weights[pid], _terms(name)))
+
+            for cid in touched_categories:
+                if cid in self._category_names:
+                    weight = sum(self._product_weight[p] for p in self._category_products[cid])
+                    puts.append((("category", cid), self._category_names[cid], weight,
+                                 _terms(self._category_names[cid])))
+            for kind, value in touched_attrs:
+                pids = self._attr_products[(kind, value)]
+                if pids:
+                    puts.append((("attr", kind, value), f"{kind.title()}: {value}",
+                                 sum(self._product_weight[p] for p in pids), _terms(value, every_word=False)))
+                else:
+                    removed.append(("attr", kind, value))
+
+            index.remove_many(removed)
+            index.put_many(puts)
+            self._position = position
+        return len(changed)
+
+    def ensure_fresh(self):
+        """Kick a background build/refresh if due; never blocks the caller."""
+        now = time.monotonic()
+        if self._refreshing or now - self._checked_at < AUTOCOMPLETE_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            self._checked_at = now
+        rebuild = self._index is None or now - self._built_at > AUTOCOMPLETE_REBUILD_SECONDS
+        threading.Thread(target=self._background, args=(rebuild,), daemon=True).start()
+
+    def _background(self, rebuild):
+        try:
+            self.build() if rebuild else self.refresh()
+        except Exception as e:
+            print("Autocomplete refresh failed:", e)
+        finally:
+            self._refreshing = False
+
+    # ---------------- serving ----------------
+    def suggest(self, text, limit=AUTOCOMPLETE_TOP_K):
+        index = self._index
+        prefix = normalize(text)
+        if index is None or not prefix:
+            return []
+        out = []
+        for key in index.lookup(prefix, limit):
+            entry = index.entries.get(key)
+            if entry is None:
+                continue
+            item = {"type": key[0], "label": entry[1]}
+            if key[0] == "attr":
+                item["attribute"], item["value"] = key[1], key[2]
+            else:
+                item["id"] = key[1]
+            out.append(item)
+        return out
+
+
+autocomplete = AutocompleteIndex()
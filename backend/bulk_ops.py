@@ -0,0 +1,319 @@
+# backend/bulk_ops.py
+"""
+Set-based bulk cancellation and refund.
+
+Target IDs are processed in primary-key order, one chunk per transaction.
+Each chunk changes statuses with a single UPDATE ... WHERE ID IN (...) and
+restores stock with one aggregated UPDATE, instead of one procedure call and
+one trigger firing per order. Chunk size adapts to BULK_LOCK_BUDGET_MS: it
+halves when a chunk runs over budget or hits a lock timeout/deadlock and
+grows again while chunks stay well under it.
+
+With DB_SHARDS set a job runs shard by shard over the IDs found there. Each
+chunk share-locks its customers' directory rows first (sharding.fence_customers)
+so a move can't copy them mid-chunk; customers being moved are reported as
+failed for a retry. Stock goes back on the main database (release_stock)
+after the chunk commits, since a shard's ProductVariant is a replica.
+"""
+import itertools
+import threading
+import time
+from datetime import datetime
+
+import mysql.connector
+
+from config import (
+    BULK_CHUNK_SIZE, BULK_MAX_CHUNK_SIZE,
+    BULK_LOCK_BUDGET_MS, BULK_CHUNK_PAUSE_MS, DB_SHARDS,
+)
+from sharding import each_customer_shard, fence_connection, fence_customers, release_stock
+
+CANCELLABLE_STATUSES = ("Pending", "Processing")
+LOCK_ERRORS = (1205, 1213)      # lock wait timeout, deadlock
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_ids = itertools.count(1)
+_MAX_JOBS_KEPT = 100
+
+
+class BulkJob:
+    def __init__(self, kind, ids):
+        self.id = next(_job_ids)
+        self.kind = kind
+        self.ids = ids
+        self.status = "queued"
+        self.total = len(ids)
+        self.processed = 0
+        self.changed = 0
+        self.failed = 0
+        self.chunks = 0
+        self.chunk_size = BULK_CHUNK_SIZE
+        self.errors = []
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "changed": self.changed,
+            "skipped": self.processed - self.changed - self.failed,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "chunk_size": self.chunk_size,
+            "errors": self.errors[-20:],
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _placeholders(ids):
+    return ",".join(["%s"] * len(ids))
+
+
+# ---------------- Target selection ----------------
+def select_order_ids(cursor, variant_id=None, from_date=None, to_date=None):
+    """Cancellable orders containing variant_id and/or placed within the date range."""
+    sql = """
+        SELECT DISTINCT o.OrderID
+        FROM Orders o
+        JOIN OrderDetails od ON o.OrderID = od.OrderID
+        WHERE o.Status IN ('Pending', 'Processing')
+    """
+    params = []
+    if variant_id is not None:
+        sql += " AND od.VariantID = %s"
+        params.append(variant_id)
+    if from_date:
+        sql += " AND o.OrderDate >= %s"
+        params.append(from_date)
+    if to_date:
+        sql += " AND o.OrderDate <= %s"
+        params.append(to_date)
+    cursor.execute(sql + " ORDER BY o.OrderID", params)
+    return [r[0] for r in cursor.fetchall()]
+
+
+def select_payment_ids(cursor, variant_id=None, from_date=None, to_date=None):
+    """Unrefunded payments for orders containing variant_id and/or within the date range."""
+    sql = """
+        SELECT DISTINCT pay.PaymentID
+        FROM Payment pay
+        JOIN Orders o ON pay.OrderID = o.OrderID
+        JOIN OrderDetails od ON o.OrderID = od.OrderID
+        WHERE pay.Status <> 'Refunded'
+    """
+    params = []
+    if variant_id is not None:
+        sql += " AND od.VariantID = %s"
+        params.append(variant_id)
+    if from_date:
+        sql += " AND o.OrderDate >= %s"
+        params.append(from_date)
+    if to_date:
+        sql += " AND o.OrderDate <= %s"
+        params.append(to_date)
+    cursor.execute(sql + " ORDER BY pay.PaymentID", params)
+    return [r[0] for r in cursor.fetchall()]
+
+
+# ---------------- Chunk operations ----------------
+def _restore_stock(cursor, order_ids):
+    """Put the orders' stock back. Sharded, returns the {VariantID: quantity} to
+    release on the main database once the chunk commits instead."""
+    ph = _placeholders(order_ids)
+    if DB_SHARDS:
+        cursor.execute(f"""
+            SELECT VariantID, SUM(Quantity) FROM OrderDetails
+            WHERE OrderID IN ({ph}) GROUP BY VariantID
+        """, order_ids)
+        return {v: int(q) for v, q in cursor.fetchall()}
+    cursor.execute(f"""
+        UPDATE ProductVariant pv
+        JOIN (
+            SELECT VariantID, SUM(Quantity) AS qty_sum
+            FROM OrderDetails
+            WHERE OrderID IN ({ph})
+            GROUP BY VariantID
+        ) t ON pv.VariantID = t.VariantID
+        SET pv.Stock = pv.Stock + t.qty_sum
+    """, order_ids)
+    return {}
+
+
+def cancel_chunk(cursor, order_ids):
+    """Cancel the still-cancellable orders among order_ids.
+    Returns (how many changed, stock to release on the main database)."""
+    ph = _placeholders(order_ids)
+    cursor.execute(f"""
+        SELECT OrderID FROM Orders
+        WHERE OrderID IN ({ph}) AND Status IN ('Pending', 'Processing')
+        FOR UPDATE
+    """, order_ids)
+    eligible = [r[0] for r in cursor.fetchall()]
+    if not eligible:
+        return 0, {}
+
+    ph = _placeholders(eligible)
+    restock = _restore_stock(cursor, eligible)
+    # stock is restored above, so keep update_stock_on_cancel from doing it per row
+    cursor.execute("SET @skip_stock_restore = 1")
+    try:
+        cursor.execute(f"UPDATE Orders SET Status = 'Cancelled' WHERE OrderID IN ({ph})", eligible)
+    finally:
+        cursor.execute("SET @skip_stock_restore = NULL")
+    return len(eligible), restock
+
+
+def refund_chunk(cursor, payment_ids):
+    """Refund the unrefunded payments among payment_ids.
+    Returns (how many changed, stock to release on the main database)."""
+    ph = _placeholders(payment_ids)
+    cursor.execute(f"""
+        SELECT pay.PaymentID, pay.OrderID, o.Status
+        FROM Payment pay
+        JOIN Orders o ON pay.OrderID = o.OrderID
+        WHERE pay.PaymentID IN ({ph}) AND pay.Status <> 'Refunded'
+        FOR UPDATE
+    """, payment_ids)
+    rows = cursor.fetchall()
+    if not rows:
+        return 0, {}
+
+    payments = [r[0] for r in rows]
+    orders = sorted({r[1] for r in rows})
+    # cancelled orders already had their stock put back by the cancellation
+    restock = sorted({r[1] for r in rows if r[2] not in ("Cancelled", "Refunded")})
+
+    cursor.execute(
+        f"UPDATE Payment SET Status = 'Refunded' WHERE PaymentID IN ({_placeholders(payments)})",
+        payments)
+    cursor.execute(
+        f"UPDATE Orders SET Status = 'Refunded' WHERE OrderID IN ({_placeholders(orders)})",
+        orders)
+    if restock:
+        restock = _restore_stock(cursor, restock)
+    return len(payments), restock or {}
+
+
+# kind -> (chunk function, SQL mapping target IDs to their CustomerID)
+_KINDS = {
+    "cancel": (cancel_chunk, "SELECT OrderID, CustomerID FROM Orders WHERE OrderID IN ({ids})"),
+    "refund": (refund_chunk, """
+        SELECT pay.PaymentID, o.CustomerID
+        FROM Payment pay JOIN Orders o ON pay.OrderID = o.OrderID
+        WHERE pay.PaymentID IN ({ids})
+    """),
+}
+
+
+# ---------------- Job runner ----------------
+def _owners(cursor, owners_sql, ids):
+    """{ID: CustomerID} of the IDs among `ids` stored in this database."""
+    owners = {}
+    for pos in range(0, len(ids), BULK_MAX_CHUNK_SIZE):
+        chunk = ids[pos:pos + BULK_MAX_CHUNK_SIZE]
+        cursor.execute(owners_sql.format(ids=_placeholders(chunk)), chunk)
+        owners.update(cursor.fetchall())
+    return owners
+
+
+def _run_database(job, conn, shard, chunk_fn, owners_sql):
+    """Run the job's chunks on one database (shard None: the only one)."""
+    budget = BULK_LOCK_BUDGET_MS / 1000.0
+    cursor = conn.cursor()
+    try:
+        # don't sit in lock queues much longer than one chunk's budget
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = %s", (max(1, int(budget + 0.999)),))
+        ids, owners = job.ids, None
+        if shard is not None:
+            owners = _owners(cursor, owners_sql, job.ids)
+            conn.commit()
+            ids = sorted(owners)
+
+        pos = 0
+        while pos < len(ids):
+            chunk = ids[pos:pos + job.chunk_size]
+            targets, moving = chunk, []
+            started = time.monotonic()
+            fence = None
+            try:
+                if owners is not None:
+                    # held until the chunk has committed, like customer_connection's fence
+                    fence = fence_connection()
+                    allowed = fence_customers(fence, shard, {owners[i] for i in chunk})
+                    targets = [i for i in chunk if owners[i] in allowed]
+                    moving = [i for i in chunk if owners[i] not in allowed]
+                conn.start_transaction()
+                changed, restock = chunk_fn(cursor, targets) if targets else (0, {})
+                conn.commit()
+            except mysql.connector.Error as err:
+                conn.rollback()
+                if err.errno in LOCK_ERRORS and job.chunk_size > 1:
+                    job.chunk_size = max(1, job.chunk_size // 2)
+                    continue
+                job.failed += len(chunk)
+                job.errors.append(f"IDs {chunk[0]}..{chunk[-1]}: {err}")
+                changed, restock, moving = 0, {}, []
+            finally:
+                if fence is not None:
+                    fence.close()
+            if moving:
+                job.failed += len(moving)
+                job.errors.append(f"IDs {moving[0]}..{moving[-1]}: customer is being moved to another shard, retry")
+            if restock:
+                try:
+                    release_stock(restock)
+                except Exception as e:
+                    job.errors.append(f"IDs {chunk[0]}..{chunk[-1]}: stock not restored: {e}")
+
+            elapsed = time.monotonic() - started
+            pos += len(chunk)
+            job.processed += len(chunk)
+            job.changed += changed
+            job.chunks += 1
+
+            if elapsed > budget and job.chunk_size > 1:
+                job.chunk_size = max(1, job.chunk_size // 2)
+            elif elapsed < budget / 2:
+                job.chunk_size = min(BULK_MAX_CHUNK_SIZE, job.chunk_size * 2)
+            if BULK_CHUNK_PAUSE_MS:
+                time.sleep(BULK_CHUNK_PAUSE_MS / 1000.0)
+    finally:
+        cursor.close()
+
+
+def _run(job, chunk_fn, owners_sql):
+    job.status = "running"
+    job.started_at = datetime.now().isoformat(timespec="seconds")
+    try:
+        # unpooled: the lock wait timeout set above must not outlive the job
+        for shard, conn in zip(sorted(DB_SHARDS) or [None], each_customer_shard(dedicated=True)):
+            _run_database(job, conn, shard, chunk_fn, owners_sql)
+        job.processed = job.total       # IDs no shard has are skipped
+        job.status = "finished" if not job.failed else "finished_with_errors"
+    except Exception as e:
+        job.status = "failed"
+        job.errors.append(str(e))
+    finally:
+        job.finished_at = datetime.now().isoformat(timespec="seconds")
+
+
+def start_job(kind, ids):
+    """Start a background bulk job over the given IDs ("cancel" or "refund")."""
+    chunk_fn, owners_sql = _KINDS[kind]
+    job = BulkJob(kind, sorted(set(int(i) for i in ids)))
+    with _jobs_lock:
+        _jobs[job.id] = job
+        for old_id in sorted(_jobs)[:-_MAX_JOBS_KEPT]:
+            del _jobs[old_id]
+    threading.Thread(target=_run, args=(job, chunk_fn, owners_sql), daemon=True).start()
+    return job
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
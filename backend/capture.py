@@ -0,0 +1,123 @@
+# backend/capture.py
+"""
+Request trace capture for replay testing (see replay.py).
+
+Enabled by setting CAPTURE_FILE. Each finished request is appended to that
+file as one JSON line: start time, method, URL rule and its arguments, query
+string, body, status and duration. Traces are sanitized before they leave the
+process:
+  - customer IDs (cust_id/user_id view args, customer_id body fields and the
+    session's CustomerID) are replaced by stable pseudonyms c1, c2, ...; the
+    real-ID mapping is kept in memory only
+  - personal fields (passwords, names, e-mail, phone, addresses) are redacted
+Loopback /api calls made by the page routes are not recorded; replaying the
+page recreates them.
+"""
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+
+from flask import g, request, session
+
+import metrics
+from admission import is_internal
+from config import CAPTURE_FILE, CAPTURE_SAMPLE_RATE
+
+REDACTED = "<redacted>"
+SENSITIVE_KEYS = {"password", "email", "phone", "name", "address_line_1", "pincode", "city"}
+CUSTOMER_KEYS = {"cust_id", "user_id", "customer_id"}
+
+_pseudonyms = {}
+_next_pseudonym = itertools.count(1)
+_pseudonym_lock = threading.Lock()
+_queue = queue.Queue(maxsize=10000)
+_writer = None
+
+
+def pseudonym(cust_id):
+    if cust_id is None:
+        return None
+    with _pseudonym_lock:
+        key = str(cust_id)
+        if key not in _pseudonyms:
+            _pseudonyms[key] = f"c{next(_next_pseudonym)}"
+        return _pseudonyms[key]
+
+
+def sanitize(data):
+    """Copy of a JSON/form payload with customer IDs pseudonymized and personal fields redacted."""
+    if isinstance(data, dict):
+        out = {}
+        for k, v in data.items():
+            key = str(k).lower()
+            if key in CUSTOMER_KEYS and not isinstance(v, (dict, list)):
+                out[k] = pseudonym(v)
+            elif key in SENSITIVE_KEYS:
+                out[k] = REDACTED
+            else:
+                out[k] = sanitize(v)
+        return out
+    if isinstance(data, list):
+        return [sanitize(v) for v in data]
+    return data
+
+
+def _write_loop():
+    with open(CAPTURE_FILE, "a", encoding="utf-8") as f:
+        while True:
+            record = _queue.get()
+            f.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+            if _queue.empty():
+                f.flush()
+
+
+def _before_request():
+    if request.path.startswith("/static/"):
+        return
+    # only our own loopback calls may opt out; anyone else could hide from the capture
+    if is_internal():
+        return
+    if CAPTURE_SAMPLE_RATE < 1 and random.random() >= CAPTURE_SAMPLE_RATE:
+        return
+    g.capture_started = (time.time(), time.perf_counter())
+
+
+def _after_request(response):
+    started = g.get("capture_started")
+    if started is None:
+        return response
+    wall, perf = started
+    user = session.get("user") or {}
+    record = {
+        "ts": round(wall, 6),
+        "ms": round((time.perf_counter() - perf) * 1000, 3),
+        "method": request.method,
+        "rule": request.url_rule.rule if request.url_rule else None,
+        "path": None if request.url_rule else request.path,
+        "args": sanitize(dict(request.view_args or {})),
+        "query": sanitize(request.args.to_dict()),
+        "json": sanitize(request.get_json(silent=True)) if request.is_json else None,
+        "form": sanitize(request.form.to_dict()) or None,
+        "customer": pseudonym(user.get("CustomerID")),
+        "status": response.status_code,
+    }
+    try:
+        _queue.put_nowait(record)
+        metrics.incr("capture.recorded")
+    except queue.Full:
+        metrics.incr("capture.dropped")
+    return response
+
+
+def init_app(app):
+    """Install the capture hooks if CAPTURE_FILE is set."""
+    global _writer
+    if not CAPTURE_FILE:
+        return
+    _writer = threading.Thread(target=_write_loop, daemon=True)
+    _writer.start()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
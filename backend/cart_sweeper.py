@@ -0,0 +1,232 @@
+# backend/cart_sweeper.py
+"""
+Abandoned-cart sweeper.
+
+A cart (all Cart rows of one customer) is abandoned when none of its rows was
+added or changed within the last CART_EXPIRE_DAYS (sp_add_to_cart refreshes
+DateAdded when it bumps a quantity); its rows are deleted. The table is walked
+in CartID order, one short transaction per chunk:
+    1. read the next chunk of CartIDs (primary-key range, no locks)
+    2. pick the customers with an expired row in that range
+    3. lock all their Cart rows (SELECT ... FOR UPDATE; the next-key locks on
+       the CustomerID index also hold off new rows) and keep the customers
+       whose rows are all expired
+    4. DELETE their whole carts in the same transaction
+The chunk size adapts to CART_SWEEP_LOCK_BUDGET_MS like bulk_ops: it halves
+when a chunk runs over budget or hits a lock wait/deadlock (the session lock
+wait timeout is 1s, so the sweeper gives way to sp_add_to_cart and
+sp_place_order instead of queueing behind them) and grows while chunks stay
+well under it. It sleeps CART_SWEEP_PAUSE_MS between chunks.
+
+With DB_SHARDS set every shard's Cart is swept in turn (sweep_all). Each pass
+also deletes OrderIdempotency keys older than ORDER_IDEMPOTENCY_RETAIN_HOURS
+(one per checkout page view), oldest first in chunks of CART_SWEEP_CHUNK_SIZE.
+
+Runs every CART_SWEEP_INTERVAL_SECONDS in one app process per database
+(MySQL GET_LOCK on the main database), or once from the command line:
+    python cart_sweeper.py --days 30
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+import metrics
+from config import (
+    CART_EXPIRE_DAYS, CART_SWEEP_INTERVAL_SECONDS, CART_SWEEP_CHUNK_SIZE, CART_SWEEP_MAX_CHUNK_SIZE,
+    CART_SWEEP_LOCK_BUDGET_MS, CART_SWEEP_PAUSE_MS, ORDER_IDEMPOTENCY_RETAIN_HOURS,
+)
+from db import get_dedicated_connection
+from sharding import each_customer_shard
+
+LOCK_ERRORS = (1205, 1213)      # lock wait timeout, deadlock
+_LOCK_NAME = "marketplace_cart_sweeper"
+
+
+def _placeholders(ids):
+    return ",".join(["%s"] * len(ids))
+
+
+def sweep_chunk(cursor, after_id, limit, cutoff):
+    """Delete the abandoned carts with a row among the next `limit` CartIDs after
+    after_id. Returns (last CartID scanned or None at the end, rows deleted)."""
+    cursor.execute("SELECT CartID FROM Cart WHERE CartID > %s ORDER BY CartID LIMIT %s", (after_id, limit))
+    ids = [r[0] for r in cursor.fetchall()]
+    if not ids:
+        return None, 0
+    cursor.execute("""
+        SELECT DISTINCT CustomerID FROM Cart
+        WHERE CartID BETWEEN %s AND %s AND DateAdded < %s
+    """, (ids[0], ids[-1], cutoff))
+    candidates = [r[0] for r in cursor.fetchall()]
+    if not candidates:
+        return ids[-1], 0
+    # the decision and the delete see the same rows: nothing can be added or
+    # bumped in these carts until the transaction ends
+    cursor.execute(f"SELECT CustomerID, DateAdded FROM Cart WHERE CustomerID IN ({_placeholders(candidates)}) "
+                   f"FOR UPDATE", candidates)
+    active = {cust_id for cust_id, added in cursor.fetchall() if added >= cutoff}
+    expired = [c for c in candidates if c not in active]
+    if not expired:
+        return ids[-1], 0
+    cursor.execute(f"DELETE FROM Cart WHERE CustomerID IN ({_placeholders(expired)})", expired)
+    return ids[-1], cursor.rowcount
+
+
+def sweep(conn, expire_days=CART_EXPIRE_DAYS):
+    """One full pass over Cart. Returns a summary dict."""
+    cutoff = datetime.now() - timedelta(days=expire_days)
+    budget = CART_SWEEP_LOCK_BUDGET_MS / 1000.0
+    chunk_size = CART_SWEEP_CHUNK_SIZE
+    stats = {"cutoff": cutoff.isoformat(timespec="seconds"), "deleted": 0, "chunks": 0, "lock_errors": 0, "skipped": 0}
+    started_pass = time.monotonic()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = 1")
+        after_id = 0
+        while True:
+            started = time.monotonic()
+            try:
+                conn.start_transaction()
+                last_id, deleted = sweep_chunk(cursor, after_id, chunk_size, cutoff)
+                conn.commit()
+            except mysql.connector.Error as err:
+                conn.rollback()
+                if err.errno not in LOCK_ERRORS:
+                    raise
+                stats["lock_errors"] += 1
+                metrics.incr("cart_sweeper.lock_errors")
+                if chunk_size == 1:
+                    # a hot row: step past it (the next pass gets to it) and go on
+                    cursor.execute("SELECT MIN(CartID) FROM Cart WHERE CartID > %s", (after_id,))
+                    hot = cursor.fetchone()[0]
+                    conn.commit()
+                    if hot is None:
+                        break
+                    after_id = hot
+                    stats["skipped"] += 1
+                    metrics.incr("cart_sweeper.skipped")
+                    time.sleep(CART_SWEEP_PAUSE_MS / 1000.0)
+                    continue
+                chunk_size = max(1, chunk_size // 2)
+                time.sleep(CART_SWEEP_PAUSE_MS / 1000.0)
+                continue
+            if last_id is None:
+                break
+            elapsed = time.monotonic() - started
+            after_id = last_id
+            stats["deleted"] += deleted
+            stats["chunks"] += 1
+            metrics.incr("cart_sweeper.rows_deleted", deleted)
+            metrics.incr("cart_sweeper.chunks")
+
+            if elapsed > budget and chunk_size > 1:
+                chunk_size = max(1, chunk_size // 2)
+            elif elapsed < budget / 2:
+                chunk_size = min(CART_SWEEP_MAX_CHUNK_SIZE, chunk_size * 2)
+            if CART_SWEEP_PAUSE_MS:
+                time.sleep(CART_SWEEP_PAUSE_MS / 1000.0)
+    finally:
+        cursor.close()
+        seconds = time.monotonic() - started_pass
+        metrics.incr("cart_sweeper.passes")
+        metrics.incr("cart_sweeper.seconds", seconds)
+    stats["seconds"] = round(seconds, 3)
+    return stats
+
+
+def prune_idempotency_keys(conn, hours=ORDER_IDEMPOTENCY_RETAIN_HOURS):
+    """Delete OrderIdempotency rows older than `hours` (idx_orderidempotency_created).
+    Returns how many went; stops early on a lock wait, the next pass goes on."""
+    cutoff = datetime.now() - timedelta(hours=hours)
+    deleted = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            try:
+                cursor.execute("""
+                    DELETE FROM OrderIdempotency WHERE CreatedAt < %s
+                    ORDER BY CreatedAt LIMIT %s
+                """, (cutoff, CART_SWEEP_CHUNK_SIZE))
+                count = cursor.rowcount
+                conn.commit()
+            except mysql.connector.Error as err:
+                conn.rollback()
+                if err.errno not in LOCK_ERRORS:
+                    raise
+                metrics.incr("cart_sweeper.lock_errors")
+                break
+            deleted += count
+            if count < CART_SWEEP_CHUNK_SIZE:
+                break
+            if CART_SWEEP_PAUSE_MS:
+                time.sleep(CART_SWEEP_PAUSE_MS / 1000.0)
+    finally:
+        cursor.close()
+    metrics.incr("cart_sweeper.idempotency_keys_deleted", deleted)
+    return deleted
+
+
+def sweep_all(expire_days=CART_EXPIRE_DAYS):
+    """sweep() and prune_idempotency_keys() every customer database. Returns the summed summary."""
+    total = None
+    # unpooled: sweep() shortens the session's lock wait timeout
+    for conn in each_customer_shard(dedicated=True):
+        stats = sweep(conn, expire_days)
+        stats["idempotency_keys_deleted"] = prune_idempotency_keys(conn)
+        if total is None:
+            total = stats
+        else:
+            for key in ("deleted", "chunks", "lock_errors", "skipped", "seconds", "idempotency_keys_deleted"):
+                total[key] += stats[key]
+    total["seconds"] = round(total["seconds"], 3)
+    return total
+
+
+class Sweeper:
+    def __init__(self):
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.last_run = None        # summary of the last completed pass
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            conn = None
+            try:
+                conn = get_dedicated_connection()
+                cursor = conn.cursor()
+                # only one sweeper per database
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+                have_lock = cursor.fetchone()[0] == 1
+                cursor.close()
+                if have_lock:
+                    self.last_run = sweep_all()
+            except Exception as e:
+                metrics.incr("cart_sweeper.failed")
+                print("Cart sweeper error:", e)
+            finally:
+                if conn:
+                    try:
+                        conn.close()    # also releases the named lock
+                    except Exception:
+                        pass
+            time.sleep(CART_SWEEP_INTERVAL_SECONDS)
+
+
+sweeper = Sweeper()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete abandoned carts")
+    parser.add_argument("--days", type=int, default=CART_EXPIRE_DAYS,
+                        help="expire carts with no row added or changed in this many days")
+    args = parser.parse_args()
+    print(sweep_all(args.days))
@@ -0,0 +1,319 @@
+# backend/catalog_snapshot.py
+"""
+Compact catalog snapshot shared by all worker processes through one
+memory-mapped file.
+
+Layout of CATALOG_SNAPSHOT_FILE:
+    8 bytes   magic b"MKTCAT01"
+    8 bytes   header length (little-endian)
+    header    JSON: CatalogChange position (version = high-water mark, gaps)
+              and {array: [dtype, offset, length]}
+    arrays    64-byte aligned, native little-endian
+Products are stored in name order as columns (ID, category, string indexes,
+first variant and variant count); variants as columns of IDs, price, stock and
+review aggregates, grouped by product. Names, descriptions, image URLs, sizes
+and colors are interned into one UTF-8 string table (offsets + bytes), so a
+repeated "Black" or "OS" costs four bytes per variant.
+
+Readers np.frombuffer() straight over the mapping: nothing is copied or
+unpickled, and the OS page cache holds one copy for every process.
+
+One process per host publishes (a flock on <file>.lock): it polls the
+CatalogChange log and, when a change arrived (late commits included), writes a new file next to
+the old one and os.replace()s it in. Readers notice the new inode within
+CATALOG_SNAPSHOT_CHECK_SECONDS and map it; the old mapping stays valid until
+its last reader lets go. Also runnable once from the command line:
+    python catalog_snapshot.py
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:         # no flock: every process publishes, os.replace keeps it safe
+    fcntl = None
+
+import metrics
+from catalog_version import ChangeCursor, changed_products
+from config import CATALOG_SNAPSHOT_FILE, CATALOG_SNAPSHOT_POLL_SECONDS, CATALOG_SNAPSHOT_CHECK_SECONDS
+from db import get_read_connection
+
+MAGIC = b"MKTCAT01"
+_ALIGN = 64
+_NULL = -1
+
+
+# ---------------- writing ----------------
+class _Strings:
+    """Interned string table; None maps to -1."""
+
+    def __init__(self):
+        self._index = {}
+        self._chunks = []
+        self._offsets = [0]
+
+    def __call__(self, text):
+        if text is None:
+            return _NULL
+        i = self._index.get(text)
+        if i is None:
+            data = text.encode("utf-8")
+            i = self._index[text] = len(self._chunks)
+            self._chunks.append(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+        return i
+
+    def arrays(self):
+        return {
+            "str_offsets": np.array(self._offsets, dtype=np.int64),
+            "str_data": np.frombuffer(b"".join(self._chunks), dtype=np.uint8),
+        }
+
+
+def _load(cursor):
+    _, position = changed_products(cursor, None)
+    cursor.execute("""
+        SELECT ProductID, Prod_Name, Description, CategoryID, ImageURL
+        FROM Product ORDER BY Prod_Name, ProductID
+    """)
+    products = cursor.fetchall()
+    cursor.execute("""
+        SELECT v.VariantID, v.ProductID, v.Size, v.Color, v.Price, v.Stock,
+               COALESCE(rs.ReviewCount, 0) AS ReviewCount, COALESCE(rs.RatingSum, 0) AS RatingSum
+        FROM ProductVariant v
+        LEFT JOIN ReviewSummary rs ON rs.VariantID = v.VariantID
+        ORDER BY v.ProductID, v.VariantID
+    """)
+    return position, products, cursor.fetchall()
+
+
+def build_arrays(products, variants):
+    strings = _Strings()
+    position = {p["ProductID"]: i for i, p in enumerate(products)}
+    variants = sorted((v for v in variants if v["ProductID"] in position),
+                      key=lambda v: (position[v["ProductID"]], v["VariantID"]))
+    counts = np.zeros(len(products), dtype=np.int32)
+    for v in variants:
+        counts[position[v["ProductID"]]] += 1
+    arrays = {
+        "product_id": np.array([p["ProductID"] for p in products], dtype=np.int32),
+        "product_name": np.array([strings(p["Prod_Name"]) for p in products], dtype=np.int32),
+        "product_description": np.array([strings(p["Description"]) for p in products], dtype=np.int32),
+        "product_image": np.array([strings(p["ImageURL"]) for p in products], dtype=np.int32),
+        "product_category": np.array([_NULL if p["CategoryID"] is None else p["CategoryID"] for p in products],
+                                     dtype=np.int32),
+        "product_first_variant": (np.cumsum(counts) - counts).astype(np.int32),
+        "product_variant_count": counts,
+        "variant_id": np.array([v["VariantID"] for v in variants], dtype=np.int32),
+        "variant_size": np.array([strings(v["Size"]) for v in variants], dtype=np.int32),
+        "variant_color": np.array([strings(v["Color"]) for v in variants], dtype=np.int32),
+        "variant_price": np.array([float(v["Price"]) for v in variants], dtype=np.float64),
+        "variant_stock": np.array([v["Stock"] for v in variants], dtype=np.int32),
+        "variant_review_count": np.array([v["ReviewCount"] for v in variants], dtype=np.int32),
+        "variant_rating_sum": np.array([v["RatingSum"] for v in variants], dtype=np.int64),
+    }
+    arrays.update(strings.arrays())
+    return arrays
+
+
+def write(path, position, arrays):
+    """Write a snapshot file and atomically replace `path` with it."""
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        offset = (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+        layout[name] = [arr.dtype.str, offset, int(arr.size)]
+        offset += arr.nbytes
+    header = json.dumps({"version": position.hwm, "gaps": position.gaps, "arrays": layout}).encode("utf-8")
+    data_start = (len(MAGIC) + 8 + len(header) + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name][1])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def publish(path=CATALOG_SNAPSHOT_FILE):
+    """Build a snapshot from the database and publish it. Returns its ChangeCursor."""
+    conn = get_read_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        position, products, variants = _load(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write(path, position, build_arrays(products, variants))
+    metrics.incr("catalog_snapshot.published")
+    return position
+
+
+# ---------------- reading ----------------
+class Snapshot:
+    """Read-only view over one mapped snapshot file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mm[start:start + header_len])
+        data_start = (start + header_len + _ALIGN - 1) // _ALIGN * _ALIGN
+        self.version = header["version"]
+        # the catalog changes this snapshot reflects (see catalog_version.ChangeCursor)
+        self.cursor = ChangeCursor(self.version, {int(g): t for g, t in header.get("gaps", {}).items()})
+        for name, (dtype, offset, length) in header["arrays"].items():
+            setattr(self, name, np.frombuffer(self._mm, dtype=np.dtype(dtype), count=length,
+                                              offset=data_start + offset))
+
+    def __len__(self):
+        return len(self.product_id)
+
+    def string(self, i):
+        if i == _NULL:
+            return None
+        return bytes(self.str_data[self.str_offsets[i]:self.str_offsets[i + 1]]).decode("utf-8")
+
+    def product(self, i, variant_limit=None):
+        """Product i (name order) in the dict shape the catalog templates expect."""
+        first = int(self.product_first_variant[i])
+        count = int(self.product_variant_count[i])
+        if variant_limit is not None:
+            count = min(count, variant_limit)
+        pid = int(self.product_id[i])
+        variants = []
+        for j in range(first, first + count):
+            variants.append({
+                "VariantID": int(self.variant_id[j]),
+                "ProductID": pid,
+                "Size": self.string(int(self.variant_size[j])),
+                "Color": self.string(int(self.variant_color[j])),
+                "Price": float(self.variant_price[j]),
+                "Stock": int(self.variant_stock[j]),
+                "ReviewCount": int(self.variant_review_count[j]),
+                "RatingSum": int(self.variant_rating_sum[j]),
+            })
+        category = int(self.product_category[i])
+        return {
+            "ProductID": pid,
+            "Prod_Name": self.string(int(self.product_name[i])),
+            "Description": self.string(int(self.product_description[i])),
+            "CategoryID": None if category == _NULL else category,
+            "ImageURL": self.string(int(self.product_image[i])),
+            "variants": variants,
+        }
+
+    def products(self):
+        return [self.product(i) for i in range(len(self))]
+
+
+class _Reader:
+    def __init__(self, path):
+        self.path = path
+        self._snapshot = None
+        self._identity = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The newest published Snapshot, or None if there is none yet."""
+        now = time.monotonic()
+        if now - self._checked_at < CATALOG_SNAPSHOT_CHECK_SECONDS:
+            return self._snapshot
+        with self._lock:
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return self._snapshot
+            identity = (st.st_ino, st.st_mtime_ns)
+            if identity != self._identity:
+                try:
+                    self._snapshot = Snapshot(self.path)
+                    self._identity = identity
+                    metrics.incr("catalog_snapshot.mapped")
+                except (OSError, ValueError) as e:
+                    print("Could not map catalog snapshot:", e)
+            return self._snapshot
+
+
+_reader = _Reader(CATALOG_SNAPSHOT_FILE)
+
+
+def current():
+    return _reader.current()
+
+
+# ---------------- publisher (background) ----------------
+class Publisher:
+    def __init__(self, path=CATALOG_SNAPSHOT_FILE):
+        self.path = path
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._lock_file = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _acquire(self):
+        """Host-wide publisher lock; held for the life of the process."""
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _loop(self):
+        published = None        # ChangeCursor of the newest snapshot
+        while True:
+            try:
+                if self._acquire():
+                    if published is None:
+                        snapshot = current()
+                        published = snapshot.cursor if snapshot is not None else None
+                    changed = True
+                    if published is not None:
+                        conn = get_read_connection()
+                        cursor = conn.cursor()
+                        try:
+                            changed, position = changed_products(cursor, published)
+                            conn.commit()
+                        finally:
+                            cursor.close()
+                            conn.close()
+                        if not changed:
+                            published = position
+                    if changed:
+                        published = publish(self.path)
+            except Exception as e:
+                print("Catalog snapshot publisher error:", e)
+            time.sleep(CATALOG_SNAPSHOT_POLL_SECONDS)
+
+
+publisher = Publisher()
+
+
+if __name__ == "__main__":
+    print(f"published catalog version {publish().hwm} to {CATALOG_SNAPSHOT_FILE}")
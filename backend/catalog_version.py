@@ -0,0 +1,245 @@
+# backend/catalog_version.py
+"""
+Per-product catalog versions read from the CatalogChange log.
+
+Triggers append a CatalogChange row whenever a product, variant or rating
+changes. refresh() reads only the rows it has not seen yet, so a product's
+version moves only when that product changed.
+
+ChangeIDs are handed out when a row is inserted but become visible when its
+transaction commits, so a lower ID can appear after a higher one was read
+(two concurrent checkouts). A ChangeCursor therefore keeps, besides the
+high-water mark, the IDs below it that were missing when it was read and
+re-checks them until they show up or are CATALOG_CHANGE_GAP_SECONDS old
+(a rolled-back transaction never fills its ID).
+
+Rows older than CATALOG_CHANGE_RETENTION_HOURS are deleted by a background
+pruner in one process per database (MySQL GET_LOCK), or once with:
+    python catalog_version.py --prune
+"""
+import argparse
+import threading
+import time
+
+import metrics
+from config import (
+    CATALOG_CHANGE_GAP_SECONDS, CATALOG_CHANGE_MAX_GAPS,
+    CATALOG_CHANGE_RETENTION_HOURS, CATALOG_CHANGE_PRUNE_SECONDS, CATALOG_CHANGE_PRUNE_CHUNK,
+    CATALOG_VERSION_REFRESH_SECONDS,
+)
+from db import get_dedicated_connection
+
+_LOCK_NAME = "marketplace_catalog_change_pruner"
+
+
+def _value(row, name):
+    return row[name] if isinstance(row, dict) else row[0]
+
+
+class ChangeCursor:
+    """Position in the CatalogChange log. Treat as immutable; reads return a new one."""
+
+    __slots__ = ("hwm", "gaps")
+
+    def __init__(self, hwm=0, gaps=None):
+        self.hwm = hwm              # highest ChangeID read
+        self.gaps = gaps or {}      # ChangeID below hwm not committed yet -> first missed (epoch seconds)
+
+    def saw(self, change_id):
+        return change_id <= self.hwm and change_id not in self.gaps
+
+    def behind(self, other):
+        """True if `other` has read a change this cursor has not."""
+        return other.hwm > self.hwm or any(other.saw(g) for g in self.gaps)
+
+
+def _current(cursor, now):
+    """Cursor at the end of the log: MAX(ChangeID) plus the missing IDs just below it."""
+    cursor.execute("SELECT COALESCE(MAX(ChangeID), 0) AS hwm FROM CatalogChange")
+    hwm = int(_value(cursor.fetchone(), "hwm"))
+    low = max(0, hwm - CATALOG_CHANGE_MAX_GAPS)
+    cursor.execute("SELECT ChangeID FROM CatalogChange WHERE ChangeID > %s", (low,))
+    present = {int(_value(r, "ChangeID")) for r in cursor.fetchall() or []}
+    return ChangeCursor(hwm, {i: now for i in range(low + 1, hwm) if i not in present})
+
+
+def read_changes(cursor, since):
+    """
+    ([(ProductID, ChangeID)] committed since `since`, new cursor), including late
+    commits below its high-water mark. since=None returns ([], current cursor).
+    """
+    now = time.time()
+    if since is None:
+        return [], _current(cursor, now)
+    open_gaps = {g: first for g, first in since.gaps.items() if now - first < CATALOG_CHANGE_GAP_SECONDS}
+    if len(open_gaps) < len(since.gaps):
+        metrics.incr("catalog_change.gaps_expired", len(since.gaps) - len(open_gaps))
+    sql, params = "SELECT ProductID, ChangeID FROM CatalogChange WHERE ChangeID > %s", [since.hwm]
+    if open_gaps:
+        sql += f" OR ChangeID IN ({','.join(['%s'] * len(open_gaps))})"
+        params += list(open_gaps)
+    cursor.execute(sql, params)
+    rows = [(r["ProductID"], r["ChangeID"]) if isinstance(r, dict) else tuple(r) for r in cursor.fetchall() or []]
+
+    present = {cid for _, cid in rows}
+    filled = present.intersection(open_gaps)
+    if filled:
+        metrics.incr("catalog_change.late_commits", len(filled))
+    hwm = max([since.hwm] + [cid for cid in present if cid > since.hwm])
+    gaps = {g: first for g, first in open_gaps.items() if g not in present}
+    gaps.update((i, now) for i in range(since.hwm + 1, hwm) if i not in present)
+    if len(gaps) > CATALOG_CHANGE_MAX_GAPS:
+        # oldest first; a dropped gap that fills later is only picked up by a full rebuild
+        for g in sorted(gaps, key=gaps.get)[:len(gaps) - CATALOG_CHANGE_MAX_GAPS]:
+            del gaps[g]
+        metrics.incr("catalog_change.gaps_dropped")
+    return rows, ChangeCursor(hwm, gaps)
+
+
+class CatalogVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursor = None
+        self._revision = 0          # bumped per observed change, late commits included
+        self._products = {}         # ProductID -> revision of its last observed change
+        self._next_refresh = 0.0    # monotonic time the next sync() pulls changes
+
+    def refresh(self, cursor):
+        """Pull new changes using the caller's cursor. Returns the changed ProductIDs."""
+        rows, position = read_changes(cursor, self._cursor)
+        changed = {pid for pid, _ in rows}
+        with self._lock:
+            # a late commit may carry a lower ChangeID than one already seen, so versions
+            # count observed changes rather than reuse ChangeIDs
+            for pid in changed:
+                self._revision += 1
+                self._products[pid] = self._revision
+            if self._cursor is None or position.hwm >= self._cursor.hwm:
+                self._cursor = position
+        return changed
+
+    def sync(self, cursor):
+        """
+        refresh() for page requests, at most every CATALOG_VERSION_REFRESH_SECONDS.
+        Returns True if the cursor's database has the newest change seen so far,
+        i.e. catalog rows read through it match the current product versions (a
+        lagging replica may not).
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = now >= self._next_refresh
+            if due:
+                self._next_refresh = now + CATALOG_VERSION_REFRESH_SECONDS
+        if due:
+            self.refresh(cursor)
+        cursor.execute("SELECT COALESCE(MAX(ChangeID), 0) AS hwm FROM CatalogChange")
+        return int(_value(cursor.fetchone(), "hwm")) >= self.position.hwm
+
+    @property
+    def position(self):
+        """ChangeCursor of the changes seen so far."""
+        return self._cursor if self._cursor is not None else ChangeCursor()
+
+    def product_version(self, product_id):
+        return self._products.get(product_id, 0)
+
+
+catalog_versions = CatalogVersions()
+
+
+def changed_products(cursor, since):
+    """(ProductIDs changed since ChangeCursor `since`, new cursor) for consumers that
+    track their own position; since=None only returns the current cursor."""
+    rows, position = read_changes(cursor, since)
+    return {pid for pid, _ in rows}, position
+
+
+# ---------------- retention ----------------
+def prune(conn, hours=CATALOG_CHANGE_RETENTION_HOURS, chunk=CATALOG_CHANGE_PRUNE_CHUNK):
+    """
+    Delete the oldest CatalogChange rows, in ChangeID order, while they are older
+    than `hours`. The newest CATALOG_CHANGE_MAX_GAPS IDs are always kept: a cursor
+    taken now looks for missing IDs among them. Returns the number of rows deleted.
+    """
+    deleted = 0
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(ChangeID), 0) FROM CatalogChange")
+        keep_from = cursor.fetchone()[0] - CATALOG_CHANGE_MAX_GAPS
+        last_id = 0
+        while True:
+            cursor.execute("""
+                SELECT ChangeID, ChangedAt < NOW() - INTERVAL %s HOUR
+                FROM CatalogChange
+                WHERE ChangeID > %s AND ChangeID <= %s
+                ORDER BY ChangeID LIMIT %s
+            """, (hours, last_id, keep_from, chunk))
+            rows = cursor.fetchall()
+            old = []
+            for change_id, expired in rows:
+                if not expired:
+                    break
+                old.append(change_id)
+            if not old:
+                break
+            cursor.execute("DELETE FROM CatalogChange WHERE ChangeID > %s AND ChangeID <= %s", (last_id, old[-1]))
+            deleted += cursor.rowcount
+            conn.commit()
+            last_id = old[-1]
+            if len(old) < chunk:
+                break
+    finally:
+        cursor.close()
+    metrics.incr("catalog_change.pruned", deleted)
+    return deleted
+
+
+class Pruner:
+    def __init__(self):
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            conn = None
+            try:
+                conn = get_dedicated_connection()
+                cursor = conn.cursor()
+                # only one pruner per database
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+                have_lock = cursor.fetchone()[0] == 1
+                cursor.close()
+                if have_lock:
+                    prune(conn)
+            except Exception as e:
+                print("CatalogChange pruner error:", e)
+            finally:
+                if conn:
+                    try:
+                        conn.close()    # also releases the named lock
+                    except Exception:
+                        pass
+            time.sleep(CATALOG_CHANGE_PRUNE_SECONDS)
+
+
+pruner = Pruner()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CatalogChange log maintenance")
+    parser.add_argument("--prune", action="store_true", help="delete rows past the retention period")
+    parser.add_argument("--hours", type=float, default=CATALOG_CHANGE_RETENTION_HOURS)
+    args = parser.parse_args()
+    if not args.prune:
+        parser.error("nothing to do (use --prune)")
+    conn = get_dedicated_connection()
+    try:
+        print(f"{prune(conn, args.hours)} CatalogChange rows deleted")
+    finally:
+        conn.close()
@@ -0,0 +1,140 @@
+# backend/categories.py
+"""
+In-memory copy of the Category hierarchy.
+
+The database keeps the CategoryClosure table current through triggers; this
+module mirrors it for page rendering (breadcrumbs, subtree id lists, nested
+menus). The same triggers bump CategoryVersion; at most every
+CATEGORY_TREE_CHECK_SECONDS a lookup compares it with the version the copy was
+loaded at and reloads on a change (or once the copy is older than
+CATEGORY_TREE_TTL). Checks and reloads run under the tree's lock, so only
+one thread at a time goes to the database for them.
+"""
+import threading
+import time
+
+from config import CATEGORY_TREE_TTL, CATEGORY_TREE_CHECK_SECONDS
+from db import get_db_connection
+
+
+class CategoryTree:
+    def __init__(self, ttl=CATEGORY_TREE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._version = None    # CategoryVersion the copy was loaded at
+        self._check_after = 0.0     # monotonic time of the next CategoryVersion check
+        self._categories = {}   # CategoryID -> row
+        self._children = {}     # CategoryID -> [CategoryID, ...]
+        self._subtree = {}      # AncestorID -> [DescendantID, ...] (incl. self)
+
+    def load(self):
+        with self._lock:
+            self._load()
+
+    def _load(self, cursor=None):
+        conn = None
+        try:
+            if cursor is None:
+                conn = get_db_connection()
+                cursor = conn.cursor(dictionary=True)
+            # one snapshot: the version matches the rows read with it
+            cursor.execute("SELECT Version FROM CategoryVersion WHERE ID = 1")
+            row = cursor.fetchone()
+            version = row["Version"] if row else None
+            cursor.execute("""
+                SELECT CategoryID, CategoryName, Description, ParentCategoryID
+                FROM Category
+                ORDER BY CategoryName
+            """)
+            rows = cursor.fetchall() or []
+            cursor.execute("""
+                SELECT AncestorID, DescendantID
+                FROM CategoryClosure
+                ORDER BY AncestorID, Depth
+            """)
+            pairs = cursor.fetchall() or []
+        finally:
+            if conn:
+                cursor.close()
+                conn.close()
+
+        categories = {r["CategoryID"]: r for r in rows}
+        children = {cid: [] for cid in categories}
+        for r in rows:
+            parent = r["ParentCategoryID"]
+            if parent in children:
+                children[parent].append(r["CategoryID"])
+        subtree = {}
+        for p in pairs:
+            subtree.setdefault(p["AncestorID"], []).append(p["DescendantID"])
+
+        self._categories = categories
+        self._children = children
+        self._subtree = subtree
+        self._version = version
+        self._loaded_at = time.time()
+        self._check_after = time.monotonic() + CATEGORY_TREE_CHECK_SECONDS
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() < self._check_after:
+            return
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() < self._check_after:
+                return      # another thread checked while this one waited
+            if self._loaded_at is None or time.time() - self._loaded_at > self.ttl:
+                self._load()
+                return
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SELECT Version FROM CategoryVersion WHERE ID = 1")
+                row = cursor.fetchone()
+                if row is not None and row["Version"] != self._version:
+                    conn.commit()   # read the tree in a snapshot at least as new
+                    self._load(cursor)
+                else:
+                    self._check_after = time.monotonic() + CATEGORY_TREE_CHECK_SECONDS
+            finally:
+                cursor.close()
+                conn.close()
+
+    # ---------- lookups ----------
+    def get(self, cat_id):
+        self._ensure_loaded()
+        return self._categories.get(cat_id)
+
+    def subtree_ids(self, cat_id):
+        """IDs of cat_id and all of its descendants."""
+        self._ensure_loaded()
+        return list(self._subtree.get(cat_id, []))
+
+    def path(self, cat_id):
+        """Root-to-node list of categories, for breadcrumbs."""
+        self._ensure_loaded()
+        path = []
+        seen = set()
+        node = self._categories.get(cat_id)
+        while node and node["CategoryID"] not in seen:
+            seen.add(node["CategoryID"])
+            path.append(node)
+            node = self._categories.get(node["ParentCategoryID"])
+        return list(reversed(path))
+
+    def as_nested(self):
+        """Roots with their children nested under "children", sorted by name."""
+        self._ensure_loaded()
+        with self._lock:
+            categories = self._categories
+            children = self._children
+
+        def build(cid):
+            node = dict(categories[cid])
+            node["children"] = [build(c) for c in children.get(cid, [])]
+            return node
+
+        return [build(cid) for cid, r in categories.items()
+                if r["ParentCategoryID"] not in categories]
+
+
+category_tree = CategoryTree()
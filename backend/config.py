@@ -9,3 +9,181 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', 'your_password'),
     'database': os.getenv('DB_NAME', 'retail_store')
 }
+
+# Recommendation engine (co-purchase matrix held in memory)
+REC_TOP_K = int(os.getenv('REC_TOP_K', '10'))
+REC_NEIGHBOURS = int(os.getenv('REC_NEIGHBOURS', '50'))
+REC_REBUILD_SECONDS = int(os.getenv('REC_REBUILD_SECONDS', '3600'))
+REC_VIEW_WEIGHT = float(os.getenv('REC_VIEW_WEIGHT', '0.25'))
+REC_WISHLIST_WEIGHT = float(os.getenv('REC_WISHLIST_WEIGHT', '0.5'))
+# every process folds new orders into its own matrix from OutboxEvent
+REC_FOLLOW_SECONDS = float(os.getenv('REC_FOLLOW_SECONDS', '2'))
+# EventIDs below the newest one re-read for events that committed late
+REC_EVENT_WINDOW = int(os.getenv('REC_EVENT_WINDOW', '1000'))
+
+# Category tree cache (the closure table itself is maintained by triggers)
+CATEGORY_TREE_TTL = int(os.getenv('CATEGORY_TREE_TTL', '60'))
+# how often a process checks CategoryVersion for category changes
+CATEGORY_TREE_CHECK_SECONDS = float(os.getenv('CATEGORY_TREE_CHECK_SECONDS', '2'))
+
+# Read replicas: comma-separated "host[:port]" list sharing DB_CONFIG's credentials,
+# e.g. DB_REPLICAS=127.0.0.1:3307,127.0.0.1:3308
+def _replica_config(spec):
+    host, _, port = spec.strip().partition(':')
+    return dict(DB_CONFIG, host=host, port=int(port or 3306))
+
+DB_REPLICAS = [_replica_config(h) for h in os.getenv('DB_REPLICAS', '').split(',') if h.strip()]
+# after a customer's own write, their reads stay on the primary this long
+READ_STICKY_SECONDS = float(os.getenv('READ_STICKY_SECONDS', '5'))
+# replicas lagging further behind than this are skipped
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '1'))
+
+# /api/admin/* endpoints: callers send X-Admin-Token: <ADMIN_TOKEN>; with no token set they are
+# answered for loopback callers only
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Bulk cancel/refund jobs
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '500'))
+BULK_MAX_CHUNK_SIZE = int(os.getenv('BULK_MAX_CHUNK_SIZE', '5000'))
+BULK_LOCK_BUDGET_MS = int(os.getenv('BULK_LOCK_BUDGET_MS', '200'))
+BULK_CHUNK_PAUSE_MS = int(os.getenv('BULK_CHUNK_PAUSE_MS', '50'))
+
+# Single-flight: how long a duplicate read waits on the in-flight call (seconds)
+SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', '5'))
+
+# Reviews per page on /api/products/<variant_id>
+REVIEWS_PAGE_SIZE = int(os.getenv('REVIEWS_PAGE_SIZE', '10'))
+
+# Rendered-fragment cache for catalog blocks (entries, LRU)
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', '5000'))
+
+# CatalogChange log (catalog_version.py): missing ChangeIDs below the high-water mark are re-checked
+# for CATALOG_CHANGE_GAP_SECONDS (open transactions commit late), at most CATALOG_CHANGE_MAX_GAPS of them;
+# rows older than CATALOG_CHANGE_RETENTION_HOURS are pruned every CATALOG_CHANGE_PRUNE_SECONDS (0 = never)
+CATALOG_CHANGE_GAP_SECONDS = float(os.getenv('CATALOG_CHANGE_GAP_SECONDS', '300'))
+CATALOG_CHANGE_MAX_GAPS = int(os.getenv('CATALOG_CHANGE_MAX_GAPS', '10000'))
+CATALOG_CHANGE_RETENTION_HOURS = float(os.getenv('CATALOG_CHANGE_RETENTION_HOURS', '24'))
+CATALOG_CHANGE_PRUNE_SECONDS = float(os.getenv('CATALOG_CHANGE_PRUNE_SECONDS', '3600'))
+CATALOG_CHANGE_PRUNE_CHUNK = int(os.getenv('CATALOG_CHANGE_PRUNE_CHUNK', '5000'))
+# page requests pull new CatalogChange rows into the product versions at most this often
+CATALOG_VERSION_REFRESH_SECONDS = float(os.getenv('CATALOG_VERSION_REFRESH_SECONDS', '1'))
+
+# Cold-order archival (archive.py)
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_CHUNK_SIZE = int(os.getenv('ARCHIVE_CHUNK_SIZE', '1000'))
+
+# Sales analytics snapshot (analytics.py)
+ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', '5000'))
+# OrderIDs below the high-water mark re-scanned for orders that committed late
+ANALYTICS_LATE_WINDOW = int(os.getenv('ANALYTICS_LATE_WINDOW', '1000'))
+
+# Catalog/inventory ingest (ingest.py)
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '1000'))
+INGEST_MAX_REJECTS_REPORTED = int(os.getenv('INGEST_MAX_REJECTS_REPORTED', '100'))
+
+# Admission control (admission.py)
+# in-flight request slots; keep at or below the DB connections the app may hold
+ADMISSION_MAX_INFLIGHT = int(os.getenv('ADMISSION_MAX_INFLIGHT', '32'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))
+# per-client token bucket: sustained requests/second and burst size
+ADMISSION_CLIENT_RATE = float(os.getenv('ADMISSION_CLIENT_RATE', '20'))
+ADMISSION_CLIENT_BURST = float(os.getenv('ADMISSION_CLIENT_BURST', '40'))
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '10000'))
+# let replay.py runs (X-Replay header signed with the app's secret_key) skip the per-client bucket; off in production
+ADMISSION_REPLAY_BYPASS = os.getenv('ADMISSION_REPLAY_BYPASS', '0') == '1'
+
+# Request budget (ms) for routes without an entry in deadline.ROUTE_BUDGETS
+DEADLINE_DEFAULT_MS = int(os.getenv('DEADLINE_DEFAULT_MS', '3000'))
+
+# Traffic capture for replay.py: set CAPTURE_FILE to record sanitized request traces
+CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')
+CAPTURE_SAMPLE_RATE = float(os.getenv('CAPTURE_SAMPLE_RATE', '1.0'))
+
+# On-demand request profiler (profiler.py); send X-Profile-Token: <PROFILE_TOKEN> to profile a request
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+
+# Outbox dispatcher (outbox.py); set OUTBOX_DISPATCHER=0 when running `python outbox.py` separately
+OUTBOX_DISPATCHER = os.getenv('OUTBOX_DISPATCHER', '1') == '1'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '200'))
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '2'))
+# dispatched events older than this are deleted by the dispatcher (0 = keep them)
+OUTBOX_RETAIN_HOURS = float(os.getenv('OUTBOX_RETAIN_HOURS', '72'))
+OUTBOX_PRUNE_BATCH = int(os.getenv('OUTBOX_PRUNE_BATCH', '1000'))
+
+# Connection pool (per server: primary and each replica)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '32'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '2'))
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv('DB_POOL_PING_AFTER_SECONDS', '30'))
+
+# Startup warm-up (warmup.py); /healthz/ready answers 503 until it finishes
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') == '1'
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', '8'))
+WARMUP_PRODUCT_DETAILS = int(os.getenv('WARMUP_PRODUCT_DETAILS', '10'))
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS', '5'))
+
+# Autocomplete prefix index (autocomplete.py)
+AUTOCOMPLETE_TOP_K = int(os.getenv('AUTOCOMPLETE_TOP_K', '10'))
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '5'))
+AUTOCOMPLETE_REBUILD_SECONDS = float(os.getenv('AUTOCOMPLETE_REBUILD_SECONDS', '3600'))
+# a product view counts this much of a unit sold towards popularity
+AUTOCOMPLETE_VIEW_WEIGHT = float(os.getenv('AUTOCOMPLETE_VIEW_WEIGHT', '0.2'))
+
+# Facet bitmaps (facets.py): upper bounds of the price bands, comma separated
+FACET_PRICE_BUCKETS = [float(b) for b in os.getenv('FACET_PRICE_BUCKETS', '25,50,100,200').split(',')]
+FACET_REFRESH_SECONDS = float(os.getenv('FACET_REFRESH_SECONDS', '5'))
+FACET_REBUILD_SECONDS = float(os.getenv('FACET_REBUILD_SECONDS', '3600'))
+
+# Shared catalog snapshot (catalog_snapshot.py), memory-mapped by every worker; empty disables it
+CATALOG_SNAPSHOT_FILE = os.getenv('CATALOG_SNAPSHOT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'catalog.snap'))
+CATALOG_SNAPSHOT_POLL_SECONDS = float(os.getenv('CATALOG_SNAPSHOT_POLL_SECONDS', '2'))
+CATALOG_SNAPSHOT_CHECK_SECONDS = float(os.getenv('CATALOG_SNAPSHOT_CHECK_SECONDS', '1'))
+
+# Abandoned-cart sweeper (cart_sweeper.py): carts with no row added in CART_EXPIRE_DAYS are deleted
+CART_SWEEP_ENABLED = os.getenv('CART_SWEEP_ENABLED', '1') == '1'
+CART_EXPIRE_DAYS = int(os.getenv('CART_EXPIRE_DAYS', '30'))
+CART_SWEEP_INTERVAL_SECONDS = float(os.getenv('CART_SWEEP_INTERVAL_SECONDS', '3600'))
+CART_SWEEP_CHUNK_SIZE = int(os.getenv('CART_SWEEP_CHUNK_SIZE', '200'))
+CART_SWEEP_MAX_CHUNK_SIZE = int(os.getenv('CART_SWEEP_MAX_CHUNK_SIZE', '2000'))
+CART_SWEEP_LOCK_BUDGET_MS = int(os.getenv('CART_SWEEP_LOCK_BUDGET_MS', '50'))
+CART_SWEEP_PAUSE_MS = int(os.getenv('CART_SWEEP_PAUSE_MS', '100'))
+# the same pass deletes checkout idempotency keys older than this
+ORDER_IDEMPOTENCY_RETAIN_HOURS = float(os.getenv('ORDER_IDEMPOTENCY_RETAIN_HOURS', '72'))
+
+# Wishlist alerts (wishlist_alerts.py): queued VariantAlert rows are fanned out to every shard's watchers
+# this often by one app process; 0 disables it
+WISHLIST_ALERT_SECONDS = float(os.getenv('WISHLIST_ALERT_SECONDS', '5'))
+WISHLIST_ALERT_BATCH = int(os.getenv('WISHLIST_ALERT_BATCH', '500'))
+
+# Write transactions retried on deadlock/lock wait timeout (db.run_transaction)
+TX_RETRY_ATTEMPTS = int(os.getenv('TX_RETRY_ATTEMPTS', '4'))
+TX_RETRY_BASE_MS = float(os.getenv('TX_RETRY_BASE_MS', '20'))
+TX_RETRY_MAX_MS = float(os.getenv('TX_RETRY_MAX_MS', '500'))
+
+# Customer sharding (sharding.py): comma-separated "id=host[:port]/database" list sharing DB_CONFIG's
+# credentials, e.g. DB_SHARDS=1=127.0.0.1/retail_s1,2=127.0.0.1/retail_s2; empty = one database.
+# Shard ids are permanent (they seed the hash ring and the shard's AUTO_INCREMENT offset) and must be
+# between 1 and SHARD_ID_STRIDE.
+def _shard_config(spec):
+    shard_id, _, location = spec.strip().partition('=')
+    address, _, database = location.partition('/')
+    host, _, port = address.partition(':')
+    return int(shard_id), dict(DB_CONFIG, host=host, port=int(port or 3306), database=database or DB_CONFIG['database'])
+
+DB_SHARDS = dict(_shard_config(s) for s in os.getenv('DB_SHARDS', '').split(',') if s.strip())
+SHARD_ID_STRIDE = int(os.getenv('SHARD_ID_STRIDE', '64'))
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', '128'))
+# how long a process may route reads by a cached directory entry; a move keeps the source rows this long
+SHARD_DIRECTORY_TTL_SECONDS = float(os.getenv('SHARD_DIRECTORY_TTL_SECONDS', '5'))
+SHARD_DIRECTORY_CACHE_SIZE = int(os.getenv('SHARD_DIRECTORY_CACHE_SIZE', '100000'))
+# connections holding write fences (CustomerShard share locks) come from a pool of their own this size
+SHARD_FENCE_POOL_SIZE = int(os.getenv('SHARD_FENCE_POOL_SIZE', str(DB_POOL_SIZE)))
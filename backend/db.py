@@ -1,5 +1,373 @@
+import itertools
+import random
+import threading
+import time
+
 import mysql.connector
-from config import DB_CONFIG
+from flask import g, has_request_context, request, session
+
+import deadline
+import metrics
+import profiler
+from admission import is_internal
+from config import (
+    DB_CONFIG, DB_REPLICAS, READ_STICKY_SECONDS,
+    REPLICA_MAX_LAG_SECONDS, REPLICA_LAG_CHECK_SECONDS,
+    DB_POOL_SIZE, DB_POOL_ACQUIRE_TIMEOUT, DB_POOL_PING_AFTER_SECONDS,
+    TX_RETRY_ATTEMPTS, TX_RETRY_BASE_MS, TX_RETRY_MAX_MS
+)
+
+# ---------------- Connection pools ----------------
+class PoolTimeout(mysql.connector.errors.PoolError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Up to DB_POOL_SIZE open connections to one server. acquire() waits for a
+    free slot (bounded by its timeout) instead of opening connections without
+    limit; idle connections are reused most-recently-used first. A released
+    connection's session is reset (user variables, SET SESSION, temporary
+    tables, named locks) and session_sql run again, so one borrower's settings
+    never reach the next.
+    """
+
+    def __init__(self, config, size=DB_POOL_SIZE, session_sql=()):
+        self.config = config
+        self.size = size
+        self.session_sql = session_sql      # run once on every new connection
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []             # (raw connection, returned_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout, connect_timeout=None):
+        if not self._slots.acquire(timeout=max(0.0, timeout)):
+            metrics.incr("db.pool.acquire_timeouts")
+            raise PoolTimeout(msg=f"no free connection to {self.config.get('host')} within {timeout:.2f}s")
+        try:
+            return self._take_idle() or self._open(connect_timeout)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, returned_at = self._idle.pop()
+            # only ping connections that sat idle long enough to have been dropped
+            if time.monotonic() - returned_at < DB_POOL_PING_AFTER_SECONDS or conn.is_connected():
+                return conn
+            metrics.incr("db.pool.stale")
+
+    def _open(self, connect_timeout=None):
+        config = dict(self.config)
+        if connect_timeout is not None:
+            config["connection_timeout"] = connect_timeout
+        metrics.incr("db.pool.opened")
+        conn = mysql.connector.connect(**config)
+        self._init_session(conn)
+        return conn
+
+    def _init_session(self, conn):
+        if self.session_sql:
+            cursor = conn.cursor()
+            try:
+                for sql in self.session_sql:
+                    cursor.execute(sql)
+            finally:
+                cursor.close()
+
+    def release(self, conn):
+        try:
+            if getattr(conn, "unread_result", False):
+                raise mysql.connector.errors.InternalError(msg="unread result")
+            # end the implicit read transaction so the next user gets a fresh snapshot
+            if conn.in_transaction:
+                conn.rollback()
+            if not conn.cmd_reset_connection():
+                raise mysql.connector.errors.NotSupportedError(msg="session reset not supported")
+            conn._max_execution_time = 0      # back to the server default
+            self._init_session(conn)
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        finally:
+            self._slots.release()
+
+    def warm(self, count):
+        """Open up to `count` connections ahead of traffic. Returns how many are idle."""
+        conns = []
+        try:
+            for _ in range(min(count, self.size)):
+                conns.append(self.acquire(timeout=0))
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+
+class PooledConnection:
+    """A pooled connection; close() hands it back to the pool."""
+
+    def __init__(self, conn, pool, tracked=None):
+        self._conn = conn
+        self._pool = pool
+        self._tracked = tracked     # deadline registration, dropped before the id is reused
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            deadline.untrack(self._tracked)
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError(msg="connection returned to the pool")
+        return getattr(self._conn, name)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(config, session_sql=(), purpose="", size=DB_POOL_SIZE):
+    """The pool for a server; a `purpose` gets slots of its own (`size` applies when it is created)."""
+    key = (purpose, config.get("host"), config.get("port", 3306), config.get("user"), config.get("database"),
+           tuple(session_sql))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(config, size=size, session_sql=session_sql)
+        return pool
+
+def _connect(config, acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT, session_sql=(), purpose="", size=DB_POOL_SIZE):
+    # within a request, waiting, connecting and statements are bounded by its remaining budget
+    limits = deadline.connect_options()
+    if limits:
+        acquire_timeout = min(acquire_timeout, limits["max_execution_time"] / 1000.0)
+    pool = get_pool(config, session_sql, purpose, size)
+    raw = pool.acquire(acquire_timeout, limits.get("connection_timeout"))
+    statement_ms = limits.get("max_execution_time", 0)
+    if getattr(raw, "_max_execution_time", 0) != statement_ms:
+        cursor = raw.cursor()
+        try:
+            cursor.execute(f"SET SESSION max_execution_time = {int(statement_ms)}")
+        finally:
+            cursor.close()
+        raw._max_execution_time = statement_ms
+    tracked = deadline.track(raw, config)
+    # DB calls are only timed while this request is being profiled
+    return profiler.instrument(PooledConnection(raw, pool, tracked))
 
 def get_db_connection():
+    return _connect(DB_CONFIG)
+
+def get_dedicated_connection():
+    """Unpooled connection for long-lived holders (e.g. the outbox dispatcher's named lock)."""
     return mysql.connector.connect(**DB_CONFIG)
+
+
+# ---------------- Read routing ----------------
+# Read-only work goes to a replica unless the customer wrote recently
+# (read-your-writes) or no replica is within REPLICA_MAX_LAG_SECONDS.
+# The "wrote recently" deadline travels with the client in the signed Flask
+# session, so it holds whichever process serves the next request. Writes made
+# through a page's loopback /api call come back in STICKY_HEADER and go into
+# the page's session; pages forward it to the /api reads they make.
+
+STICKY_HEADER = "X-Read-Sticky"     # "<CustomerID>:<epoch seconds>"
+_STICKY_KEY = "read_sticky"         # session: [CustomerID, epoch seconds]
+_replica_lag = {}           # replica index -> (lag seconds or None, checked_at)
+_next_replica = itertools.count()
+
+def mark_write(cust_id):
+    """Pin the customer's reads to the primary for READ_STICKY_SECONDS."""
+    if cust_id is None or not has_request_context():
+        return
+    session[_STICKY_KEY] = g.read_sticky = [int(cust_id), time.time() + READ_STICKY_SECONDS]
+
+def _sticky():
+    """[CustomerID, until] of the current client, from its session or the page that called us."""
+    pinned = session.get(_STICKY_KEY)
+    forwarded = request.headers.get(STICKY_HEADER)
+    if forwarded and is_internal():
+        try:
+            cust_id, until = forwarded.split(":")
+            if not pinned or float(until) > pinned[1]:
+                pinned = [int(cust_id), float(until)]
+        except ValueError:
+            pass
+    return pinned
+
+def _is_sticky(cust_id):
+    if cust_id is None or not has_request_context():
+        return False
+    pinned = _sticky()
+    return bool(pinned) and pinned[0] == int(cust_id) and pinned[1] > time.time()
+
+def propagate_sticky():
+    """Header carrying the client's read stickiness to a loopback /api call."""
+    if not has_request_context():
+        return {}
+    pinned = _sticky()
+    if not pinned or pinned[1] <= time.time():
+        return {}
+    return {STICKY_HEADER: f"{pinned[0]}:{pinned[1]}"}
+
+def absorb_sticky(response, *args, **kwargs):
+    """requests response hook: a write made by a loopback /api call pins this page's client."""
+    value = response.headers.get(STICKY_HEADER)
+    if value and has_request_context():
+        try:
+            cust_id, until = value.split(":")
+            session[_STICKY_KEY] = [int(cust_id), float(until)]
+        except ValueError:
+            pass
+    return response
+
+def _echo_sticky(response):
+    pinned = g.get("read_sticky")
+    if pinned:
+        response.headers[STICKY_HEADER] = f"{pinned[0]}:{pinned[1]}"
+    return response
+
+def init_app(app):
+    app.after_request(_echo_sticky)
+
+def _measure_lag(conn):
+    """Seconds behind the source, or None if replication is not running."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            cursor.execute("SHOW SLAVE STATUS")   # MySQL < 8.0.22
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not row:
+        return None
+    lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+    return float(lag) if lag is not None else None
+
+def _replica_ok(idx, conn):
+    lag, checked_at = _replica_lag.get(idx, (None, 0.0))
+    if time.monotonic() - checked_at > REPLICA_LAG_CHECK_SECONDS:
+        try:
+            lag = _measure_lag(conn)
+        except mysql.connector.Error:
+            lag = None
+        _replica_lag[idx] = (lag, time.monotonic())
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+def _replica_known_bad(idx):
+    lag, checked_at = _replica_lag.get(idx, (0.0, 0.0))
+    fresh = time.monotonic() - checked_at <= REPLICA_LAG_CHECK_SECONDS
+    return fresh and (lag is None or lag > REPLICA_MAX_LAG_SECONDS)
+
+def get_read_connection(cust_id=None):
+    """
+    Connection for read-only queries. Falls back to the primary when the
+    customer is sticky, no replicas are configured, or every replica is
+    unreachable or lagging.
+    """
+    if not DB_REPLICAS or _is_sticky(cust_id):
+        return get_db_connection()
+
+    start = next(_next_replica)
+    for i in range(len(DB_REPLICAS)):
+        idx = (start + i) % len(DB_REPLICAS)
+        if _replica_known_bad(idx):
+            continue
+        try:
+            # a busy replica pool is skipped straight away rather than waited on
+            conn = _connect(DB_REPLICAS[idx], acquire_timeout=0)
+        except PoolTimeout:
+            continue
+        except mysql.connector.Error:
+            _replica_lag[idx] = (None, time.monotonic())
+            continue
+        if _replica_ok(idx, conn):
+            return conn
+        conn.close()
+
+    return get_db_connection()
+
+
+# ---------------- Round-trip batching ----------------
+def fetch_batch(cursor, statements):
+    """
+    Send independent statements in one round trip (multi-statement query) and
+    return one list of rows per statement, in order. A CALL contributes the
+    rows of all its result sets; statements without rows get [].
+
+    statements: [(sql, params), ...]; each sql is a single statement.
+    """
+    sql = ";\n".join(s.strip().rstrip(";") for s, _ in statements)
+    params = [p for _, ps in statements for p in (ps or ())]
+    is_call = [s.lstrip()[:4].upper() == "CALL" for s, _ in statements]
+    results = [[] for _ in statements]
+    i = 0
+    for result in cursor.execute(sql, params, multi=True):
+        if i >= len(statements):
+            break
+        if result.with_rows:
+            results[i].extend(result.fetchall())
+            if not is_call[i]:
+                i += 1
+        else:
+            # a statement without rows, or the status packet that ends a CALL
+            i += 1
+    return results
+
+
+# ---------------- Write transactions ----------------
+RETRYABLE_ERRORS = {1213: "deadlock", 1205: "lock_wait_timeout"}
+
+
+class TransactionConflict(mysql.connector.errors.DatabaseError):
+    """A write transaction still deadlocked or timed out on locks after every retry."""
+
+
+def run_transaction(conn, work, name, **cursor_kwargs):
+    """
+    Run work(cursor) as one transaction on conn and commit it. On a deadlock or
+    lock wait timeout the transaction is rolled back (InnoDB only rolls back the
+    statement on a lock wait timeout) and work runs again on a fresh cursor
+    after a jittered exponential backoff, up to TX_RETRY_ATTEMPTS times, as long
+    as the request's deadline leaves room. work must do nothing outside the
+    transaction that cannot be repeated.
+    """
+    for attempt in range(1, TX_RETRY_ATTEMPTS + 1):
+        cursor = conn.cursor(**cursor_kwargs)
+        try:
+            result = work(cursor)
+            conn.commit()
+            if attempt > 1:
+                metrics.incr(f"tx.{name}.recovered")
+            return result
+        except mysql.connector.Error as err:
+            kind = RETRYABLE_ERRORS.get(err.errno)
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                pass
+            if kind is None:
+                raise
+            metrics.incr(f"tx.{name}.{kind}")
+            # full jitter: concurrent losers of the same deadlock spread out instead of colliding again
+            delay = random.uniform(0, min(TX_RETRY_MAX_MS, TX_RETRY_BASE_MS * 2 ** (attempt - 1)) / 1000.0)
+            left = deadline.remaining()
+            if attempt == TX_RETRY_ATTEMPTS or (left is not None and left <= delay):
+                metrics.incr(f"tx.{name}.gave_up")
+                raise TransactionConflict(msg=f"{name}: {err.msg} (gave up after {attempt} attempts)",
+                                          errno=err.errno, sqlstate=err.sqlstate) from err
+            metrics.incr(f"tx.{name}.retries")
+            time.sleep(delay)
+        finally:
+            cursor.close()
@@ -0,0 +1,300 @@
+# backend/deadline.py
+"""
+Per-route latency budgets.
+
+Each request gets a deadline from ROUTE_BUDGETS when it arrives (before
+admission control, so queueing counts against it). The DB layer reads the
+remaining budget when it hands out a connection: it bounds the pool wait and
+connect, and becomes the session's max_execution_time. Stored procedures are
+not covered by max_execution_time, so a watchdog thread also issues KILL QUERY
+on every connection the request still has checked out once its deadline
+passes (a connection handed back to the pool may already serve another request).
+The watchdog keeps one connection per server for its KILLs; a connection being
+killed is only handed back to the pool once the KILL has been sent.
+
+A route that fails because of its deadline (a statement killed or cut off by
+max_execution_time, or no budget left to connect) is answered with 504 and
+counted as deadline.exceeded; other errors keep their status. Page routes that
+turn errors into a flash message call reraise() first so those failures are
+still answered with 504. Page routes pass their remaining budget to our own /api
+through DEADLINE_HEADER so the inner call never outlives the outer one.
+"""
+import heapq
+import math
+import threading
+import time
+
+import mysql.connector
+import requests
+from flask import g, has_request_context, jsonify, make_response, request
+
+import metrics
+from admission import is_internal
+from config import DEADLINE_DEFAULT_MS
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+# (path prefix, budget in ms or None for no deadline); first match wins
+ROUTE_BUDGETS = [
+    ("/api/admin/ingest", None),
+    ("/api/orders/place", 8000),
+    ("/api/payments", 5000),
+    ("/api/products", 1500),
+    ("/api/categories", 1000),
+    ("/api/recommendations", 500),
+    ("/api/analytics", 2000),
+    ("/checkout", 12000),
+    ("/pay/", 8000),
+    ("/products", 2000),
+]
+
+
+def budget_for(path):
+    """(route key, budget in ms or None) for a request path."""
+    for prefix, budget in ROUTE_BUDGETS:
+        if path.startswith(prefix):
+            return prefix, budget
+    return "default", DEADLINE_DEFAULT_MS
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class _State:
+    """Deadline of one request and the DB connections it opened."""
+
+    def __init__(self, route, deadline):
+        self.route = route
+        self.deadline = deadline
+        self.connections = []       # (db config, connection id) checked out right now
+        self.killed = False
+        self.exceeded = False       # the deadline cut off DB work (connect, statement or kill)
+        self.killing = False        # the watchdog is sending KILLs for this request
+        self.done = False
+        self.lock = threading.Condition()
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+class _Watchdog:
+    """Kills the running statements of requests whose deadline has passed."""
+
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._killers = {}      # (host, port, user) -> connection for KILL QUERY; watchdog thread only
+
+    def watch(self, state):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (state.deadline, id(state), state))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, state = self._heap[0]
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+            self._expire(state)
+
+    def _expire(self, state):
+        with state.lock:
+            if state.done or not state.connections:
+                return
+            state.killed = state.exceeded = True
+            state.killing = True
+            targets = list(state.connections)
+        # KILL outside the lock; untrack() waits for `killing` to clear, so a connection
+        # can't go back to the pool (and to another request) while it is being killed
+        try:
+            for config, connection_id in targets:
+                self._kill(config, connection_id)
+        finally:
+            with state.lock:
+                state.killing = False
+                state.lock.notify_all()
+
+    def _kill(self, config, connection_id):
+        key = (config.get("host"), config.get("port", 3306), config.get("user"))
+        for attempt in range(2):
+            conn = self._killers.get(key)
+            try:
+                if conn is None:
+                    conn = self._killers[key] = mysql.connector.connect(**dict(config, connection_timeout=2))
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(f"KILL QUERY {int(connection_id)}")
+                finally:
+                    cursor.close()
+                metrics.incr("deadline.killed_queries")
+                return
+            except mysql.connector.Error as e:
+                # 1094: the thread already finished
+                if e.errno == 1094:
+                    return
+                # the kill connection may have been dropped: retry once on a new one
+                self._killers.pop(key, None)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                if attempt:
+                    print("Deadline watchdog could not kill query:", e)
+
+
+_watchdog = _Watchdog()
+
+
+# ---------------- DB layer hooks ----------------
+def current():
+    """The current request's deadline state, or None outside a request or without a budget."""
+    if not has_request_context():
+        return None
+    return g.get("deadline")
+
+
+def connect_options():
+    """
+    Limits for a connection handed out now: connection_timeout (seconds, for
+    pool waits and new connects) and max_execution_time (ms). {} without a budget.
+    """
+    state = current()
+    if state is None:
+        return {}
+    remaining = state.remaining()
+    if remaining <= 0:
+        state.exceeded = True
+        metrics.incr("deadline.exceeded_before_connect")
+        raise DeadlineExceeded(f"request budget for {state.route} exhausted")
+    return {
+        "connection_timeout": max(1, math.ceil(remaining)),
+        # rounded up, so a statement cut off by it ends after the deadline (see untrack)
+        "max_execution_time": max(1, math.ceil(remaining * 1000)),
+    }
+
+
+def track(conn, config):
+    """Register a checked-out connection so the watchdog can kill its query at the
+    deadline. Returns a handle for untrack(), or None without a budget."""
+    state = current()
+    if state is None:
+        return None
+    entry = (config, conn.connection_id)
+    with state.lock:
+        state.connections.append(entry)
+    return state, entry
+
+
+def untrack(handle):
+    """The connection is going back to the pool; never kill it for this request again."""
+    if handle is None:
+        return
+    state, entry = handle
+    with state.lock:
+        while state.killing:
+            state.lock.wait()
+        if entry in state.connections:
+            state.connections.remove(entry)
+            # still checked out at the deadline: its statement may have hit max_execution_time
+            if state.remaining() <= 0:
+                state.exceeded = True
+
+
+def reraise(e):
+    """For handlers that turn errors into a message: re-raise `e` as DeadlineExceeded
+    if the request's deadline caused it, so it is still answered with 504."""
+    if isinstance(e, DeadlineExceeded):
+        raise e
+    state = current()
+    if state is None:
+        return
+    # 3024: cut off by max_execution_time; 1317: query killed by the watchdog
+    if isinstance(e, mysql.connector.Error) and (e.errno == 3024 or (e.errno == 1317 and state.exceeded)):
+        state.exceeded = True
+        raise DeadlineExceeded(f"request budget for {state.route} exhausted") from e
+    # a loopback /api call given the remaining budget as its timeout
+    if isinstance(e, requests.exceptions.Timeout) and state.remaining() <= 0:
+        state.exceeded = True
+        raise DeadlineExceeded(f"request budget for {state.route} exhausted") from e
+
+
+def remaining(default=None):
+    """Seconds left for the current request (for loopback HTTP timeouts)."""
+    state = current()
+    if state is None:
+        return default
+    return max(0.001, state.remaining())
+
+
+def propagate():
+    """Header carrying the remaining budget to a loopback /api call."""
+    state = current()
+    if state is None:
+        return {}
+    return {DEADLINE_HEADER: str(max(1, int(state.remaining() * 1000)))}
+
+
+# ---------------- Flask hooks ----------------
+def _before_request():
+    started = time.monotonic()
+    route, budget = budget_for(request.path)
+    inherited = request.headers.get(DEADLINE_HEADER)
+    if inherited and is_internal():
+        try:
+            inherited = int(inherited)
+            budget = min(budget, inherited) if budget is not None else inherited
+        except ValueError:
+            pass
+    if budget is None:
+        return
+    state = _State(route, started + budget / 1000.0)
+    g.deadline = state
+    _watchdog.watch(state)
+
+
+def _after_request(response):
+    state = g.get("deadline")
+    if state is None or response.status_code < 400 or response.status_code in (429, 503, 504):
+        return response
+    # a 404 or validation error that merely came late keeps its status
+    if state.exceeded:
+        metrics.incr("deadline.exceeded")
+        metrics.incr(f"deadline.exceeded.{state.route}")
+        if request.path.startswith("/api/"):
+            return make_response(jsonify({"success": False, "error": "request exceeded its time budget"}), 504)
+        return make_response("request exceeded its time budget", 504)
+    return response
+
+
+def _teardown_request(exc):
+    state = g.get("deadline")
+    if state is not None:
+        with state.lock:
+            state.done = True
+
+
+def _deadline_error(e):
+    metrics.incr("deadline.exceeded")
+    if request.path.startswith("/api/"):
+        return jsonify({"success": False, "error": str(e)}), 504
+    return str(e), 504
+
+
+def init_app(app):
+    # register before admission control so time spent queueing counts against the budget
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_error_handler(DeadlineExceeded, _deadline_error)
@@ -0,0 +1,247 @@
+# backend/facets.py
+"""
+Faceted catalog filtering with bitmap indexes.
+
+Every variant gets a slot (bit position). For each facet value there is a
+bitmap, a Python int with bit `slot` set when the variant has that value:
+    category   CategoryID of the product (filters match the whole subtree)
+    size       ProductVariant.Size
+    color      ProductVariant.Color
+    price      FACET_PRICE_BUCKETS band, e.g. "25-50" or "200+"
+    in_stock   "1" when Stock > 0
+A query ORs the selected values within a facet and ANDs the facets. Counts
+for a facet are taken against the other facets' filters only (so selecting
+"Red" still shows how many "Blue" there are), all from the same bitmaps.
+
+Bitmaps are immutable ints, so an update builds new ones and swaps the whole
+state in one assignment; readers never lock. Changes (stock, price, new or
+deleted variants) are applied from the CatalogChange log every
+FACET_REFRESH_SECONDS, and the index is rebuilt from scratch every
+FACET_REBUILD_SECONDS as a safety net.
+"""
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import metrics
+from catalog_version import changed_products
+from categories import category_tree
+from config import FACET_PRICE_BUCKETS, FACET_REFRESH_SECONDS, FACET_REBUILD_SECONDS
+from db import get_read_connection
+
+FACETS = ("category", "size", "color", "price", "in_stock")
+
+
+def price_bucket(price):
+    lower = 0
+    for bound in FACET_PRICE_BUCKETS:
+        if price < bound:
+            return f"{lower:g}-{bound:g}"
+        lower = bound
+    return f"{lower:g}+"
+
+
+def _values(row):
+    """Facet -> value for one variant row."""
+    return {
+        "category": row["CategoryID"],
+        "size": row["Size"],
+        "color": row["Color"],
+        "price": price_bucket(float(row["Price"])),
+        "in_stock": "1" if row["Stock"] > 0 else "0",
+    }
+
+
+def _slots(bitmap, nbits):
+    """Set bit positions of an int bitmap, ascending."""
+    if not bitmap:
+        return np.empty(0, dtype=np.int64)
+    raw = np.frombuffer(bitmap.to_bytes((nbits + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+
+class _State:
+    __slots__ = ("bitmaps", "rows", "slot_of", "live", "position")
+
+    def __init__(self, bitmaps, rows, slot_of, live, position):
+        self.bitmaps = bitmaps      # facet -> {value: int bitmap}
+        self.rows = rows            # slot -> variant row dict, None once deleted
+        self.slot_of = slot_of      # VariantID -> slot
+        self.live = live            # bitmap of slots that hold a variant
+        self.position = position    # ChangeCursor into the CatalogChange log
+
+
+_VARIANT_QUERY = """
+    SELECT v.VariantID, v.ProductID, p.Prod_Name AS ProductName, p.CategoryID,
+           v.Size, v.Color, v.Price, v.Stock
+    FROM ProductVariant v
+    JOIN Product p ON p.ProductID = v.ProductID
+"""
+
+
+class FacetIndex:
+    def __init__(self):
+        self._state = None
+        self._lock = threading.Lock()       # one writer at a time
+        self._refreshing = False
+        self._checked_at = 0.0
+        self._built_at = 0.0
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    # ---------------- building ----------------
+    def build(self):
+        conn = get_read_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            _, position = changed_products(cursor, None)
+            cursor.execute(_VARIANT_QUERY + " ORDER BY v.VariantID")
+            rows = cursor.fetchall()
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        # collect slot lists per value, then turn each into an int in one go
+        positions = {facet: defaultdict(list) for facet in FACETS}
+        for slot, row in enumerate(rows):
+            for facet, value in _values(row).items():
+                positions[facet][value].append(slot)
+        nbytes = (len(rows) + 7) // 8
+        bitmaps = {}
+        for facet, by_value in positions.items():
+            bitmaps[facet] = {}
+            for value, slots in by_value.items():
+                bits = np.zeros(nbytes * 8, dtype=np.uint8)
+                bits[slots] = 1
+                bitmaps[facet][value] = int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+        state = _State(bitmaps, rows, {r["VariantID"]: i for i, r in enumerate(rows)},
+                       (1 << len(rows)) - 1, position)
+        with self._lock:
+            self._state = state
+            self._built_at = time.monotonic()
+
+    def refresh(self):
+        """Apply variant/product changes since the last build or refresh."""
+        old = self._state
+        conn = get_read_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            changed, position = changed_products(cursor, old.position)
+            if not changed:
+                with self._lock:
+                    s = self._state
+                    self._state = _State(s.bitmaps, s.rows, s.slot_of, s.live, position)
+                return 0
+            placeholders = ",".join(["%s"] * len(changed))
+            cursor.execute(_VARIANT_QUERY + f" WHERE v.ProductID IN ({placeholders})", tuple(changed))
+            current = {r["VariantID"]: r for r in cursor.fetchall()}
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        with self._lock:
+            old = self._state
+            bitmaps = {facet: dict(values) for facet, values in old.bitmaps.items()}
+            rows = list(old.rows)
+            slot_of = dict(old.slot_of)
+            live = old.live
+            # variants of the changed products that are gone
+            gone = [vid for vid, slot in slot_of.items()
+                    if rows[slot] is not None and rows[slot]["ProductID"] in changed and vid not in current]
+            for vid in gone:
+                slot = slot_of.pop(vid)
+                for facet, value in _values(rows[slot]).items():
+                    bitmaps[facet][value] &= ~(1 << slot)
+                rows[slot] = None
+                live &= ~(1 << slot)
+            for vid, row in current.items():
+                slot = slot_of.get(vid)
+                if slot is None:
+                    slot = slot_of[vid] = len(rows)
+                    rows.append(row)
+                    live |= 1 << slot
+                    before = {}
+                else:
+                    before = _values(rows[slot])
+                    rows[slot] = row
+                bit = 1 << slot
+                for facet, value in _values(row).items():
+                    if before.get(facet) == value:
+                        continue
+                    if facet in before:
+                        bitmaps[facet][before[facet]] &= ~bit
+                    bitmaps[facet][value] = bitmaps[facet].get(value, 0) | bit
+            for values in bitmaps.values():
+                for value in [v for v, bm in values.items() if not bm]:
+                    del values[value]
+            self._state = _State(bitmaps, rows, slot_of, live, position)
+        metrics.incr("facets.variants_updated", len(current) + len(gone))
+        return len(changed)
+
+    def ensure_fresh(self):
+        """Build or refresh in the background when due; never blocks the caller."""
+        now = time.monotonic()
+        if self._refreshing or now - self._checked_at < FACET_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            self._checked_at = now
+        rebuild = self._state is None or now - self._built_at > FACET_REBUILD_SECONDS
+        threading.Thread(target=self._background, args=(rebuild,), daemon=True).start()
+
+    def _background(self, rebuild):
+        try:
+            self.build() if rebuild else self.refresh()
+        except Exception as e:
+            print("Facet index refresh failed:", e)
+        finally:
+            self._refreshing = False
+
+    # ---------------- querying ----------------
+    def _facet_filter(self, state, facet, values):
+        if facet == "category":
+            ids = set()
+            for cid in values:
+                ids.update(category_tree.subtree_ids(cid))
+            values = ids
+        bitmap = 0
+        for value in values:
+            bitmap |= state.bitmaps[facet].get(value, 0)
+        return bitmap
+
+    def search(self, filters, offset=0, limit=50):
+        """
+        filters: {facet: [values]} (empty or missing facet = no filter).
+        Returns (total, rows for offset..offset+limit, {facet: {value: count}}).
+        """
+        state = self._state
+        masks = {facet: self._facet_filter(state, facet, values)
+                 for facet, values in filters.items() if values}
+        matched = state.live
+        for mask in masks.values():
+            matched &= mask
+
+        counts = {}
+        for facet in FACETS:
+            # disjunctive counts: apply every filter except this facet's own
+            base = state.live
+            for other, mask in masks.items():
+                if other != facet:
+                    base &= mask
+            counts[facet] = {value: (bm & base).bit_count()
+                             for value, bm in state.bitmaps[facet].items() if bm & base}
+
+        slots = _slots(matched, len(state.rows))
+        page = [state.rows[s] for s in slots[offset:offset + limit]]
+        return len(slots), page, counts
+
+
+facet_index = FacetIndex()
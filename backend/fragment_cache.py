@@ -0,0 +1,56 @@
+# backend/fragment_cache.py
+"""
+Cache of rendered Jinja fragments for catalog blocks.
+
+Entries are keyed by (macro, ProductID, product version, variant count), so
+a product's card is rendered once per catalog change to that product and
+reused for every user; the variant count tells apart cards the landing page
+cuts short. Per-user bits (flash messages, cart badge, "bought before") are
+rendered around the cached HTML by the page template. Callers pass
+cache=False when the product was read from a database that may not have
+the changes behind the current version (catalog_versions.refresh).
+"""
+import threading
+from collections import OrderedDict
+
+from flask import get_template_attribute
+from markupsafe import Markup
+
+import metrics
+from catalog_version import catalog_versions
+from config import FRAGMENT_CACHE_SIZE
+
+FRAGMENTS_TEMPLATE = "fragments.html"
+
+
+class FragmentCache:
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, macro_name, product, cache=True):
+        """Rendered HTML of fragments.html:<macro_name>(product), cached per product version."""
+        if not cache:
+            metrics.incr("fragment_cache.bypassed")
+            return Markup(get_template_attribute(FRAGMENTS_TEMPLATE, macro_name)(product))
+        pid = product["ProductID"]
+        key = (macro_name, pid, catalog_versions.product_version(pid), len(product.get("variants") or ()))
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+        if html is not None:
+            metrics.incr("fragment_cache.hits")
+            return html
+
+        metrics.incr("fragment_cache.misses")
+        html = Markup(get_template_attribute(FRAGMENTS_TEMPLATE, macro_name)(product))
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+
+fragment_cache = FragmentCache()
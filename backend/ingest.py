@@ -0,0 +1,305 @@
+# backend/ingest.py
+"""
+Streaming catalog and inventory ingest.
+
+Reads supplier rows from CSV or NDJSON, validates them, diffs each chunk
+against the current Product/ProductVariant rows and applies only the changes
+as multi-row INSERT ... ON DUPLICATE KEY UPDATE statements, one bounded
+transaction per chunk.
+
+Row fields (CSV header or NDJSON keys):
+    product_id (required), product_name, description, category_id, image_url,
+    size (default 'OS'), color (default 'N/A'), price, stock
+product_name is required only when the product does not exist yet; price and
+stock are required for new variants.
+
+Usage (from the backend directory):
+    python ingest.py feed.csv
+    python ingest.py feed.ndjson --format ndjson --dry-run
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+import mysql.connector
+
+import metrics
+from config import INGEST_CHUNK_SIZE, INGEST_MAX_REJECTS_REPORTED
+from db import get_db_connection
+
+_PRODUCT_FIELDS = ("product_name", "description", "category_id", "image_url")
+
+
+class IngestReport:
+    def __init__(self):
+        self.rows = 0
+        self.products_inserted = 0
+        self.products_updated = 0
+        self.variants_inserted = 0
+        self.variants_updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.rejects = []
+        self.chunks = 0
+        self.started = time.monotonic()
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < INGEST_MAX_REJECTS_REPORTED:
+            self.rejects.append({"line": line, "reason": reason})
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "rows": self.rows,
+            "products_inserted": self.products_inserted,
+            "products_updated": self.products_updated,
+            "variants_inserted": self.variants_inserted,
+            "variants_updated": self.variants_updated,
+            "unchanged": self.unchanged,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else None,
+        }
+
+
+# ---------------- Parsing / validation ----------------
+def read_rows(stream, fmt="csv"):
+    """Yield (line_number, dict) from a text stream without loading it all."""
+    if fmt == "ndjson":
+        for n, line in enumerate(stream, start=1):
+            line = line.strip()
+            if line:
+                try:
+                    yield n, json.loads(line)
+                except ValueError as e:
+                    yield n, {"_error": f"invalid JSON: {e}"}
+    else:
+        reader = csv.DictReader(stream)
+        for n, row in enumerate(reader, start=2):     # line 1 is the header
+            yield n, {k.strip().lower(): v for k, v in row.items() if k}
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def validate(row, categories):
+    """Normalised row dict, or raise ValueError with the reason."""
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    out = {}
+    try:
+        out["product_id"] = int(row.get("product_id"))
+    except (TypeError, ValueError):
+        raise ValueError("product_id must be an integer")
+    if out["product_id"] <= 0:
+        raise ValueError("product_id must be positive")
+
+    out["size"] = str(row.get("size") or "OS").strip()
+    out["color"] = str(row.get("color") or "N/A").strip()
+    if len(out["size"]) > 20 or len(out["color"]) > 20:
+        raise ValueError("size/color longer than 20 characters")
+
+    if not _blank(row.get("price")):
+        try:
+            out["price"] = Decimal(str(row["price"])).quantize(Decimal("0.01"))
+        except InvalidOperation:
+            raise ValueError("price must be a number")
+        if out["price"] <= 0:
+            raise ValueError("price must be positive")
+    if not _blank(row.get("stock")):
+        try:
+            out["stock"] = int(row["stock"])
+        except (TypeError, ValueError):
+            raise ValueError("stock must be an integer")
+        if out["stock"] < 0:
+            raise ValueError("stock cannot be negative")
+
+    for field in _PRODUCT_FIELDS:
+        if not _blank(row.get(field)):
+            out[field] = str(row[field]).strip()
+    if "product_name" in out and len(out["product_name"]) > 50:
+        raise ValueError("product_name longer than 50 characters")
+    if "image_url" in out and len(out["image_url"]) > 255:
+        raise ValueError("image_url longer than 255 characters")
+    if "category_id" in out:
+        try:
+            out["category_id"] = int(out["category_id"])
+        except ValueError:
+            raise ValueError("category_id must be an integer")
+        if out["category_id"] not in categories:
+            raise ValueError(f"unknown category_id {out['category_id']}")
+    return out
+
+
+# ---------------- Diff / apply ----------------
+def _multi_row(sql_head, columns, rows, update_columns):
+    """One INSERT ... VALUES (...),(...) ON DUPLICATE KEY UPDATE statement."""
+    group = "(" + ",".join(["%s"] * len(columns)) + ")"
+    sql = (f"{sql_head} ({', '.join(columns)}) VALUES " + ",".join([group] * len(rows)) +
+           " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in update_columns))
+    params = [value for row in rows for value in row]
+    return sql, params
+
+
+def _variant_key(product_id, size, color):
+    # ProductVariant's collation ignores case and trailing spaces, so the diff must too
+    return product_id, size.strip().casefold(), color.strip().casefold()
+
+
+def _apply_chunk(conn, cursor, chunk, report, dry_run):
+    # last row wins within a chunk
+    by_variant = {}
+    for line, row in chunk:
+        by_variant[_variant_key(row["product_id"], row["size"], row["color"])] = (line, row)
+    product_ids = sorted({k[0] for k in by_variant})
+    ph = ",".join(["%s"] * len(product_ids))
+
+    cursor.execute(f"""
+        SELECT ProductID, Prod_Name, Description, CategoryID, ImageURL
+        FROM Product WHERE ProductID IN ({ph})
+    """, product_ids)
+    products = {r["ProductID"]: r for r in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT ProductID, Size, Color, Price, Stock
+        FROM ProductVariant WHERE ProductID IN ({ph})
+    """, product_ids)
+    variants = {_variant_key(r["ProductID"], r["Size"], r["Color"]): r for r in cursor.fetchall()}
+
+    product_rows = {}       # ProductID -> [Prod_Name, Description, CategoryID, ImageURL]
+    variant_rows = []
+    counts = {"variants_inserted": 0, "variants_updated": 0, "unchanged": 0}
+    for key, (line, row) in by_variant.items():
+        pid = key[0]
+        current = products.get(pid)
+        if current is None and pid not in product_rows and "product_name" not in row:
+            report.reject(line, f"product {pid} does not exist and no product_name given")
+            continue
+
+        existing = variants.get(key)
+        if existing is None:
+            if "price" not in row or "stock" not in row:
+                report.reject(line, "new variant needs price and stock")
+                continue
+            variant_rows.append((pid, row["size"], row["color"], row["price"], row["stock"]))
+            counts["variants_inserted"] += 1
+            variant_changed = True
+        else:
+            price = row.get("price", existing["Price"])
+            stock = row.get("stock", existing["Stock"])
+            variant_changed = price != existing["Price"] or stock != existing["Stock"]
+            if variant_changed:
+                variant_rows.append((pid, existing["Size"], existing["Color"], price, stock))
+                counts["variants_updated"] += 1
+
+        # only accepted rows touch the product
+        base = product_rows.get(pid) or (
+            [current["Prod_Name"], current["Description"], current["CategoryID"], current["ImageURL"]]
+            if current else [None, None, None, None])
+        wanted = [row.get(f, base[i]) for i, f in enumerate(_PRODUCT_FIELDS)]
+        if current is None or wanted != [current["Prod_Name"], current["Description"],
+                                         current["CategoryID"], current["ImageURL"]]:
+            product_rows[pid] = wanted
+        elif not variant_changed and pid not in product_rows:
+            counts["unchanged"] += 1
+
+    counts["products_updated"] = sum(1 for pid in product_rows if pid in products)
+    counts["products_inserted"] = len(product_rows) - counts["products_updated"]
+
+    if dry_run:
+        conn.rollback()
+        _count(report, counts)
+        return
+    if product_rows:
+        sql, params = _multi_row(
+            "INSERT INTO Product", ["ProductID", "Prod_Name", "Description", "CategoryID", "ImageURL"],
+            [[pid] + values for pid, values in product_rows.items()],
+            ["Prod_Name", "Description", "CategoryID", "ImageURL"])
+        cursor.execute(sql, params)
+    if variant_rows:
+        sql, params = _multi_row(
+            "INSERT INTO ProductVariant", ["ProductID", "Size", "Color", "Price", "Stock"],
+            variant_rows, ["Price", "Stock"])
+        cursor.execute(sql, params)
+    conn.commit()
+    # counted only once the chunk is in; a failed chunk is reported as rejected instead
+    _count(report, counts)
+
+
+def _count(report, counts):
+    for name, n in counts.items():
+        setattr(report, name, getattr(report, name) + n)
+
+
+def ingest(stream, fmt="csv", chunk_size=INGEST_CHUNK_SIZE, dry_run=False, progress=None):
+    """Ingest a text stream of rows. Returns an IngestReport."""
+    report = IngestReport()
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT CategoryID FROM Category")
+        categories = {r["CategoryID"] for r in cursor.fetchall()}
+        conn.commit()
+
+        chunk = []
+        for line, raw in read_rows(stream, fmt):
+            report.rows += 1
+            try:
+                chunk.append((line, validate(raw, categories)))
+            except ValueError as e:
+                report.reject(line, str(e))
+                continue
+            if len(chunk) >= chunk_size:
+                _run_chunk(conn, cursor, chunk, report, dry_run)
+                chunk = []
+                if progress:
+                    progress(report)
+        if chunk:
+            _run_chunk(conn, cursor, chunk, report, dry_run)
+            if progress:
+                progress(report)
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+    metrics.incr("ingest.rows", report.rows)
+    metrics.incr("ingest.rejected", report.rejected)
+    return report
+
+
+def _run_chunk(conn, cursor, chunk, report, dry_run):
+    report.chunks += 1
+    try:
+        _apply_chunk(conn, cursor, chunk, report, dry_run)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        # a bad chunk is reported, the rest of the feed still goes in
+        for line, _ in chunk:
+            report.reject(line, f"chunk failed: {err}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk catalog/inventory ingest")
+    parser.add_argument("path", help="feed file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default=None)
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="validate and diff without writing")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    stream = (io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8") if args.path == "-"
+              else open(args.path, newline="", encoding="utf-8"))
+    with stream:
+        result = ingest(stream, fmt, args.chunk_size, args.dry_run,
+                        progress=lambda r: print(f"{r.rows} rows, {r.rejected} rejected", file=sys.stderr))
+    print(json.dumps(result.to_dict(), indent=2))
@@ -0,0 +1,15 @@
+# backend/metrics.py
+"""Process-local counters, exposed at /api/admin/metrics."""
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(float)
+_lock = threading.Lock()
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+def snapshot():
+    with _lock:
+        return {k: (int(v) if float(v).is_integer() else round(v, 6)) for k, v in sorted(_counters.items())}
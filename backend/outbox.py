@@ -0,0 +1,244 @@
+# backend/outbox.py
+"""
+Outbox dispatcher.
+
+Order and payment writes append OutboxEvent rows in their own transaction
+(triggers in retail_store.txt). This module drains them in the background:
+
+    @outbox.handler("order_placed")
+    def do_something(event): ...
+
+Events are fetched in batches in EventID order. Events of one OrderID are
+handed to handlers strictly in order, one at a time; different orders are
+dispatched in parallel on OUTBOX_WORKERS threads. A failing event is retried
+with exponential backoff and holds back the later events of its order; after
+OUTBOX_MAX_ATTEMPTS it is marked dead and the order moves on. Delivery is
+at-least-once, so handlers must be idempotent. Dispatched events older than
+OUTBOX_RETAIN_HOURS are deleted between batches, OUTBOX_PRUNE_BATCH at a time.
+
+A successful payment moves its order from Pending to Processing here
+(mark_order_processing), outside the payment's transaction.
+
+There is one dispatcher per database that writes events: DB_CONFIG, or
+each of the DB_SHARDS when sharding is on (orders live on the shards).
+Only one process runs a given database's dispatcher (MySQL GET_LOCK), so
+several app processes can call start(). It can also run on its own:
+    python outbox.py
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import (
+    DB_CONFIG, DB_SHARDS, OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_WORKERS,
+    OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_SECONDS, OUTBOX_RETAIN_HOURS, OUTBOX_PRUNE_BATCH,
+)
+from db import get_dedicated_connection
+from sharding import dedicated_shard_connection, order_connection
+
+_LOCK_NAME = "marketplace_outbox_dispatcher"
+_handlers = defaultdict(list)     # event type ("*" = every event) -> [fn(event)]
+
+
+def handler(event_type):
+    """Register fn(event) for an event type; event is a dict with EventID, OrderID, EventType, Payload."""
+    def register(fn):
+        _handlers[event_type].append(fn)
+        return fn
+    return register
+
+
+def _handlers_for(event_type):
+    return _handlers.get(event_type, []) + _handlers.get("*", [])
+
+
+class Dispatcher:
+    def __init__(self, connect, lock_name):
+        self._connect = connect             # () -> unpooled connection to the database to drain
+        self._lock_name = lock_name
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox")
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                cursor = conn.cursor()
+                # only one dispatcher per database; others keep polling for the lock
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (self._lock_name,))
+                if cursor.fetchone()[0] == 1:
+                    cursor.close()
+                    while True:
+                        if not self.dispatch_batch(conn):
+                            self.prune(conn)
+                            time.sleep(OUTBOX_POLL_SECONDS)
+                cursor.close()
+            except Exception as e:
+                print(f"Outbox dispatcher error ({self._lock_name}):", e)
+            finally:
+                if conn:
+                    try:
+                        conn.close()    # also releases the named lock
+                    except Exception:
+                        pass
+            time.sleep(OUTBOX_POLL_SECONDS)
+
+    # ---------------- one batch ----------------
+    def dispatch_batch(self, conn):
+        """Dispatch up to OUTBOX_BATCH_SIZE pending events. Returns the number handled."""
+        cursor = conn.cursor(dictionary=True)
+        try:
+            # due events, minus those queued behind an earlier event of the same order
+            # that is still waiting for its retry
+            cursor.execute("""
+                SELECT e.EventID, e.OrderID, e.EventType, e.Payload, e.Attempts
+                FROM OutboxEvent e
+                WHERE e.DispatchedAt IS NULL AND e.DeadAt IS NULL
+                  AND (e.NextAttemptAt IS NULL OR e.NextAttemptAt <= NOW())
+                  AND NOT EXISTS (
+                      SELECT 1 FROM OutboxEvent b
+                      WHERE b.OrderID = e.OrderID AND b.EventID < e.EventID
+                        AND b.DispatchedAt IS NULL AND b.DeadAt IS NULL
+                        AND b.NextAttemptAt > NOW()
+                  )
+                ORDER BY e.EventID
+                LIMIT %s
+            """, (OUTBOX_BATCH_SIZE,))
+            events = cursor.fetchall()
+            conn.commit()
+            if not events:
+                return 0
+
+            by_order = OrderedDict()
+            for e in events:
+                by_order.setdefault(e["OrderID"], []).append(e)
+            outcomes = self._pool.map(self._dispatch_order, by_order.values())
+
+            done, failed, dead = [], [], []
+            for order_done, order_failed in outcomes:
+                done.extend(order_done)
+                if order_failed:
+                    event, error = order_failed
+                    (dead if event["Attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS else failed).append((event, error))
+
+            if done:
+                placeholders = ",".join(["%s"] * len(done))
+                cursor.execute(f"UPDATE OutboxEvent SET DispatchedAt = NOW() WHERE EventID IN ({placeholders})",
+                               done)
+            for event, error in failed:
+                delay = OUTBOX_RETRY_BASE_SECONDS * (2 ** event["Attempts"])
+                cursor.execute("""
+                    UPDATE OutboxEvent
+                    SET Attempts = Attempts + 1, LastError = %s,
+                        NextAttemptAt = NOW() + INTERVAL %s SECOND
+                    WHERE EventID = %s
+                """, (error[:255], int(delay), event["EventID"]))
+            for event, error in dead:
+                cursor.execute("""
+                    UPDATE OutboxEvent SET Attempts = Attempts + 1, LastError = %s, DeadAt = NOW()
+                    WHERE EventID = %s
+                """, (error[:255], event["EventID"]))
+                print(f"Outbox event {event['EventID']} ({event['EventType']}) gave up: {error}")
+            conn.commit()
+
+            metrics.incr("outbox.dispatched", len(done))
+            metrics.incr("outbox.retried", len(failed))
+            metrics.incr("outbox.dead", len(dead))
+            return len(done)
+        finally:
+            cursor.close()
+
+    def prune(self, conn):
+        """Delete up to OUTBOX_PRUNE_BATCH dispatched events older than OUTBOX_RETAIN_HOURS."""
+        if OUTBOX_RETAIN_HOURS <= 0:
+            return 0
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                DELETE FROM OutboxEvent
+                WHERE DispatchedAt < NOW() - INTERVAL %s SECOND
+                ORDER BY DispatchedAt
+                LIMIT %s
+            """, (int(OUTBOX_RETAIN_HOURS * 3600), OUTBOX_PRUNE_BATCH))
+            pruned = cursor.rowcount
+            conn.commit()
+            metrics.incr("outbox.pruned", pruned)
+            return pruned
+        finally:
+            cursor.close()
+
+    def _dispatch_order(self, events):
+        """Run one order's events in order; stop at the first that fails."""
+        done = []
+        for event in events:
+            payload = event["Payload"]
+            if isinstance(payload, (bytes, str)):
+                payload = json.loads(payload)
+            message = {"EventID": event["EventID"], "OrderID": event["OrderID"],
+                       "EventType": event["EventType"], "Payload": payload or {}}
+            try:
+                for fn in _handlers_for(event["EventType"]):
+                    fn(message)
+            except Exception as e:
+                return done, (event, f"{type(e).__name__}: {e}")
+            done.append(event["EventID"])
+        return done, None
+
+
+# ---------------- handlers ----------------
+@handler("payment_recorded")
+def mark_order_processing(event):
+    """A successful payment moves a Pending order to Processing; a redelivery or an
+    order that has moved on since is left alone."""
+    if event["Payload"].get("Status") != "Success":
+        return
+    conn = order_connection(event["OrderID"])
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE Orders SET Status = 'Processing' WHERE OrderID = %s AND Status = 'Pending'",
+                       (event["OrderID"],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _lock_name(config):
+    # shards may share a MySQL server, and GET_LOCK names are server-wide
+    return f"{_LOCK_NAME}:{config['database']}"
+
+
+if DB_SHARDS:
+    dispatchers = [Dispatcher(lambda s=s: dedicated_shard_connection(s), _lock_name(DB_SHARDS[s]))
+                   for s in sorted(DB_SHARDS)]
+else:
+    dispatchers = [Dispatcher(get_dedicated_connection, _lock_name(DB_CONFIG))]
+
+
+def start():
+    for d in dispatchers:
+        d.start()
+
+
+if __name__ == "__main__":
+    print(f"outbox dispatcher running for {len(dispatchers)} database(s) (Ctrl+C to stop)")
+    start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
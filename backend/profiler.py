@@ -0,0 +1,254 @@
+# backend/profiler.py
+"""
+On-demand sampling profiler for individual requests.
+
+A request is profiled when it carries PROFILE_HEADER matching PROFILE_TOKEN,
+or at random with probability PROFILE_SAMPLE_RATE. While at least one request
+is being profiled, a sampler thread reads that request thread's stack every
+PROFILE_INTERVAL_MS (sys._current_frames) and DB connections opened by it are
+wrapped to time every execute/callproc/fetch. Nothing is wrapped or sampled
+otherwise; the only cost when disabled is one header lookup per request.
+
+Each profile is written to PROFILE_DIR as
+    <id>.folded   collapsed stacks ("frame;frame;frame count"), for
+                  flamegraph.pl or speedscope
+    <id>.json     route, status, duration and the DB call timings
+and only the newest PROFILE_MAX_FILES profiles are kept.
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+import metrics
+from admission import is_internal
+from config import PROFILE_DIR, PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILE_MAX_FILES
+
+PROFILE_HEADER = "X-Profile-Token"
+INTERNAL_PROFILE_HEADER = "X-Profile"
+
+
+class Profile:
+    def __init__(self, thread_id, route):
+        self.thread_id = thread_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.db_calls = []      # (operation, statement, ms)
+
+
+_active = {}        # thread ident -> Profile
+_active_lock = threading.Lock()
+_wakeup = threading.Event()
+_sampler = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _sample_loop():
+    interval = PROFILE_INTERVAL_MS / 1000.0
+    while True:
+        _wakeup.wait()
+        with _active_lock:
+            profiles = list(_active.values())
+        if not profiles:
+            _wakeup.clear()
+            continue
+        frames = sys._current_frames()
+        for profile in profiles:
+            frame = frames.get(profile.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                profile.stacks[";".join(reversed(stack))] += 1
+                profile.samples += 1
+        del frames
+        time.sleep(interval)
+
+
+def current():
+    """The Profile of the current thread's request, or None."""
+    if not _active:
+        return None
+    return _active.get(threading.get_ident())
+
+
+# ---------------- DB call timing ----------------
+class _TimedCursor:
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+
+    def _timed(self, op, statement, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._profile.db_calls.append(
+                (op, (statement or "")[:300], round((time.perf_counter() - started) * 1000, 3)))
+
+    def execute(self, operation, params=None, multi=False):
+        if multi:
+            return self._timed_iter(operation, params)
+        return self._timed("execute", " ".join(operation.split()), self._cursor.execute, operation, params)
+
+    def _timed_iter(self, operation, params):
+        # a multi-statement batch is only finished once its results are consumed
+        started = time.perf_counter()
+        try:
+            yield from self._cursor.execute(operation, params, multi=True)
+        finally:
+            self._profile.db_calls.append(
+                ("execute_multi", " ".join(operation.split())[:300],
+                 round((time.perf_counter() - started) * 1000, 3)))
+
+    def callproc(self, procname, args=()):
+        return self._timed("callproc", procname, self._cursor.callproc, procname, args)
+
+    def fetchall(self):
+        return self._timed("fetchall", None, self._cursor.fetchall)
+
+    def fetchone(self):
+        return self._timed("fetchone", None, self._cursor.fetchone)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedConnection:
+    def __init__(self, conn, profile):
+        self._conn = conn
+        self._profile = profile
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._conn.cursor(*args, **kwargs), self._profile)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return self._conn.commit()
+        finally:
+            self._profile.db_calls.append(("commit", None, round((time.perf_counter() - started) * 1000, 3)))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument(conn):
+    """Wrap a new DB connection for timing if this request is being profiled."""
+    profile = current()
+    return _TimedConnection(conn, profile) if profile is not None else conn
+
+
+def propagate():
+    """Header asking a loopback /api call to profile itself too."""
+    return {INTERNAL_PROFILE_HEADER: "1"} if current() is not None else {}
+
+
+# ---------------- Flask hooks ----------------
+def _wanted():
+    if PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        return True
+    if request.headers.get(INTERNAL_PROFILE_HEADER) and is_internal():
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start():
+    global _sampler
+    route = request.url_rule.rule if request.url_rule else request.path
+    profile = Profile(threading.get_ident(), f"{request.method} {route}")
+    with _active_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, daemon=True)
+            _sampler.start()
+        _active[profile.thread_id] = profile
+    _wakeup.set()
+    g.profile = profile
+
+
+def _before_request():
+    if request.path.startswith("/static/") or not _wanted():
+        return
+    _start()
+
+
+def _after_request(response):
+    profile = g.get("profile")
+    if profile is None:
+        return response
+    _stop(profile)
+    try:
+        profile_id = _write(profile, response.status_code)
+        response.headers["X-Profile-Id"] = profile_id
+        metrics.incr("profiler.profiles")
+    except OSError as e:
+        print("Profiler could not write profile:", e)
+    return response
+
+
+def _teardown_request(exc):
+    profile = g.get("profile")
+    if profile is not None:
+        _stop(profile)
+
+
+def _stop(profile):
+    with _active_lock:
+        if _active.get(profile.thread_id) is profile:
+            del _active[profile.thread_id]
+
+
+def _write(profile, status):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    elapsed_ms = (time.perf_counter() - profile.started) * 1000
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", profile.route).strip("_")[:60]
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{slug}-{int(elapsed_ms)}ms"
+    base = os.path.join(PROFILE_DIR, profile_id)
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    db_ms = sum(ms for _, _, ms in profile.db_calls)
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump({
+            "route": profile.route,
+            "status": status,
+            "elapsed_ms": round(elapsed_ms, 3),
+            "samples": profile.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "db_ms": round(db_ms, 3),
+            "db_calls": [{"op": op, "statement": stmt, "ms": ms} for op, stmt, ms in profile.db_calls],
+        }, f, indent=2)
+    _enforce_retention()
+    return profile_id
+
+
+def _enforce_retention():
+    names = sorted(n[:-len(".json")] for n in os.listdir(PROFILE_DIR) if n.endswith(".json"))
+    for old in names[:max(0, len(names) - PROFILE_MAX_FILES)]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old + ext))
+            except FileNotFoundError:
+                pass
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,307 @@
+# backend/recommendations.py
+"""
+Item-to-item co-purchase recommendations served from memory.
+
+The co-occurrence matrix is aggregated set-based in MySQL (one self-join over
+OrderDetails, plus optional per-customer view/wishlist co-occurrence) and kept
+here as a sparse dict-of-dicts. Each variant's strongest neighbours are
+precomputed, so serving a customer is a merge of a few short lists.
+
+Every process keeps its own matrix, so every process folds new orders in
+itself: a follower thread tails the order_placed rows of OutboxEvent on each
+shard from its own position (independent of the outbox dispatcher). The
+build records, in the same read snapshot as the matrix, which events it
+already covers; the follower then re-reads the last REC_EVENT_WINDOW
+EventIDs each pass and folds only the ones it has not applied, so late
+commits are picked up and no order is counted twice.
+"""
+import threading
+import time
+from collections import defaultdict
+from heapq import nlargest
+
+from config import (
+    REC_TOP_K, REC_NEIGHBOURS, REC_REBUILD_SECONDS,
+    REC_VIEW_WEIGHT, REC_WISHLIST_WEIGHT, REC_FOLLOW_SECONDS, REC_EVENT_WINDOW, DB_SHARDS,
+)
+from db import get_db_connection
+from sharding import each_customer_shard
+
+# pairs of variants bought in the same (non-cancelled) order
+_ORDER_PAIRS_SQL = """
+    SELECT a.VariantID AS v1, b.VariantID AS v2, COUNT(*) AS n
+    FROM OrderDetails a
+    JOIN OrderDetails b ON a.OrderID = b.OrderID AND a.VariantID <> b.VariantID
+    JOIN Orders o ON o.OrderID = a.OrderID
+    WHERE o.Status <> 'Cancelled'
+    GROUP BY a.VariantID, b.VariantID
+"""
+
+# pairs of variants touched by the same customer (views / wishlist)
+_CUSTOMER_PAIRS_SQL = """
+    SELECT a.VariantID AS v1, b.VariantID AS v2, COUNT(*) AS n
+    FROM {table} a
+    JOIN {table} b ON a.CustomerID = b.CustomerID AND a.VariantID <> b.VariantID
+    GROUP BY a.VariantID, b.VariantID
+"""
+
+_BOUGHT_SQL = """
+    SELECT DISTINCT o.CustomerID, od.VariantID
+    FROM Orders o
+    JOIN OrderDetails od ON o.OrderID = od.OrderID
+    WHERE o.Status <> 'Cancelled'
+"""
+
+_POPULAR_SQL = """
+    SELECT od.VariantID, SUM(od.Quantity) AS qty
+    FROM OrderDetails od
+    JOIN Orders o ON o.OrderID = od.OrderID
+    WHERE o.Status <> 'Cancelled'
+    GROUP BY od.VariantID
+    ORDER BY qty DESC
+    LIMIT %s
+"""
+
+_ORDER_LINES_SQL = """
+    SELECT o.OrderID, o.CustomerID, od.VariantID
+    FROM Orders o
+    JOIN OrderDetails od ON o.OrderID = od.OrderID
+    WHERE o.OrderID IN ({ids}) AND o.Status <> 'Cancelled'
+"""
+
+_VARIANT_INFO_SQL = """
+    SELECT v.VariantID, p.Prod_Name AS ProductName,
+           CONCAT(v.Size, '/', v.Color) AS Variant, v.Price
+    FROM ProductVariant v
+    JOIN Product p ON v.ProductID = p.ProductID
+"""
+
+
+class _EventPosition:
+    """order_placed events of one shard already in the matrix: the highest EventID
+    plus the applied IDs in the REC_EVENT_WINDOW below it."""
+
+    def __init__(self, hwm, applied):
+        self.hwm = hwm
+        self.applied = applied
+
+    @classmethod
+    def current(cls, cursor):
+        cursor.execute("SELECT COALESCE(MAX(EventID), 0) AS hwm FROM OutboxEvent")
+        hwm = int(cursor.fetchone()["hwm"])
+        cursor.execute("""
+            SELECT EventID FROM OutboxEvent WHERE EventType = 'order_placed' AND EventID > %s
+        """, (hwm - REC_EVENT_WINDOW,))
+        return cls(hwm, {r["EventID"] for r in cursor.fetchall()})
+
+    def read(self, cursor):
+        """(new EventIDs, their OrderIDs) since this position, late commits in the window included."""
+        cursor.execute("""
+            SELECT EventID, OrderID FROM OutboxEvent
+            WHERE EventType = 'order_placed' AND EventID > %s
+            ORDER BY EventID
+        """, (self.hwm - REC_EVENT_WINDOW,))
+        rows = [r for r in cursor.fetchall() if r["EventID"] not in self.applied]
+        return [r["EventID"] for r in rows], sorted({r["OrderID"] for r in rows})
+
+    def mark(self, event_ids):
+        if not event_ids:
+            return
+        self.applied.update(event_ids)
+        self.hwm = max(self.hwm, max(event_ids))
+        low = self.hwm - REC_EVENT_WINDOW
+        self.applied = {e for e in self.applied if e > low}
+
+
+class CoPurchaseRecommender:
+    def __init__(self, neighbours=REC_NEIGHBOURS):
+        self.neighbours = neighbours
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._built_at = None
+        self._cooc = {}        # VariantID -> {VariantID: weight}
+        self._top = {}         # VariantID -> [(VariantID, weight), ...] best first
+        self._bought = {}      # CustomerID -> set(VariantID)
+        self._popular = []     # [(VariantID, weight), ...] fallback for new customers
+        self._info = {}        # VariantID -> display row
+        self._events = None    # shard -> _EventPosition of the order_placed events folded in
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # ---------- building ----------
+    def build(self):
+        """Rebuild the whole matrix from the database and swap it in."""
+        cooc = defaultdict(lambda: defaultdict(float))
+        bought = defaultdict(set)
+        sold = defaultdict(float)
+        events = {}
+        # a customer's rows are all on one shard, so per-shard counts just add up
+        for shard, shard_conn in zip(sorted(DB_SHARDS) or [None], each_customer_shard()):
+            cursor = shard_conn.cursor(dictionary=True)
+            try:
+                # one read snapshot per shard, so the event position matches the counts
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                events[shard] = _EventPosition.current(cursor)
+                cursor.execute(_ORDER_PAIRS_SQL)
+                for r in cursor.fetchall():
+                    cooc[r["v1"]][r["v2"]] += float(r["n"])
+
+                for table, weight in (("ProductViewHistory", REC_VIEW_WEIGHT),
+                                      ("Wishlist", REC_WISHLIST_WEIGHT)):
+                    if weight <= 0:
+                        continue
+                    cursor.execute(_CUSTOMER_PAIRS_SQL.format(table=table))
+                    for r in cursor.fetchall():
+                        cooc[r["v1"]][r["v2"]] += weight * float(r["n"])
+
+                cursor.execute(_BOUGHT_SQL)
+                for r in cursor.fetchall():
+                    bought[r["CustomerID"]].add(r["VariantID"])
+
+                # each shard's best sellers; merged below (approximate with several shards)
+                cursor.execute(_POPULAR_SQL, (self.neighbours,))
+                for r in cursor.fetchall():
+                    sold[r["VariantID"]] += float(r["qty"])
+                shard_conn.commit()
+            finally:
+                cursor.close()
+        popular = sorted(sold.items(), key=lambda item: -item[1])[:self.neighbours]
+
+        conn = None
+        cursor = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(_VARIANT_INFO_SQL)
+            info = {}
+            for r in cursor.fetchall():
+                r["Price"] = float(r["Price"])
+                info[r["VariantID"]] = r
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+        cooc = {v: dict(row) for v, row in cooc.items()}
+        top = {v: self._rank(row) for v, row in cooc.items()}
+        with self._lock:
+            self._cooc = cooc
+            self._top = top
+            self._bought = dict(bought)
+            self._popular = popular
+            self._info = info
+            self._events = events
+            self._built_at = time.time()
+
+    @property
+    def ready(self):
+        return self._built_at is not None
+
+    def ensure_fresh(self):
+        """Build in the background on first use and once stale; never blocks the caller."""
+        if self._built_at is not None and time.time() - self._built_at < REC_REBUILD_SECONDS:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_build, daemon=True).start()
+
+    def _background_build(self):
+        try:
+            self.build()
+        except Exception as e:
+            print("Recommendation rebuild failed:", e)
+        finally:
+            self._rebuilding = False
+
+    def _rank(self, row):
+        return nlargest(self.neighbours, row.items(), key=lambda kv: kv[1])
+
+    # ---------- incremental updates ----------
+    def start(self):
+        """Start following new orders; nothing is read before the first build."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._follow_loop, daemon=True)
+                self._thread.start()
+
+    def _follow_loop(self):
+        while True:
+            try:
+                self.follow()
+            except Exception as e:
+                print("Recommendation follower error:", e)
+            time.sleep(REC_FOLLOW_SECONDS)
+
+    def follow(self):
+        """Fold order_placed events not applied yet. Returns the number of orders folded."""
+        events = self._events
+        if events is None:
+            return 0
+        folded = 0
+        for shard, shard_conn in zip(sorted(DB_SHARDS) or [None], each_customer_shard()):
+            position = events.get(shard)
+            if position is None:
+                continue
+            cursor = shard_conn.cursor(dictionary=True)
+            try:
+                new_ids, order_ids = position.read(cursor)
+                orders = {}         # OrderID -> (CustomerID, {VariantID})
+                if order_ids:
+                    cursor.execute(_ORDER_LINES_SQL.format(ids=",".join(["%s"] * len(order_ids))), order_ids)
+                    for r in cursor.fetchall():
+                        orders.setdefault(r["OrderID"], (r["CustomerID"], set()))[1].add(r["VariantID"])
+                shard_conn.commit()
+            finally:
+                cursor.close()
+            with self._lock:
+                if self._events is not events:
+                    return folded           # a rebuild swapped in a matrix that already has them
+                for cust_id, variant_ids in orders.values():
+                    self._fold(cust_id, variant_ids)
+                position.mark(new_ids)
+            folded += len(orders)
+        return folded
+
+    def _fold(self, cust_id, variant_ids):
+        if not variant_ids:
+            return
+        for v1 in variant_ids:
+            row = self._cooc.setdefault(v1, {})
+            for v2 in variant_ids:
+                if v1 != v2:
+                    row[v2] = row.get(v2, 0.0) + 1.0
+            self._top[v1] = self._rank(row)
+        self._bought.setdefault(cust_id, set()).update(variant_ids)
+
+    # ---------- serving ----------
+    def recommend(self, cust_id, k=REC_TOP_K):
+        """Top-k variants the customer has not bought, best first."""
+        with self._lock:
+            bought = self._bought.get(cust_id, set())
+            scores = defaultdict(float)
+            for v in bought:
+                for other, weight in self._top.get(v, ()):
+                    if other not in bought:
+                        scores[other] += weight
+            best = nlargest(k, scores.items(), key=lambda kv: kv[1])
+            if len(best) < k:
+                seen = bought | {v for v, _ in best}
+                for v, weight in self._popular:
+                    if len(best) >= k:
+                        break
+                    if v not in seen:
+                        best.append((v, 0.0))
+            info = self._info
+
+        results = []
+        for v, score in best:
+            row = dict(info.get(v) or {"VariantID": v})
+            row["Score"] = round(score, 4)
+            results.append(row)
+        return results
+
+
+recommender = CoPurchaseRecommender()
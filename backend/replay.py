@@ -0,0 +1,249 @@
+# backend/replay.py
+"""
+Replay captured traffic (capture.py) against a build and compare builds.
+
+Requests are issued open-loop at their original start offsets divided by
+--speed, so the original concurrency and mix are reproduced (1x) or
+compressed (Nx). Customer pseudonyms from the trace are mapped onto test
+customers; page requests get a signed session cookie for that customer, so
+no passwords are needed. Redacted fields are sent as-is, so login/register
+requests are expected to fail and are skipped unless --include-auth is given.
+
+Every request carries admission.REPLAY_HEADER, signed with --secret-key.
+All replayed customers share one address, so start the target with
+ADMISSION_REPLAY_BYPASS=1, or the per-client rate limit answers most of them
+with 429. 429 (rate limited) and 503 (shed) responses count as errors and are
+also reported on their own.
+
+Usage (from the backend directory):
+    python replay.py run traces.jsonl --target http://127.0.0.1:5000 --speed 2 \
+        --customers 1-50 --out baseline.json
+    python replay.py compare baseline.json candidate.json
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from admission import REPLAY_HEADER, internal_token
+
+_RULE_ARG = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+
+def load_traces(path):
+    with open(path, encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    traces.sort(key=lambda t: t["ts"])
+    return traces
+
+
+def parse_customers(spec):
+    """'1-50' or '3,7,9' -> list of CustomerIDs."""
+    ids = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        ids.extend(range(int(lo), int(hi or lo) + 1))
+    return ids
+
+
+class CustomerMap:
+    """Assigns trace pseudonyms to test customers round-robin, stable per pseudonym."""
+
+    def __init__(self, customers):
+        self.customers = customers
+        self._assigned = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, alias):
+        if alias is None:
+            return None
+        with self._lock:
+            if alias not in self._assigned:
+                self._assigned[alias] = self.customers[len(self._assigned) % len(self.customers)]
+            return self._assigned[alias]
+
+
+def _unalias(data, customer_of):
+    if isinstance(data, dict):
+        return {k: (customer_of(v) if str(k).lower() in ("cust_id", "user_id", "customer_id")
+                    and isinstance(v, str) and v.startswith("c") else _unalias(v, customer_of))
+                for k, v in data.items()}
+    if isinstance(data, list):
+        return [_unalias(v, customer_of) for v in data]
+    return data
+
+
+def build_request(trace, customer_of):
+    """(method, path, kwargs, customer) for one trace, or None if it can't be replayed."""
+    if trace.get("rule") is None:
+        return None
+    args = _unalias(trace.get("args") or {}, customer_of)
+    path = _RULE_ARG.sub(lambda m: str(args.get(m.group(1), "")), trace["rule"])
+    kwargs = {"params": _unalias(trace.get("query") or {}, customer_of)}
+    if trace.get("json") is not None:
+        kwargs["json"] = _unalias(trace["json"], customer_of)
+    elif trace.get("form"):
+        kwargs["data"] = _unalias(trace["form"], customer_of)
+    return trace["method"], path, kwargs, customer_of(trace.get("customer"))
+
+
+class Replayer:
+    def __init__(self, target, secret_key, customers, timeout=30):
+        self.target = target.rstrip("/")
+        self.timeout = timeout
+        self.customer_of = CustomerMap(customers)
+        app = Flask("replay")
+        app.secret_key = secret_key
+        self._signer = SecureCookieSessionInterface().get_signing_serializer(app)
+        self._headers = {REPLAY_HEADER: internal_token(secret_key, "replay")}
+        self._local = threading.local()
+        self.results = []
+        self._results_lock = threading.Lock()
+
+    def _session(self):
+        # one HTTP connection pool per worker thread
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+        return s
+
+    def _cookies(self, cust_id):
+        if cust_id is None:
+            return None
+        return {"session": self._signer.dumps({"user": {"CustomerID": cust_id}})}
+
+    def _issue(self, trace, built, scheduled):
+        method, path, kwargs, cust_id = built
+        lag = time.monotonic() - scheduled
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            resp = self._session().request(method, self.target + path, cookies=self._cookies(cust_id),
+                                           headers=self._headers, timeout=self.timeout,
+                                           allow_redirects=False, **kwargs)
+            status = resp.status_code
+        except requests.RequestException as e:
+            error = type(e).__name__
+        result = {
+            "rule": f"{method} {trace['rule']}",
+            "status": status,
+            "error": error,
+            "ms": round((time.perf_counter() - started) * 1000, 3),
+            "captured_ms": trace.get("ms"),
+            "captured_status": trace.get("status"),
+            "schedule_lag_ms": round(lag * 1000, 3),
+        }
+        with self._results_lock:
+            self.results.append(result)
+
+    def run(self, traces, speed=1.0, max_workers=64, include_auth=False):
+        if not traces:
+            return []
+        t0 = traces[0]["ts"]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for trace in traces:
+                if not include_auth and (trace.get("rule") or "").startswith(("/auth/", "/api/auth/")):
+                    continue
+                built = build_request(trace, self.customer_of)
+                if built is None:
+                    continue
+                scheduled = start + (trace["ts"] - t0) / speed
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._issue, trace, built, scheduled)
+        return self.results
+
+
+# ---------------- Reporting ----------------
+def _is_error(r):
+    # fast 429/503 rejections would otherwise flatter the latency numbers
+    return bool(r["error"]) or (r["status"] or 0) >= 500 or r["status"] == 429
+
+
+def summarize(results):
+    """Per route: count, error rate (429 and 503 counted also separately) and latency percentiles (ms)."""
+    by_rule = defaultdict(list)
+    for r in results:
+        by_rule[r["rule"]].append(r)
+        by_rule["ALL"].append(r)
+    summary = {}
+    for rule, rows in by_rule.items():
+        ms = np.array([r["ms"] for r in rows])
+        errors = sum(1 for r in rows if _is_error(r))
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        summary[rule] = {"count": len(rows), "error_rate": round(errors / len(rows), 4),
+                         "rate_limited": sum(1 for r in rows if r["status"] == 429),
+                         "shed": sum(1 for r in rows if r["status"] == 503),
+                         "p50": round(float(p50), 1), "p95": round(float(p95), 1),
+                         "p99": round(float(p99), 1), "max": round(float(ms.max()), 1)}
+    return summary
+
+
+def print_summary(summary, out=sys.stdout):
+    print(f"{'route':50} {'n':>6} {'err%':>6} {'429':>5} {'503':>5} {'p50':>8} {'p95':>8} {'p99':>8}", file=out)
+    for rule, s in sorted(summary.items(), key=lambda kv: -kv[1]["count"]):
+        print(f"{rule[:50]:50} {s['count']:6d} {s['error_rate'] * 100:6.2f} {s['rate_limited']:5d} {s['shed']:5d} "
+              f"{s['p50']:8.1f} {s['p95']:8.1f} {s['p99']:8.1f}", file=out)
+
+
+def compare(base, cand, out=sys.stdout):
+    """Side-by-side p50/p95/p99 and error rates; returns routes whose p95 regressed >10%."""
+    regressions = []
+    print(f"{'route':50} {'p50 a->b':>16} {'p95 a->b':>16} {'p99 a->b':>16} {'err% a->b':>14}", file=out)
+    for rule in sorted(set(base) | set(cand), key=lambda r: -(base.get(r) or cand[r])["count"]):
+        a, b = base.get(rule), cand.get(rule)
+        if not a or not b:
+            print(f"{rule[:50]:50} only in {'candidate' if b else 'baseline'}", file=out)
+            continue
+        cells = " ".join(f"{a[k]:7.1f}->{b[k]:<7.1f}" for k in ("p50", "p95", "p99"))
+        print(f"{rule[:50]:50} {cells} {a['error_rate'] * 100:5.2f}->{b['error_rate'] * 100:<6.2f}", file=out)
+        if b["p95"] > a["p95"] * 1.1 or b["error_rate"] > a["error_rate"]:
+            regressions.append(rule)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured traffic and compare builds")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="replay a trace file against a target")
+    run_p.add_argument("traces")
+    run_p.add_argument("--target", default="http://127.0.0.1:5000")
+    run_p.add_argument("--speed", type=float, default=1.0, help="1 = original pace, 4 = four times faster")
+    run_p.add_argument("--customers", default="1-10", help="test CustomerIDs, e.g. 1-50 or 3,7,9")
+    run_p.add_argument("--secret-key", default="supersecretkey", help="target app's secret_key (for session cookies)")
+    run_p.add_argument("--max-workers", type=int, default=64)
+    run_p.add_argument("--include-auth", action="store_true")
+    run_p.add_argument("--out", required=True, help="write per-request results here (JSON)")
+
+    cmp_p = sub.add_parser("compare", help="compare two result files")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        replayer = Replayer(args.target, args.secret_key, parse_customers(args.customers))
+        results = replayer.run(load_traces(args.traces), args.speed, args.max_workers, args.include_auth)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        print_summary(summarize(results))
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = summarize(json.load(f))
+        with open(args.candidate, encoding="utf-8") as f:
+            cand = summarize(json.load(f))
+        regressed = compare(base, cand)
+        if regressed:
+            print(f"\n{len(regressed)} route(s) regressed (p95 +10% or more errors): {', '.join(regressed)}")
+            sys.exit(1)
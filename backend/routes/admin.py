@@ -0,0 +1,128 @@
+# routes/admin.py
+from flask import Blueprint, jsonify, request
+from sharding import each_customer_shard
+from config import ADMIN_TOKEN
+from functools import wraps
+import csv
+import hmac
+import io
+import mysql.connector
+
+import bulk_ops
+import ingest
+import metrics
+from admission import _LOOPBACK
+
+admin_bp = Blueprint("admin", __name__)
+
+ADMIN_HEADER = "X-Admin-Token"
+
+def admin_required(view):
+    """ADMIN_TOKEN in X-Admin-Token, or a loopback caller when no token is configured."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if ADMIN_TOKEN:
+            allowed = hmac.compare_digest(request.headers.get(ADMIN_HEADER, ""), ADMIN_TOKEN)
+        else:
+            allowed = request.remote_addr in _LOOPBACK
+        if not allowed:
+            metrics.incr("admin.denied")
+            return jsonify({"success": False, "error": "admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def _start_bulk(kind, id_field, select_fn):
+    payload = request.get_json(force=True, silent=True) or {}
+    ids = payload.get(id_field)
+    variant_id = payload.get("variant_id")
+    from_date = payload.get("from_date")
+    to_date = payload.get("to_date")
+
+    if ids is None and variant_id is None and not from_date and not to_date:
+        return jsonify({"success": False, "error": f"{id_field} or a variant_id/from_date/to_date filter is required"}), 400
+
+    try:
+        if ids is None:
+            ids = []
+            for conn in each_customer_shard():
+                cursor = conn.cursor()
+                try:
+                    ids += select_fn(cursor, variant_id, from_date, to_date)
+                finally:
+                    cursor.close()
+        job = bulk_ops.start_job(kind, ids)
+        return jsonify({"success": True, "data": job.to_dict()}), 202
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": f"{id_field} must be a list of integers"}), 400
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route("/admin/bulk/cancel", methods=["POST"])
+@admin_required
+def bulk_cancel():
+    """
+    POST /api/admin/bulk/cancel
+    JSON body: { "order_ids": [101, 102] }
+           or: { "variant_id": 3, "from_date": "2025-10-01", "to_date": "2025-10-31" }
+    Starts a background job; poll /api/admin/bulk/jobs/<job_id> for progress.
+    """
+    return _start_bulk("cancel", "order_ids", bulk_ops.select_order_ids)
+
+
+@admin_bp.route("/admin/bulk/refund", methods=["POST"])
+@admin_required
+def bulk_refund():
+    """
+    POST /api/admin/bulk/refund
+    JSON body: { "payment_ids": [1001, 1002] }
+           or: { "variant_id": 3, "from_date": "2025-10-01", "to_date": "2025-10-31" }
+    """
+    return _start_bulk("refund", "payment_ids", bulk_ops.select_payment_ids)
+
+
+@admin_bp.route("/admin/bulk/jobs/<int:job_id>", methods=["GET"])
+@admin_required
+def bulk_job_status(job_id):
+    job = bulk_ops.get_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "data": job.to_dict()}), 200
+
+
+@admin_bp.route("/admin/ingest", methods=["POST"])
+@admin_required
+def ingest_feed():
+    """
+    POST /api/admin/ingest?format=csv|ndjson&dry_run=1
+    Raw CSV (with header) or NDJSON body, read as a stream. Returns counts,
+    throughput and the first rejected rows. Large nightly feeds are better run
+    with `python ingest.py feed.csv`.
+    """
+    fmt = request.args.get("format") or ("ndjson" if "json" in (request.content_type or "") else "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"success": False, "error": "format must be csv or ndjson"}), 400
+    dry_run = request.args.get("dry_run") == "1"
+
+    try:
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        report = ingest.ingest(stream, fmt, dry_run=dry_run)
+        return jsonify({"success": True, "data": report.to_dict()}), 200
+    except UnicodeDecodeError:
+        return jsonify({"success": False, "error": "feed must be UTF-8"}), 400
+    except (csv.Error, mysql.connector.Error) as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route("/admin/metrics", methods=["GET"])
+@admin_required
+def get_metrics():
+    """
+    GET /api/admin/metrics
+    Process-local counters (e.g. singleflight.<name>.saved = DB calls avoided).
+    """
+    return jsonify({"success": True, "data": metrics.snapshot()}), 200
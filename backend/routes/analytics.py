@@ -0,0 +1,55 @@
+# routes/analytics.py
+from datetime import date
+
+from flask import Blueprint, jsonify, request
+
+from analytics import sales
+
+analytics_bp = Blueprint("analytics", __name__)
+
+def _date_range():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD (both optional, inclusive)."""
+    start = request.args.get("from")
+    end = request.args.get("to")
+    return (date.fromisoformat(start) if start else None,
+            date.fromisoformat(end) if end else None)
+
+def _report(fn):
+    """Run a report against the in-memory snapshot; never queries MySQL."""
+    sales.start()
+    if not sales.ready:
+        return jsonify({"success": False, "error": "analytics snapshot is still loading"}), 503
+    try:
+        start, end = _date_range()
+        return jsonify({"success": True, "data": fn(start, end), "snapshot": sales.info()}), 200
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"bad parameter: {e}"}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@analytics_bp.route("/analytics/revenue-by-day", methods=["GET"])
+def revenue_by_day():
+    """GET /api/analytics/revenue-by-day?from=2025-10-01&to=2025-10-31"""
+    return _report(sales.revenue_by_day)
+
+
+@analytics_bp.route("/analytics/revenue-by-category", methods=["GET"])
+def revenue_by_category():
+    """GET /api/analytics/revenue-by-category?from=...&to=..."""
+    return _report(sales.revenue_by_category)
+
+
+@analytics_bp.route("/analytics/top-variants", methods=["GET"])
+def top_variants():
+    """GET /api/analytics/top-variants?limit=10&by=revenue|units&from=...&to=..."""
+    def run(start, end):
+        limit = min(int(request.args.get("limit", 10)), 500)
+        return sales.top_variants(limit, start, end, request.args.get("by", "revenue"))
+    return _report(run)
+
+
+@analytics_bp.route("/analytics/cancellation-rate", methods=["GET"])
+def cancellation_rate():
+    """GET /api/analytics/cancellation-rate?from=...&to=..."""
+    return _report(sales.cancellation_rate)
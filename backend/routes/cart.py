@@ -1,6 +1,7 @@
 # routes/cart.py
 from flask import Blueprint, jsonify, request
-from db import get_db_connection
+from db import mark_write, run_transaction, TransactionConflict
+from sharding import customer_connection
 import mysql.connector
 
 cart_bp = Blueprint("cart", __name__)
@@ -24,7 +25,7 @@ def get_cart(cust_id):
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = customer_connection(cust_id, read=True)
         cursor = conn.cursor(dictionary=True)
         cursor.callproc("show_cart", (cust_id,))
         data = _fetch_proc_results(cursor)
@@ -62,21 +63,27 @@ def add_to_cart():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # call stored procedure that raises SIGNAL on insufficient stock
-        cursor.callproc("sp_add_to_cart", (cust_id, variant_id, qty))
-        # consume any results (some connectors require this)
-        for _ in cursor.stored_results():
-            pass
+        conn = customer_connection(cust_id)
+
+        def add(cursor):
+            # call stored procedure that raises SIGNAL on insufficient stock
+            cursor.callproc("sp_add_to_cart", (cust_id, variant_id, qty))
+            # consume any results (some connectors require this)
+            for _ in cursor.stored_results():
+                pass
+
+        # a deadlock rolls the whole increment back, so running it again can't add twice
+        run_transaction(conn, add, "add_to_cart")
+        mark_write(cust_id)
         # return updated cart
-        conn.commit()
-        cursor.close()
         cursor = conn.cursor(dictionary=True)
         cursor.callproc("show_cart", (cust_id,))
         data = _fetch_proc_results(cursor)
         return jsonify({"success": True, "data": data}), 200
 
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+
     except mysql.connector.Error as err:
         return jsonify({"success": False, "error": str(err)}), 400
 
@@ -111,14 +118,20 @@ def remove_from_cart():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.callproc("sp_remove_from_cart", (int(cust_id), int(variant_id)))
-        for _ in cursor.stored_results():
-            pass
-        conn.commit()
+        conn = customer_connection(cust_id)
+
+        def remove(cursor):
+            cursor.callproc("sp_remove_from_cart", (int(cust_id), int(variant_id)))
+            for _ in cursor.stored_results():
+                pass
+
+        run_transaction(conn, remove, "remove_from_cart")
+        mark_write(cust_id)
         return jsonify({"success": True, "message": "removed from cart"}), 200
 
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+
     except mysql.connector.Error as err:
         if conn:
             conn.rollback()
@@ -162,30 +175,33 @@ def update_cart_quantity():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
-        # start explicit transaction to keep operations atomic
-        conn.start_transaction()
-        cursor = conn.cursor()
-        # remove any existing entry
-        cursor.callproc("sp_remove_from_cart", (cust_id, variant_id))
-        for _ in cursor.stored_results():
-            pass
-
-        if qty > 0:
-            # add with exact qty (sp_add_to_cart increments if exists, but we've removed it above)
-            cursor.callproc("sp_add_to_cart", (cust_id, variant_id, qty))
+        conn = customer_connection(cust_id)
+
+        def replace(cursor):
+            # remove any existing entry
+            cursor.callproc("sp_remove_from_cart", (cust_id, variant_id))
             for _ in cursor.stored_results():
                 pass
 
-        conn.commit()
+            if qty > 0:
+                # add with exact qty (sp_add_to_cart increments if exists, but we've removed it above)
+                cursor.callproc("sp_add_to_cart", (cust_id, variant_id, qty))
+                for _ in cursor.stored_results():
+                    pass
+
+        # both calls in one transaction, retried as a unit on deadlock
+        run_transaction(conn, replace, "update_cart")
+        mark_write(cust_id)
 
         # fetch and return updated cart
-        cursor.close()
         cursor = conn.cursor(dictionary=True)
         cursor.callproc("show_cart", (cust_id,))
         data = _fetch_proc_results(cursor)
         return jsonify({"success": True, "data": data}), 200
 
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+
     except mysql.connector.Error as err:
         if conn:
             conn.rollback()
@@ -0,0 +1,42 @@
+# routes/categories.py
+from flask import Blueprint, jsonify
+import mysql.connector
+
+from categories import category_tree
+
+categories_bp = Blueprint("categories", __name__)
+
+@categories_bp.route("/categories", methods=["GET"])
+def get_categories():
+    """
+    GET /api/categories
+    Returns the category hierarchy as nested nodes.
+    """
+    try:
+        return jsonify({"success": True, "data": category_tree.as_nested()}), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@categories_bp.route("/categories/<int:cat_id>", methods=["GET"])
+def get_category(cat_id):
+    """
+    GET /api/categories/<cat_id>
+    Returns the category, its breadcrumb path and the IDs in its subtree.
+    """
+    try:
+        category = category_tree.get(cat_id)
+        if not category:
+            return jsonify({"success": False, "error": "Category not found"}), 404
+        return jsonify({
+            "success": True,
+            "data": category,
+            "path": category_tree.path(cat_id),
+            "subtree_ids": category_tree.subtree_ids(cat_id)
+        }), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
@@ -1,6 +1,8 @@
 # routes/customers.py
 from flask import Blueprint, jsonify, request
-from db import get_db_connection
+from config import DB_SHARDS
+from db import get_db_connection, TransactionConflict
+from sharding import customer_connection
 import mysql.connector
 
 customers_bp = Blueprint("customers", __name__)
@@ -16,7 +18,7 @@ def get_customer_addresses(cust_id):
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = customer_connection(cust_id, read=True)
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT * FROM Address WHERE CustomerID = %s", (cust_id,))
         data = cursor.fetchall()
@@ -46,7 +48,7 @@ def add_customer_address():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = customer_connection(cust_id)
         cursor = conn.cursor()
         query = """
             INSERT INTO Address (CustomerID, AddressLine1, City, PinCode, AddressType)
@@ -55,6 +57,8 @@ def add_customer_address():
         cursor.execute(query, (cust_id, addr_line, city, pincode, addr_type))
         conn.commit()
         return jsonify({"success": True, "message": "Address added"}), 201
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
     except mysql.connector.Error as err:
         if conn: conn.rollback()
         return jsonify({"success": False, "error": str(err)}), 400
@@ -67,3 +71,89 @@ def add_customer_address():
         if conn:
             conn.close()
 
+@customers_bp.route("/customers/<int:cust_id>/purchased/<int:variant_id>", methods=["GET"])
+def has_purchased(cust_id, variant_id):
+    """
+    GET /api/customers/<cust_id>/purchased/<variant_id>
+    Review eligibility: a primary-key lookup in the PurchasedItem index.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id, read=True)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT OrderCount, FirstPurchased FROM PurchasedItem
+            WHERE CustomerID = %s AND VariantID = %s
+        """, (cust_id, variant_id))
+        row = cursor.fetchone()
+        return jsonify({"success": True, "purchased": bool(row), "data": row}), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@customers_bp.route("/customers/<int:cust_id>/reviews", methods=["POST"])
+def add_review(cust_id):
+    """
+    POST /api/customers/<cust_id>/reviews
+    JSON body: { "variant_id": 2, "rating": 5, "comment": "..." }
+    Uses sp_add_review; only customers who bought the variant may review it.
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    try:
+        variant_id = int(payload.get("variant_id"))
+        rating = int(payload.get("rating"))
+        if not 1 <= rating <= 5:
+            raise ValueError()
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "variant_id and a rating from 1 to 5 are required"}), 400
+    comment = payload.get("comment")
+
+    conn = None
+    cursor = None
+    try:
+        verified = False
+        if DB_SHARDS:
+            # Review is global but PurchasedItem is on the customer's shard: check it there
+            shard_conn = customer_connection(cust_id, read=True)
+            shard_cursor = shard_conn.cursor()
+            try:
+                shard_cursor.execute("SELECT 1 FROM PurchasedItem WHERE CustomerID = %s AND VariantID = %s",
+                                     (cust_id, variant_id))
+                verified = shard_cursor.fetchone() is not None
+            finally:
+                shard_cursor.close()
+                shard_conn.close()
+            if not verified:
+                return jsonify({"success": False, "error": "Cannot review without purchase"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if verified:
+            cursor.execute("SET @purchase_verified = 1")
+        try:
+            cursor.callproc("sp_add_review", (cust_id, variant_id, rating, comment))
+            for _ in cursor.stored_results():
+                pass
+        finally:
+            if verified:
+                cursor.execute("SET @purchase_verified = NULL")
+        conn.commit()
+        return jsonify({"success": True, "message": "Review added"}), 201
+    except mysql.connector.Error as err:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
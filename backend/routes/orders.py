@@ -1,6 +1,12 @@
 # routes/orders.py
 from flask import Blueprint, jsonify, request
-from db import get_db_connection
+from config import DB_SHARDS
+from db import mark_write, run_transaction, TransactionConflict
+from sharding import (
+    customer_connection, customer_read_connection, order_connection,
+    cart_lines, order_lines, reserve_stock, release_stock,
+)
+import archive
 import mysql.connector
 
 # Must be initialized to define routes
@@ -17,11 +23,13 @@ def get_order_history(cust_id):
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = customer_read_connection(cust_id)
         cursor = conn.cursor(dictionary=True)
         # Assuming 'show_order_history' stored procedure exists
         cursor.callproc("show_order_history", (cust_id,))
         data = _fetch_proc_results(cursor)
+        # archived orders are all older than the hot ones, so they go last
+        data.extend(archive.archived_order_history(cursor, cust_id))
         return jsonify({"success": True, "data": data}), 200
     except mysql.connector.Error as err:
         return jsonify({"success": False, "error": str(err)}), 400
@@ -38,11 +46,20 @@ def get_order_details(order_id):
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = order_connection(order_id, read=True)
         cursor = conn.cursor(dictionary=True)
         # Assuming 'show_order_details' stored procedure exists
         cursor.callproc("show_order_details", (order_id,))
         data = _fetch_proc_results(cursor)
+        if not data:
+            _, details = archive.find_archived_order(cursor, order_id)
+            data = [{
+                "ProductName": d["ProductName"],
+                "Variant": f"{d['Size']}/{d['Color']}",
+                "Quantity": d["Quantity"],
+                "Price": d["Price"],
+                "Subtotal": str(round(float(d["Price"]) * d["Quantity"], 2))
+            } for d in details]
         return jsonify({"success": True, "data": data}), 200
     except mysql.connector.Error as err:
         return jsonify({"success": False, "error": str(err)}), 400
@@ -56,36 +73,88 @@ def get_order_details(order_id):
 
 @orders_bp.route("/orders/place", methods=["POST"])
 def place_order():
+    """
+    POST /api/orders/place
+    JSON body: { "customer_id": 1, "shipping_address_id": 2, "idempotency_key": "<uuid>" }
+    Repeating a request with the same idempotency_key returns the order it
+    already placed (200) instead of placing another one.
+    """
     payload = request.get_json()
     cust_id = payload.get("customer_id")
     addr_id = payload.get("shipping_address_id")
+    idem_key = payload.get("idempotency_key") or request.headers.get("Idempotency-Key") or None
 
     if not cust_id or not addr_id:
         return jsonify({"success": False, "error": "customer_id and shipping_address_id are required"}), 400
+    if idem_key is not None and len(str(idem_key)) > 64:
+        return jsonify({"success": False, "error": "idempotency_key must be at most 64 characters"}), 400
+
+    def place(cursor):
+        cursor.callproc("sp_place_order", (cust_id, addr_id, idem_key))
+        return _fetch_proc_results(cursor)
 
     conn = None
-    cursor = None
+    reserved = None     # stock taken on the main database for a sharded checkout, until settled
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        # Assuming 'sp_place_order' stored procedure exists
-        cursor.callproc("sp_place_order", (cust_id, addr_id))
-        data = _fetch_proc_results(cursor)
+        conn = customer_connection(cust_id)
+        if DB_SHARDS:
+            # the shard's stock is a replica: take the cart's stock on the main database first
+            reserved = cart_lines(conn, cust_id)
+            conn.commit()
+            short = reserve_stock(reserved) if reserved else []
+            if short:
+                reserved = None
+                return jsonify({"success": False,
+                                "error": f"Insufficient stock for variant(s) {', '.join(map(str, short))}"}), 400
+        # deadlocks with concurrent orders/cancellations are retried; the key keeps retries from placing twice
+        data = run_transaction(conn, place, "place_order", dictionary=True)
         new_order_id = data[0] if data else None
-        conn.commit()
+        replayed = bool(new_order_id and new_order_id.pop("Replayed", 0))
+        if reserved is not None:
+            # from here on the stock belongs to the order (an error below leaves it taken)
+            taken, reserved = reserved, None
+            if replayed:
+                release_stock(taken)    # the call that placed the order took its stock
+            elif not _settle_stock(conn, taken, new_order_id["NewOrderID"]):
+                return jsonify({"success": False, "error": "Insufficient stock"}), 400
+        mark_write(cust_id)
+        if replayed:
+            return jsonify({"success": True, "message": "Order already placed", "data": new_order_id}), 200
+        # follow-up work runs off this request: outbox handlers, and the recommender tails the order's event
         return jsonify({"success": True, "message": "Order placed successfully", "data": new_order_id}), 201
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
     except mysql.connector.Error as err:
-        if conn: conn.rollback()
         return jsonify({"success": False, "error": str(err)}), 400
     except Exception as e:
         if conn: conn.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
-        if cursor:
-            cursor.close()
+        if reserved:
+            release_stock(reserved)     # no order took it
         if conn:
             conn.close()
 
+
+def _settle_stock(conn, reserved, order_id):
+    """
+    Match the stock taken before a sharded checkout to the order actually
+    placed (the cart can change in between). If the order needs stock that
+    is no longer there, it is cancelled and all of its stock given back.
+    Returns False in that case.
+    """
+    placed = order_lines(conn, order_id)
+    conn.commit()
+    missing = {v: q - reserved.get(v, 0) for v, q in placed.items() if q > reserved.get(v, 0)}
+    if missing and reserve_stock(missing):
+        def cancel(cursor):
+            cursor.execute("UPDATE Orders SET Status = 'Cancelled' WHERE OrderID = %s", (order_id,))
+        run_transaction(conn, cancel, "place_order_cancel")
+        release_stock(reserved)
+        return False
+    release_stock({v: q - placed.get(v, 0) for v, q in reserved.items() if q > placed.get(v, 0)})
+    return True
+
 @orders_bp.route("/orders/cancel", methods=["POST"])
 def cancel_order():
     payload = request.get_json()
@@ -94,26 +163,32 @@ def cancel_order():
     if not order_id:
         return jsonify({"success": False, "error": "order_id is required"}), 400
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def cancel(cursor):
+        cursor.execute("SELECT CustomerID, Status FROM Orders WHERE OrderID = %s FOR UPDATE", (order_id,))
+        owner = cursor.fetchone()
         # Assuming 'cancel_order' stored procedure exists
         cursor.callproc("cancel_order", (order_id,))
         for _ in cursor.stored_results():
             pass
-        conn.commit()
+        return owner
+
+    conn = None
+    try:
+        conn = order_connection(order_id)
+        owner = run_transaction(conn, cancel, "cancel_order")
+        if owner:
+            mark_write(owner[0])
+            # sharded: the stock goes back on the main database, not the shard's replica
+            if DB_SHARDS and owner[1] in ("Pending", "Processing"):
+                release_stock(order_lines(conn, order_id))
         return jsonify({"success": True, "message": "Order cancelled"}), 200
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
     except mysql.connector.Error as err:
-        if conn: conn.rollback()
         return jsonify({"success": False, "error": str(err)}), 400
     except Exception as e:
         if conn: conn.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
     finally:
-        if cursor:
-            cursor.close()
         if conn:
             conn.close()
-
@@ -1,6 +1,8 @@
 # routes/payments.py
 from flask import Blueprint, jsonify, request
-from db import get_db_connection
+from config import DB_SHARDS
+from db import mark_write, run_transaction, TransactionConflict
+from sharding import order_connection, payment_connection, order_lines, release_stock
 import mysql.connector
 
 payments_bp = Blueprint("payments", __name__)
@@ -11,6 +13,13 @@ def _fetch_proc_results(cursor):
         rows.extend(result.fetchall())
     return rows
 
+def _mark_order_owner(cursor, order_id):
+    """Keep the paying customer's reads on the primary so they see the new status."""
+    cursor.execute("SELECT CustomerID FROM Orders WHERE OrderID = %s", (order_id,))
+    row = cursor.fetchone()
+    if row:
+        mark_write(row[0])
+
 @payments_bp.route("/payments/make", methods=["POST"])
 def make_payment():
     """
@@ -29,17 +38,21 @@ def make_payment():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = order_connection(order_id)
+
+        def pay(cursor):
+            cursor.callproc("sp_make_payment", (order_id, method, amount))
+            for _ in cursor.stored_results():
+                pass
+
+        # the payment trigger updates Orders, so this can deadlock with order writes; retried
+        run_transaction(conn, pay, "make_payment")
         cursor = conn.cursor()
-        
-        cursor.callproc("sp_make_payment", (order_id, method, amount))
-        
-        for _ in cursor.stored_results(): 
-            pass
-        
-        conn.commit()
+        _mark_order_owner(cursor, order_id)
         return jsonify({"success": True, "message": "Payment recorded successfully"}), 201
 
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
     except mysql.connector.Error as err:
         if conn: conn.rollback()
         return jsonify({"success": False, "error": str(err)}), 400
@@ -68,15 +81,26 @@ def process_refund():
     conn = None
     cursor = None
     try:
-        conn = get_db_connection()
+        conn = payment_connection(payment_id)
+
+        def refund(cursor):
+            cursor.callproc("process_refund", (payment_id,))
+            for _ in cursor.stored_results():
+                pass
+
+        run_transaction(conn, refund, "refund")
         cursor = conn.cursor()
-        cursor.callproc("process_refund", (payment_id,))
-        for _ in cursor.stored_results(): 
-            pass
-        
-        conn.commit()
+        cursor.execute("SELECT OrderID FROM Payment WHERE PaymentID = %s", (payment_id,))
+        row = cursor.fetchone()
+        if row:
+            _mark_order_owner(cursor, row[0])
+            # sharded: the stock goes back on the main database, not the shard's replica
+            if DB_SHARDS:
+                release_stock(order_lines(conn, row[0]))
         return jsonify({"success": True, "message": "Refund processed successfully"}), 200
 
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
     except mysql.connector.Error as err:
         if conn: conn.rollback()
         return jsonify({"success": False, "error": str(err)}), 400
@@ -1,76 +1,169 @@
 from flask import Blueprint, jsonify, request
-from db import get_db_connection
+from autocomplete import autocomplete
+from config import REVIEWS_PAGE_SIZE, AUTOCOMPLETE_TOP_K
+from facets import facet_index, FACETS
+from db import get_read_connection, fetch_batch
+from singleflight import SingleFlight, SingleFlightTimeout
 
 products_bp = Blueprint('products', __name__)
 
-@products_bp.route('/products', methods=['GET'])
-def get_products():
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+# identical concurrent reads share one DB call
+_catalog_flight = SingleFlight('catalog')
+_product_flight = SingleFlight('product')
 
-        category_id = request.args.get('category_id', None)
-        search_kw = request.args.get('search', '')
 
-        if category_id:
-            cursor.callproc('show_product_catalog', (category_id, search_kw))
-        else:
-            cursor.callproc('show_product_catalog', (None, search_kw))
+def _load_catalog(category_id, search_kw):
+    conn = get_read_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.callproc('show_product_catalog', (category_id, search_kw))
 
         # Stored procedures return results through cursor.stored_results()
         data = []
         for result in cursor.stored_results():
             data.extend(result.fetchall())
+        return data
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _load_product(variant_id, after_date, after_id, limit):
+    conn = get_read_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # product, rating summary and one keyset page of reviews in a single round trip;
+        # ratings come from the ReviewSummary aggregate
+        product_rows, reviews = fetch_batch(cursor, [
+            ("""
+            SELECT p.Prod_Name AS ProductName,
+                   CONCAT(v.Size, '/', v.Color) AS Variant,
+                   v.Price,
+                   v.Stock,
+                   COALESCE(rs.ReviewCount, 0) AS ReviewCount,
+                   ROUND(rs.RatingSum / NULLIF(rs.ReviewCount, 0), 2) AS AvgRating,
+                   COALESCE(rs.Rating1, 0) AS Rating1,
+                   COALESCE(rs.Rating2, 0) AS Rating2,
+                   COALESCE(rs.Rating3, 0) AS Rating3,
+                   COALESCE(rs.Rating4, 0) AS Rating4,
+                   COALESCE(rs.Rating5, 0) AS Rating5
+            FROM ProductVariant v
+            JOIN Product p ON p.ProductID = v.ProductID
+            LEFT JOIN ReviewSummary rs ON rs.VariantID = v.VariantID
+            WHERE v.VariantID = %s
+            """, (variant_id,)),
+            ("CALL show_product_reviews_page(%s, %s, %s, %s)", (variant_id, after_date, after_id, limit)),
+        ])
+
+        if not product_rows:
+            return None, []
+        return product_rows[0], reviews
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@products_bp.route('/products', methods=['GET'])
+def get_products():
+    try:
+        category_id = request.args.get('category_id', None) or None
+        search_kw = request.args.get('search', '')
 
+        data = _catalog_flight.do(
+            (category_id, search_kw),
+            lambda: _load_catalog(category_id, search_kw)
+        )
         return jsonify({'success': True, 'data': data})
 
+    except SingleFlightTimeout as e:
+        return jsonify({'success': False, 'error': str(e)}), 504
+
     except Exception as e:
         print("Error:", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
-    finally:
-        cursor.close()
-        conn.close()
 
+@products_bp.route('/products/autocomplete', methods=['GET'])
+def autocomplete_products():
+    """
+    GET /api/products/autocomplete?q=cot&limit=8
+    Most popular products, categories and sizes/colors matching what has been
+    typed so far, from the in-memory prefix index.
+    """
+    autocomplete.ensure_fresh()
+    if not autocomplete.ready:
+        return jsonify({'success': False, 'error': 'Autocomplete index is loading, try again shortly'}), 503
+    try:
+        limit = min(int(request.args.get('limit', AUTOCOMPLETE_TOP_K)), AUTOCOMPLETE_TOP_K)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be an integer'}), 400
+    return jsonify({'success': True, 'data': autocomplete.suggest(request.args.get('q', ''), max(limit, 1))}), 200
+
+@products_bp.route('/products/filter', methods=['GET'])
+def filter_products():
+    """
+    GET /api/products/filter?category_id=3&size=M&size=L&color=Red&price=25-50&in_stock=1&limit=50&offset=0
+    Variants matching every given facet (any of the values given for one facet),
+    plus per-value counts for each facet, from the in-memory facet bitmaps.
+    """
+    facet_index.ensure_fresh()
+    if not facet_index.ready:
+        return jsonify({'success': False, 'error': 'Facet index is loading, try again shortly'}), 503
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        offset = int(request.args.get('offset', 0))
+        if limit < 1 or offset < 0:
+            raise ValueError()
+        filters = {facet: request.args.getlist('category_id' if facet == 'category' else facet)
+                   for facet in FACETS}
+        filters['category'] = [int(c) for c in filters['category']]
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit, offset and category_id must be non-negative integers'}), 400
+
+    total, rows, counts = facet_index.search(filters, offset, limit)
+    return jsonify({'success': True, 'data': rows, 'total': total, 'facets': counts}), 200
 
 
 @products_bp.route('/products/<int:variant_id>', methods=['GET'])
 def get_product_details(variant_id):
+    """
+    GET /api/products/<variant_id>?limit=10&after_date=2025-10-02&after_id=201
+    Product with its rating summary and one page of reviews; pass next_cursor's
+    values as after_date/after_id to fetch the following page.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        limit = min(int(request.args.get('limit', REVIEWS_PAGE_SIZE)), 100)
+        after_date = request.args.get('after_date') or None
+        after_id = int(request.args['after_id']) if after_date else None
+        if limit < 1:
+            raise ValueError()
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'limit must be a positive integer and after_date needs after_id'}), 400
 
-        # Columns match your schema exactly
-        cursor.execute("""
-            SELECT p.Prod_Name AS ProductName,
-                   CONCAT(v.Size, '/', v.Color) AS Variant,
-                   v.Price,
-                   v.Stock
-            FROM ProductVariant v
-            JOIN Product p ON p.ProductID = v.ProductID
-            WHERE v.VariantID = %s
-        """, (variant_id,))
-        product = cursor.fetchone()
+    try:
+        product, reviews = _product_flight.do(
+            (variant_id, after_date, after_id, limit),
+            lambda: _load_product(variant_id, after_date, after_id, limit)
+        )
 
         if not product:
             return jsonify({'success': False, 'message': 'Product not found'}), 404
 
-        # Reviews fetched using your stored procedure
-        cursor.callproc('show_product_reviews', (variant_id,))
-        reviews = []
-        for result in cursor.stored_results():
-            reviews.extend(result.fetchall())
+        next_cursor = None
+        if len(reviews) == limit:
+            last = reviews[-1]
+            next_cursor = {'after_date': str(last['ReviewDate']), 'after_id': last['ReviewID']}
 
         return jsonify({
             'success': True,
             'product': product,
-            'reviews': reviews
+            'reviews': reviews,
+            'next_cursor': next_cursor
         })
 
+    except SingleFlightTimeout as e:
+        return jsonify({'success': False, 'error': str(e)}), 504
+
     except Exception as e:
         print("Error:", e)
         return jsonify({'success': False, 'error': str(e)}), 500
-
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
@@ -0,0 +1,34 @@
+# routes/recommendations.py
+from flask import Blueprint, jsonify, request
+import mysql.connector
+
+from config import REC_TOP_K
+from recommendations import recommender
+
+recommendations_bp = Blueprint("recommendations", __name__)
+
+@recommendations_bp.route("/recommendations/<int:cust_id>", methods=["GET"])
+def get_recommendations(cust_id):
+    """
+    GET /api/recommendations/<cust_id>?k=10
+    Serves co-purchase suggestions from the in-memory matrix.
+    """
+    try:
+        k = int(request.args.get("k", REC_TOP_K))
+        if k < 1:
+            raise ValueError()
+    except ValueError:
+        return jsonify({"success": False, "error": "k must be a positive integer"}), 400
+
+    # the first build runs in the background; it never fits in this route's budget
+    recommender.ensure_fresh()
+    if not recommender.ready:
+        return jsonify({"success": False, "error": "Recommendations are loading, try again shortly"}), 503
+
+    try:
+        data = recommender.recommend(cust_id, min(k, 100))
+        return jsonify({"success": True, "data": data}), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
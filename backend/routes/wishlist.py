@@ -0,0 +1,214 @@
+# routes/wishlist.py
+from flask import Blueprint, jsonify, request
+from db import TransactionConflict
+from sharding import customer_connection
+import mysql.connector
+
+wishlist_bp = Blueprint("wishlist", __name__)
+
+def _fetch_proc_results(cursor):
+    rows = []
+    for result in cursor.stored_results():
+        rows.extend(result.fetchall())
+    return rows
+
+def _ids_from(payload, *keys):
+    values = []
+    for key in keys:
+        value = request.args.get(key) or payload.get(key)
+        values.append(int(value) if value else None)
+    return values
+
+@wishlist_bp.route("/wishlist/<int:cust_id>", methods=["GET"])
+def get_wishlist(cust_id):
+    """
+    GET /api/wishlist/<cust_id>
+    Returns the customer's wishlist with current price and stock.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id, read=True)
+        cursor = conn.cursor(dictionary=True)
+        cursor.callproc("show_wishlist", (cust_id,))
+        data = _fetch_proc_results(cursor)
+        return jsonify({"success": True, "data": data}), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+@wishlist_bp.route("/wishlist/add", methods=["POST"])
+def add_to_wishlist():
+    """
+    POST /api/wishlist/add
+    JSON body: { "customer_id": 1, "variant_id": 2 }
+    Uses add_to_wishlist(cust_id, variant_id) (re-adding refreshes DateAdded)
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    cust_id = payload.get("customer_id")
+    variant_id = payload.get("variant_id")
+
+    if not cust_id or not variant_id:
+        return jsonify({"success": False, "error": "customer_id and variant_id required"}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id)
+        cursor = conn.cursor()
+        cursor.callproc("add_to_wishlist", (cust_id, variant_id))
+        for _ in cursor.stored_results():
+            pass
+        conn.commit()
+        return jsonify({"success": True, "message": "added to wishlist"}), 200
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+    except mysql.connector.Error as err:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+@wishlist_bp.route("/wishlist/remove", methods=["DELETE"])
+def remove_from_wishlist():
+    """
+    DELETE /api/wishlist/remove?customer_id=1&variant_id=2
+    Or JSON body: { "customer_id": 1, "variant_id": 2 }
+    Uses remove_from_wishlist(cust_id, variant_id)
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    try:
+        cust_id, variant_id = _ids_from(payload, "customer_id", "variant_id")
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "customer_id and variant_id must be integers"}), 400
+
+    if not cust_id or not variant_id:
+        return jsonify({"success": False, "error": "customer_id and variant_id required"}), 400
+
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id)
+        cursor = conn.cursor()
+        cursor.callproc("remove_from_wishlist", (cust_id, variant_id))
+        for _ in cursor.stored_results():
+            pass
+        conn.commit()
+        return jsonify({"success": True, "message": "removed from wishlist"}), 200
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+    except mysql.connector.Error as err:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+@wishlist_bp.route("/wishlist/<int:cust_id>/notifications", methods=["GET"])
+def get_wishlist_notifications(cust_id):
+    """
+    GET /api/wishlist/<cust_id>/notifications?all=1&limit=50
+    Back-in-stock / price-drop alerts queued by wishlist_alerts.py.
+    Unread only unless all=1.
+    """
+    try:
+        limit = min(int(request.args.get("limit", 50)), 200)
+        if limit < 1:
+            raise ValueError()
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be a positive integer"}), 400
+    unread_only = request.args.get("all") != "1"
+
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id, read=True)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT n.NotificationID, n.VariantID, n.Kind, n.OldValue, n.NewValue,
+                   n.CreatedAt, n.ReadAt, p.Prod_Name AS ProductName,
+                   CONCAT(v.Size, '/', v.Color) AS Variant
+            FROM WishlistNotification n
+            JOIN ProductVariant v ON n.VariantID = v.VariantID
+            JOIN Product p ON v.ProductID = p.ProductID
+            WHERE n.CustomerID = %s {"AND n.ReadAt IS NULL" if unread_only else ""}
+            ORDER BY n.NotificationID DESC
+            LIMIT %s
+        """, (cust_id, limit))
+        data = cursor.fetchall()
+        return jsonify({"success": True, "data": data}), 200
+    except mysql.connector.Error as err:
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+@wishlist_bp.route("/wishlist/<int:cust_id>/notifications/read", methods=["POST"])
+def mark_notifications_read(cust_id):
+    """
+    POST /api/wishlist/<cust_id>/notifications/read
+    JSON body: { "notification_ids": [1, 2] }  (omit to mark all as read)
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    ids = payload.get("notification_ids")
+
+    conn = None
+    cursor = None
+    try:
+        conn = customer_connection(cust_id)
+        cursor = conn.cursor()
+        if ids:
+            ids = [int(i) for i in ids]
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"""
+                UPDATE WishlistNotification SET ReadAt = NOW()
+                WHERE CustomerID = %s AND ReadAt IS NULL AND NotificationID IN ({placeholders})
+            """, [cust_id] + ids)
+        else:
+            cursor.execute("""
+                UPDATE WishlistNotification SET ReadAt = NOW()
+                WHERE CustomerID = %s AND ReadAt IS NULL
+            """, (cust_id,))
+        updated = cursor.rowcount
+        conn.commit()
+        return jsonify({"success": True, "updated": updated}), 200
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "notification_ids must be a list of integers"}), 400
+    except TransactionConflict as err:
+        return jsonify({"success": False, "error": str(err)}), 503
+    except mysql.connector.Error as err:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(err)}), 400
+    except Exception as e:
+        if conn: conn.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
@@ -0,0 +1,624 @@
+# backend/sharding.py
+"""
+Customer-keyed sharding.
+
+Per-customer tables (Address, Cart, Orders, OrderDetails, Payment, Wishlist,
+WishlistNotification, ProductViewHistory, PurchasedItem, OrderArchive,
+OrderIdempotency) live on one of the DB_SHARDS databases per customer. Every
+shard is a full retail_store schema; the global tables (Customer, Password,
+Category, Product, ProductVariant, Review, ...) are written on DB_CONFIG and
+copied into the shards by MySQL replication, so foreign keys, joins and
+stored procedures keep working inside a shard. With DB_SHARDS empty every
+function here falls back to the single database.
+
+Stock: a shard's ProductVariant is a replica, so shard connections set
+@stock_on_primary, which turns off the stock triggers and the stock part
+of process_refund there. Checkout takes the cart's stock on DB_CONFIG
+first (reserve_stock) and cancellations and refunds put it back there
+(release_stock). Each shard's OutboxEvent rows are drained by a dispatcher
+of their own (outbox.py).
+
+Placement: the CustomerShard table on DB_CONFIG says where a customer lives.
+A customer without a row is placed by a consistent-hash ring (SHARD_VNODES
+points per shard), so adding a shard only claims about 1/N of new customers,
+and `rebalance` moves existing customers whose ring shard changed. Shard
+connections use AUTO_INCREMENT offset = shard id and increment =
+SHARD_ID_STRIDE, so OrderIDs, PaymentIDs, ... are unique across shards and
+rows can move without renumbering.
+
+Routing:
+    customer_connection(cust_id)       writes to the customer's rows
+    customer_read_connection(cust_id)  reads of the customer's rows
+    order_connection(order_id)         order/payment writes keyed by OrderID
+    payment_connection(payment_id)     ... keyed by PaymentID
+
+Write fence: customer_connection(cust_id) (not read=True) reads the
+customer's directory row FOR SHARE on a second connection to DB_CONFIG and
+holds that lock until the shard connection is closed, so every write that
+could reach the old shard has finished before a move can start. Fence
+connections come from their own pool (SHARD_FENCE_POOL_SIZE), so fenced
+writes that also need the main database can't starve each other.
+
+Online moves (one customer at a time): setting the directory row to
+'moving' waits for those shared locks; after that customer_connection
+raises ShardMoving (answered 503, retry) while reads continue from the
+source. The rows are copied in one transaction on the target (@shard_copy
+set, so insert triggers don't touch stock or emit events) and the per-table
+row counts are compared with the source before it commits. The directory
+then flips to the target and, once cached read routes have expired
+(SHARD_DIRECTORY_TTL_SECONDS), the source rows are deleted.
+
+Usage (from the backend directory):
+    python sharding.py locate 42
+    python sharding.py adopt 1              # register every existing customer on shard 1
+    python sharding.py rebalance --dry-run
+    python sharding.py move 42 2
+"""
+import argparse
+import bisect
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+
+import metrics
+from config import (
+    DB_CONFIG, DB_SHARDS, SHARD_ID_STRIDE, SHARD_VNODES,
+    SHARD_DIRECTORY_TTL_SECONDS, SHARD_DIRECTORY_CACHE_SIZE, SHARD_FENCE_POOL_SIZE,
+)
+from db import _connect, get_db_connection, get_dedicated_connection, get_read_connection, TransactionConflict
+
+# (table, rows of one customer), parents first; deletes run in reverse
+CUSTOMER_TABLES = [
+    ("Address", "CustomerID = %s"),
+    ("Orders", "CustomerID = %s"),
+    ("OrderDetails", "OrderID IN (SELECT OrderID FROM Orders WHERE CustomerID = %s)"),
+    ("Payment", "OrderID IN (SELECT OrderID FROM Orders WHERE CustomerID = %s)"),
+    ("OutboxEvent", "OrderID IN (SELECT OrderID FROM Orders WHERE CustomerID = %s)"),
+    ("OrderIdempotency", "CustomerID = %s"),
+    ("OrderArchive", "CustomerID = %s"),
+    ("Cart", "CustomerID = %s"),
+    ("Wishlist", "CustomerID = %s"),
+    ("WishlistNotification", "CustomerID = %s"),
+    ("ProductViewHistory", "CustomerID = %s"),
+    ("PurchasedItem", "CustomerID = %s"),
+]
+
+
+class ShardMoving(TransactionConflict):
+    """The customer's rows are being moved to another shard; retry shortly."""
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, shard_ids, vnodes=SHARD_VNODES):
+        points = sorted((_hash(f"shard-{s}#{i}"), s) for s in shard_ids for i in range(vnodes))
+        self._points = [p for p, _ in points]
+        self._shards = [s for _, s in points]
+
+    def shard_for(self, cust_id):
+        i = bisect.bisect(self._points, _hash(int(cust_id)))
+        return self._shards[i % len(self._shards)]
+
+
+ring = HashRing(sorted(DB_SHARDS)) if DB_SHARDS else None
+
+
+def _session_sql(shard):
+    # IDs from different shards never collide, so rows can move between them unchanged;
+    # stock triggers stay off, the shard's ProductVariant is a replica (see reserve_stock)
+    return (f"SET SESSION auto_increment_increment = {SHARD_ID_STRIDE}",
+            f"SET SESSION auto_increment_offset = {shard}",
+            "SET @stock_on_primary = 1")
+
+
+def shard_connection(shard):
+    return _connect(DB_SHARDS[shard], session_sql=_session_sql(shard))
+
+
+def dedicated_shard_connection(shard):
+    """Unpooled, for session state (@shard_copy, named locks) that must not leak into the pool."""
+    conn = mysql.connector.connect(**DB_SHARDS[shard])
+    cursor = conn.cursor()
+    try:
+        for sql in _session_sql(shard):
+            cursor.execute(sql)
+    finally:
+        cursor.close()
+    return conn
+
+
+# ---------------- Directory ----------------
+class Directory:
+    """CustomerShard lookups with a bounded, short-lived cache."""
+
+    def __init__(self, ttl=SHARD_DIRECTORY_TTL_SECONDS, max_entries=SHARD_DIRECTORY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()     # CustomerID -> (shard, state, fetched_at)
+        self._lock = threading.Lock()
+
+    def lookup(self, cust_id):
+        """(shard, state) of a customer, placing them by the ring on first use."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(cust_id)
+        if hit is not None and now - hit[2] < self.ttl:
+            metrics.incr("sharding.directory.hits")
+            return hit[0], hit[1]
+
+        metrics.incr("sharding.directory.misses")
+        conn = get_db_connection()
+        try:
+            return self.read(conn, cust_id)
+        finally:
+            conn.commit()
+            conn.close()
+
+    def read(self, conn, cust_id, lock=False):
+        """(shard, state) from CustomerShard on conn, placing the customer by the ring if
+        they have no row yet. lock=True leaves the row share-locked in conn's transaction."""
+        sql = "SELECT Shard, State FROM CustomerShard WHERE CustomerID = %s" + (" FOR SHARE" if lock else "")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, (cust_id,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT IGNORE INTO CustomerShard (CustomerID, Shard) VALUES (%s, %s)",
+                               (cust_id, ring.shard_for(cust_id)))
+                conn.commit()
+                # another process may have placed them first
+                cursor.execute(sql, (cust_id,))
+                row = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        with self._lock:
+            self._cache[cust_id] = (row[0], row[1], time.monotonic())
+            self._cache.move_to_end(cust_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return row[0], row[1]
+
+    def invalidate(self, cust_id):
+        with self._lock:
+            self._cache.pop(cust_id, None)
+
+
+directory = Directory()
+
+
+# ---------------- Routing ----------------
+def fence_connection():
+    """DB_CONFIG connection to hold a write fence on. Fences have a pool of their own:
+    a fenced write also takes main-database connections (reserve_stock, ...), so with
+    one shared pool DB_POOL_SIZE concurrent writes could hold every slot as fences
+    and all wait for one more."""
+    return _connect(DB_CONFIG, purpose="fence", size=SHARD_FENCE_POOL_SIZE)
+
+
+class FencedConnection:
+    """A shard connection for writes. Holds the customer's directory row share-locked
+    on DB_CONFIG until close(), so a move waits for the write to finish."""
+
+    def __init__(self, conn, fence):
+        self._conn = conn
+        self._fence = fence
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        fence, self._fence = self._fence, None
+        try:
+            if conn is not None:
+                conn.close()
+        finally:
+            if fence is not None:
+                fence.close()       # the pool rolls back, which releases the shared lock
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError(msg="connection already closed")
+        return getattr(self._conn, name)
+
+
+def customer_connection(cust_id, read=False):
+    """Primary connection for one customer's rows. Writes are fenced against moves and
+    refused while the customer is being moved; read=True keeps reading from the
+    source shard and uses the cached directory."""
+    if not DB_SHARDS or cust_id is None:
+        return get_db_connection()
+    if read:
+        shard, _ = directory.lookup(int(cust_id))
+        return shard_connection(shard)
+    fence = fence_connection()
+    try:
+        shard, state = directory.read(fence, int(cust_id), lock=True)
+        if state == "moving":
+            metrics.incr("sharding.rejected_moving")
+            raise ShardMoving(msg=f"customer {cust_id} is being moved to another shard, retry shortly")
+        return FencedConnection(shard_connection(shard), fence)
+    except BaseException:
+        fence.close()
+        raise
+
+
+def fence_customers(fence, shard, cust_ids):
+    """The customers among cust_ids that live on `shard` and aren't being moved, their
+    directory rows share-locked in fence's transaction: set-based jobs that write
+    straight to a shard are fenced against moves like customer_connection."""
+    cust_ids = sorted(set(cust_ids))
+    if not cust_ids:
+        return set()
+    cursor = fence.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT CustomerID FROM CustomerShard
+            WHERE CustomerID IN ({','.join(['%s'] * len(cust_ids))}) AND Shard = %s AND State = 'active'
+            FOR SHARE
+        """, cust_ids + [shard])
+        return {r[0] for r in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def customer_read_connection(cust_id):
+    """Connection for reads that may go to a replica (the shard itself when sharded)."""
+    if not DB_SHARDS or cust_id is None:
+        return get_read_connection(cust_id)
+    shard, _ = directory.lookup(int(cust_id))
+    return shard_connection(shard)
+
+
+def each_customer_shard(read=False, dedicated=False):
+    """Yield a connection to every database holding customer rows (just DB_CONFIG
+    when unsharded), closing each once the caller moves on. Each customer's rows
+    are on exactly one shard, so per-customer aggregates add up across them.
+    read=True lets an unsharded database be read from a replica; dedicated=True
+    gives unpooled connections for jobs that change session settings."""
+    for shard in sorted(DB_SHARDS) or [None]:
+        if shard is not None:
+            conn = dedicated_shard_connection(shard) if dedicated else shard_connection(shard)
+        elif dedicated:
+            conn = get_dedicated_connection()
+        else:
+            conn = get_read_connection() if read else get_db_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+class _OwnerCache:
+    """OrderID/PaymentID -> CustomerID. Owners never change, so entries never go stale."""
+
+    def __init__(self, max_entries=SHARD_DIRECTORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, find):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        owner = find()
+        if owner is not None:
+            with self._lock:
+                self._cache[key] = owner
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return owner
+
+
+_owners = _OwnerCache()
+
+
+def _find_owner(sql, key):
+    """Ask every shard; the row exists on exactly one of them (or on both mid-move)."""
+    metrics.incr("sharding.scatter_lookups")
+    for shard in sorted(DB_SHARDS):
+        conn = shard_connection(shard)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, {"id": key})
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if row is not None:
+            return row[0]
+    return None
+
+
+def order_owner(order_id):
+    if not DB_SHARDS:
+        return None
+    return _owners.get(("order", int(order_id)), lambda: _find_owner("""
+        SELECT CustomerID FROM Orders WHERE OrderID = %(id)s
+        UNION ALL
+        SELECT CustomerID FROM OrderArchive WHERE OrderID = %(id)s
+    """, int(order_id)))
+
+
+def order_connection(order_id, read=False):
+    """Connection to the shard holding an order, live or archived (DB_CONFIG if no shard has it)."""
+    return customer_connection(order_owner(order_id), read)
+
+
+def payment_connection(payment_id):
+    owner = None
+    if DB_SHARDS:
+        owner = _owners.get(("payment", int(payment_id)), lambda: _find_owner(
+            "SELECT o.CustomerID FROM Payment p JOIN Orders o ON o.OrderID = p.OrderID WHERE p.PaymentID = %(id)s",
+            int(payment_id)))
+    return customer_connection(owner)
+
+
+# ---------------- Stock on the global database ----------------
+def _lines(conn, sql, key):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, (key,))
+        lines = {}
+        for variant_id, quantity in cursor.fetchall():
+            lines[variant_id] = lines.get(variant_id, 0) + int(quantity)
+        return lines
+    finally:
+        cursor.close()
+
+
+def cart_lines(conn, cust_id):
+    """{VariantID: Quantity} in the customer's cart."""
+    return _lines(conn, "SELECT VariantID, Quantity FROM Cart WHERE CustomerID = %s", cust_id)
+
+
+def order_lines(conn, order_id):
+    """{VariantID: Quantity} of an order."""
+    return _lines(conn, "SELECT VariantID, Quantity FROM OrderDetails WHERE OrderID = %s", order_id)
+
+
+def reserve_stock(lines):
+    """
+    Take {VariantID: quantity} off ProductVariant.Stock on DB_CONFIG, all or
+    nothing. Returns the VariantIDs that are short; empty means the stock was
+    taken. Variants are updated in VariantID order so concurrent checkouts
+    don't deadlock.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        short = []
+        for variant_id in sorted(lines):
+            cursor.execute("""
+                UPDATE ProductVariant SET Stock = Stock - %s
+                WHERE VariantID = %s AND Stock >= %s
+            """, (lines[variant_id], variant_id, lines[variant_id]))
+            if cursor.rowcount != 1:
+                short.append(variant_id)
+        if short:
+            conn.rollback()
+            metrics.incr("sharding.stock_short")
+        else:
+            conn.commit()
+            metrics.incr("sharding.stock_reserved", sum(lines.values()))
+        return short
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def release_stock(lines):
+    """Put {VariantID: quantity} back on ProductVariant.Stock on DB_CONFIG."""
+    if not lines:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for variant_id in sorted(lines):
+            cursor.execute("UPDATE ProductVariant SET Stock = Stock + %s WHERE VariantID = %s",
+                           (lines[variant_id], variant_id))
+        conn.commit()
+        metrics.incr("sharding.stock_released", sum(lines.values()))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ---------------- Moving customers ----------------
+def _count_rows(cursor, cust_id):
+    counts = {}
+    for table, where in CUSTOMER_TABLES:
+        cursor.execute(f"SELECT COUNT(*) AS n FROM {table} WHERE {where}", (cust_id,))
+        row = cursor.fetchone()
+        counts[table] = row["n"] if isinstance(row, dict) else row[0]
+    return counts
+
+
+def _copy_customer(src, dst, cust_id):
+    """Copy a customer's rows from src to dst in one dst transaction (leftovers of an earlier
+    try replaced). Commits only if every table ends up with as many rows as the source has."""
+    read = src.cursor(dictionary=True)
+    write = dst.cursor()
+    try:
+        write.execute("SET @shard_copy = 1")
+        for table, where in reversed(CUSTOMER_TABLES):
+            write.execute(f"DELETE FROM {table} WHERE {where}", (cust_id,))
+        copied = 0
+        for table, where in CUSTOMER_TABLES:
+            read.execute(f"SELECT * FROM {table} WHERE {where}", (cust_id,))
+            rows = read.fetchall()
+            if not rows:
+                continue
+            columns = list(rows[0])
+            write.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                [tuple(r[c] for c in columns) for r in rows])
+            copied += len(rows)
+        # re-count the source outside the copy's snapshot: a write that got past the
+        # fence shows up here instead of being deleted with the source rows
+        src.commit()
+        expected, actual = _count_rows(read, cust_id), _count_rows(write, cust_id)
+        if expected != actual:
+            metrics.incr("sharding.copy_mismatch")
+            raise mysql.connector.errors.DataError(
+                msg=f"customer {cust_id}: copied row counts {actual} differ from the source {expected}")
+        dst.commit()
+        src.commit()
+        return copied
+    except Exception:
+        dst.rollback()
+        raise
+    finally:
+        write.execute("SET @shard_copy = NULL")
+        read.close()
+        write.close()
+
+
+def _set_directory(cust_id, shard, state, expected_state):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE CustomerShard SET Shard = %s, State = %s
+            WHERE CustomerID = %s AND State = %s
+        """, (shard, state, cust_id, expected_state))
+        changed = cursor.rowcount
+        conn.commit()
+        return changed == 1
+    finally:
+        cursor.close()
+        conn.close()
+        directory.invalidate(cust_id)
+
+
+def _delete_customer(conn, cust_id):
+    cursor = conn.cursor()
+    try:
+        for table, where in reversed(CUSTOMER_TABLES):
+            cursor.execute(f"DELETE FROM {table} WHERE {where}", (cust_id,))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def move_customer(cust_id, target):
+    """Move one customer's rows to shard `target`. Returns the number of rows copied."""
+    source, state = directory.lookup(cust_id)
+    if source == target:
+        return 0
+    # waits for the shared locks of in-flight writes (see customer_connection); once
+    # committed, no write can reach the source any more
+    if state != "active" or not _set_directory(cust_id, source, "moving", "active"):
+        raise ShardMoving(msg=f"customer {cust_id} is already being moved")
+    started = time.monotonic()
+    src = dst = None
+    copied = None
+    try:
+        try:
+            src = dedicated_shard_connection(source)
+            dst = dedicated_shard_connection(target)
+            copied = _copy_customer(src, dst, cust_id)
+            if not _set_directory(cust_id, target, "active", "moving"):
+                raise ShardMoving(msg=f"customer {cust_id}: directory changed during the move")
+        except Exception:
+            # nothing was flipped: the customer stays (and stays writable) on the source
+            if copied is not None:
+                _delete_customer(dst, cust_id)
+            _set_directory(cust_id, source, "active", "moving")
+            metrics.incr("sharding.moves_failed")
+            raise
+        # writes go to the target now; reads routed by a cached directory entry may
+        # still reach the source until it expires
+        time.sleep(SHARD_DIRECTORY_TTL_SECONDS + 0.5)
+        _delete_customer(src, cust_id)
+    finally:
+        for conn in (src, dst):
+            if conn is not None:
+                conn.close()
+    metrics.incr("sharding.moves")
+    metrics.incr("sharding.rows_moved", copied)
+    metrics.incr("sharding.move_seconds", time.monotonic() - started)
+    return copied
+
+
+def misplaced(limit=None):
+    """(CustomerID, current shard, ring shard) for customers the ring puts elsewhere."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT CustomerID, Shard FROM CustomerShard WHERE State = 'active' ORDER BY CustomerID")
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    out = [(cid, shard, ring.shard_for(cid)) for cid, shard in rows if ring.shard_for(cid) != shard]
+    return out[:limit] if limit else out
+
+
+def rebalance(dry_run=False, limit=None, pause=0.0):
+    moves = misplaced(limit)
+    for i, (cid, source, target) in enumerate(moves, 1):
+        if dry_run:
+            print(f"customer {cid}: shard {source} -> {target}")
+            continue
+        try:
+            rows = move_customer(cid, target)
+            print(f"[{i}/{len(moves)}] customer {cid}: shard {source} -> {target} ({rows} rows)")
+        except mysql.connector.Error as e:
+            print(f"[{i}/{len(moves)}] customer {cid}: move failed, left on shard {source}: {e}")
+        if pause:
+            time.sleep(pause)
+    return len(moves)
+
+
+def adopt(shard):
+    """Register every customer without a directory row as living on `shard` (e.g. the pre-sharding database)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT IGNORE INTO CustomerShard (CustomerID, Shard)
+            SELECT CustomerID, %s FROM Customer
+        """, (shard,))
+        adopted = cursor.rowcount
+        conn.commit()
+        return adopted
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Customer shard directory and rebalancing")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("locate", help="show a customer's shard")
+    p.add_argument("customer_id", type=int)
+    p = sub.add_parser("adopt", help="register existing customers on a shard")
+    p.add_argument("shard", type=int)
+    p = sub.add_parser("move", help="move one customer")
+    p.add_argument("customer_id", type=int)
+    p.add_argument("shard", type=int)
+    p = sub.add_parser("rebalance", help="move customers to their ring shard")
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--limit", type=int, default=None)
+    p.add_argument("--pause", type=float, default=0.0, help="seconds between moves")
+    args = parser.parse_args()
+
+    if not DB_SHARDS:
+        parser.error("DB_SHARDS is not set")
+    if getattr(args, "shard", None) is not None and args.shard not in DB_SHARDS:
+        parser.error(f"unknown shard {args.shard}; DB_SHARDS has {sorted(DB_SHARDS)}")
+    if args.command == "locate":
+        shard, state = directory.lookup(args.customer_id)
+        print(f"customer {args.customer_id}: shard {shard} ({state}); ring says {ring.shard_for(args.customer_id)}")
+    elif args.command == "adopt":
+        print(f"{adopt(args.shard)} customers registered on shard {args.shard}")
+    elif args.command == "move":
+        print(f"{move_customer(args.customer_id, args.shard)} rows moved")
+    else:
+        print(f"{rebalance(args.dry_run, args.limit, args.pause)} customers {'to move' if args.dry_run else 'processed'}")
@@ -0,0 +1,62 @@
+# backend/singleflight.py
+"""
+Request coalescing for identical concurrent reads.
+
+The first caller for a key runs the DB call; callers arriving while it is in
+flight wait for that result instead of issuing their own query. Results are
+shared between threads, so callers must treat them as read-only.
+"""
+import threading
+
+import metrics
+from config import SINGLEFLIGHT_TIMEOUT
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=SINGLEFLIGHT_TIMEOUT):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if leader:
+            metrics.incr(f"singleflight.{self.name}.db_calls")
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            if not call.done.wait(timeout):
+                metrics.incr(f"singleflight.{self.name}.timeouts")
+                raise SingleFlightTimeout(f"timed out waiting for in-flight {self.name} read")
+            metrics.incr(f"singleflight.{self.name}.saved")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+# tests import backend modules the way app.py does (flat, from the backend directory)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
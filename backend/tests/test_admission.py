@@ -0,0 +1,34 @@
+# backend/tests/test_admission.py
+import threading
+import time
+
+from admission import AdmissionController, Overloaded
+
+
+def _wait_until(check, timeout=1.0):
+    end = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+def _try_acquire(controller, *args):
+    try:
+        controller.acquire(*args)
+    except Overloaded:
+        pass
+
+
+def test_route_limited_waiter_does_not_block_lower_classes():
+    controller = AdmissionController(capacity=8, max_queue=8)
+    controller.acquire("standard", "/api/admin/ingest", 1)
+
+    # a second ingest waits for the route slot only
+    waiter = threading.Thread(target=_try_acquire, args=(controller, "standard", "/api/admin/ingest", 1))
+    waiter.start()
+    _wait_until(lambda: controller.state()["waiting"]["standard"] == 1)
+
+    controller.acquire("browse")        # free capacity: admitted right away
+    assert controller.state()["inflight"] == 2
+    waiter.join()
+
@@ -0,0 +1,62 @@
+# backend/tests/test_autocomplete.py
+import random
+
+from autocomplete import PrefixIndex, _terms
+
+
+def _fresh(entries, k):
+    index = PrefixIndex(k)
+    index.bulk_insert([(key, label, weight, terms) for key, (weight, label, terms) in entries.items()])
+    index.finish_build()
+    return index
+
+
+def _prefixes(*indexes):
+    out = set()
+    for index in indexes:
+        for _, _, terms in index.entries.values():
+            for term in terms:
+                out.update(term[:i] for i in range(1, len(term) + 1))
+    return out
+
+
+def _assert_same(index, removed_terms=()):
+    fresh = _fresh(index.entries, index.k)
+    prefixes = _prefixes(index, fresh)
+    for term in removed_terms:
+        prefixes.update(term[:i] for i in range(1, len(term) + 1))
+    for prefix in sorted(prefixes):
+        assert index.lookup(prefix, index.k) == fresh.lookup(prefix, index.k), prefix
+
+
+def test_split_above_earlier_path_in_same_batch():
+    index = PrefixIndex(5)
+    index.bulk_insert([(0, "abc", 4, _terms("abc"))])
+    index.finish_build()
+    index.put_many([(3, "ab a", 1, _terms("ab a")), (0, "abc", 4, _terms("abc"))])
+    assert index.lookup("ab", 5) == (0, 3)
+    _assert_same(index)
+
+
+def test_random_batches_match_fresh_build():
+    rng = random.Random(7)
+    words = ["a", "ab", "abc", "abd", "b", "ba", "shirt", "shoe", "sh", "cotton", "co"]
+
+    def item(key):
+        label = " ".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        return key, label, rng.random(), _terms(label)
+
+    index = PrefixIndex(3)
+    index.bulk_insert([item(key) for key in range(20)])
+    index.finish_build()
+    for _ in range(200):
+        removed = set()
+        if rng.random() < 0.5:
+            keys = rng.sample(sorted(index.entries), min(len(index.entries), rng.randint(1, 4)))
+            removed.update(t for key in keys for t in index.entries[key][2])
+            index.remove_many(keys)
+        else:
+            keys = [rng.randrange(30) for _ in range(rng.randint(1, 5))]
+            removed.update(t for key in keys if key in index.entries for t in index.entries[key][2])
+            index.put_many([item(key) for key in keys])
+        _assert_same(index, removed)
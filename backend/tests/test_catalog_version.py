@@ -0,0 +1,72 @@
+# backend/tests/test_catalog_version.py
+from catalog_version import CatalogVersions, read_changes
+
+
+class FakeCursor:
+    """Just enough of a cursor over the committed CatalogChange rows {ChangeID: ProductID}."""
+
+    def __init__(self, committed):
+        self.committed = committed
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        if sql.startswith("SELECT COALESCE(MAX(ChangeID), 0)"):
+            self._rows = [(max(self.committed, default=0),)]
+        elif sql.startswith("SELECT ChangeID FROM"):
+            self._rows = [(cid,) for cid in sorted(self.committed) if cid > params[0]]
+        else:
+            since, wanted = params[0], set(params[1:])
+            self._rows = [(pid, cid) for cid, pid in sorted(self.committed.items())
+                          if cid > since or cid in wanted]
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_late_commit_below_high_water_mark_is_read():
+    committed = {1: 10, 2: 20}
+    cur = FakeCursor(committed)
+    _, position = read_changes(cur, None)
+    # 3 and 5 are still open when 4 and 6 commit
+    committed.update({4: 40, 6: 60})
+    rows, position = read_changes(cur, position)
+    assert sorted(rows) == [(40, 4), (60, 6)]
+    assert position.hwm == 6 and set(position.gaps) == {3, 5}
+    committed[3] = 30
+    rows, position = read_changes(cur, position)
+    assert rows == [(30, 3)]
+    assert set(position.gaps) == {5}
+
+
+def test_gaps_open_at_start_are_tracked():
+    committed = {1: 10, 3: 30}
+    cur = FakeCursor(committed)
+    _, position = read_changes(cur, None)
+    assert position.hwm == 3 and set(position.gaps) == {2}
+    committed[2] = 20
+    rows, _ = read_changes(cur, position)
+    assert rows == [(20, 2)]
+
+
+def test_versions_move_on_late_commits():
+    committed = {1: 10}
+    cur = FakeCursor(committed)
+    versions = CatalogVersions()
+    versions.refresh(cur)
+    committed[3] = 10
+    versions.refresh(cur)
+    first = versions.product_version(10)
+    committed[2] = 10
+    assert versions.refresh(cur) == {10}
+    assert versions.product_version(10) > first
+
+
+def test_sync_reports_a_database_behind_the_versions():
+    versions = CatalogVersions()
+    versions.sync(FakeCursor({1: 10, 2: 20}))
+    assert versions.sync(FakeCursor({1: 10, 2: 20}))
+    assert not versions.sync(FakeCursor({1: 10}))
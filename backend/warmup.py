@@ -0,0 +1,135 @@
+# backend/warmup.py
+"""
+Startup warm-up.
+
+Runs once in a background thread when the app starts, before the instance
+reports ready on /healthz/ready:
+  1. open WARMUP_CONNECTIONS pooled connections to the primary (and replicas)
+  2. compile every template in backend/templates
+  3. run the trending and product-detail queries, pulling their InnoDB pages
+     into the buffer pool
+  4. request /, /products, /api/products and /api/categories in-process, which
+     runs the catalog queries and fills the category tree, catalog version and
+     product fragment caches
+  5. start the analytics snapshot, recommender, autocomplete and facet builds
+A failing step is retried every WARMUP_RETRY_SECONDS until it succeeds (for
+example while MySQL is still starting).
+"""
+import threading
+import time
+
+from werkzeug.test import Client
+
+import metrics
+from admission import INTERNAL_HEADER, internal_token
+from config import (
+    DB_CONFIG, DB_REPLICAS, WARMUP_CONNECTIONS, WARMUP_PRODUCT_DETAILS, WARMUP_RETRY_SECONDS,
+    REVIEWS_PAGE_SIZE,
+)
+from analytics import sales
+from autocomplete import autocomplete
+from db import get_pool, get_read_connection
+from facets import facet_index
+from recommendations import recommender
+from routes.products import _load_product
+
+WARMUP_PATHS = ["/", "/products", "/api/products", "/api/categories"]
+
+
+class WarmupState:
+    def __init__(self):
+        self.ready = False
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}         # step -> {"ok": bool, "ms": float, "error": str}
+
+    def to_dict(self):
+        return {
+            "ready": self.ready,
+            "steps": self.steps,
+            "seconds": round((self.finished_at or time.monotonic()) - self.started_at, 3)
+                       if self.started_at else None,
+        }
+
+
+state = WarmupState()
+
+
+def _open_pools():
+    opened = get_pool(DB_CONFIG).warm(WARMUP_CONNECTIONS)
+    for replica in DB_REPLICAS:
+        opened += get_pool(replica).warm(WARMUP_CONNECTIONS)
+    return f"{opened} connections"
+
+
+def _compile_templates(app):
+    names = [n for n in app.jinja_env.list_templates() if n.endswith(".html")]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return f"{len(names)} templates"
+
+
+def _run_queries():
+    conn = get_read_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.callproc("show_trending_products", (10,))
+        trending = [r for result in cursor.stored_results() for r in result.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+    # the variants a visitor is most likely to open first
+    variant_ids = [r["VariantID"] for r in trending][:WARMUP_PRODUCT_DETAILS]
+    for vid in variant_ids:
+        _load_product(vid, None, None, REVIEWS_PAGE_SIZE)
+    return f"{len(trending)} trending, {len(variant_ids)} product pages"
+
+
+def _render_pages(app):
+    """Request the hot pages in-process: catalog queries, page templates and fragment/category caches."""
+    client = Client(app)
+    headers = {INTERNAL_HEADER: internal_token(app.secret_key)}    # not admitted, rate limited or captured
+    for path in WARMUP_PATHS:
+        resp = client.get(path, headers=headers, environ_base={"REMOTE_ADDR": "127.0.0.1"})
+        if resp.status_code >= 500:
+            raise RuntimeError(f"{path} returned {resp.status_code}")
+    return f"{len(WARMUP_PATHS)} pages"
+
+
+def _start_background_builds():
+    sales.start()
+    recommender.ensure_fresh()
+    autocomplete.ensure_fresh()
+    facet_index.ensure_fresh()
+    return "analytics, recommendations, autocomplete, facets"
+
+
+def _step(name, fn, *args):
+    while True:
+        started = time.perf_counter()
+        try:
+            detail = fn(*args)
+            state.steps[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1),
+                                 "detail": detail}
+            return
+        except Exception as e:
+            state.steps[name] = {"ok": False, "error": str(e)}
+            metrics.incr(f"warmup.{name}.failed")
+            print(f"Warm-up step {name} failed, retrying:", e)
+            time.sleep(WARMUP_RETRY_SECONDS)
+
+
+def run(app):
+    state.started_at = time.monotonic()
+    _step("pool", _open_pools)
+    _step("templates", _compile_templates, app)
+    _step("queries", _run_queries)
+    _step("pages", _render_pages, app)
+    _step("background", _start_background_builds)
+    state.finished_at = time.monotonic()
+    state.ready = True
+    print(f"Warm-up finished in {state.finished_at - state.started_at:.1f}s")
+
+
+def start(app):
+    threading.Thread(target=run, args=(app,), daemon=True).start()
@@ -0,0 +1,128 @@
+# backend/wishlist_alerts.py
+"""
+Wishlist back-in-stock / price-drop alerts.
+
+The ProductVariant trigger on the main database queues one VariantAlert row
+per stock or price change that watchers should hear about. Wishlist lives
+with the customer (on their shard when sharded, where replicated
+ProductVariant changes fire no triggers), so alerts are matched here: each
+batch is fanned out to every database in each_customer_shard(), one
+INSERT ... SELECT per alert over the variant's watchers
+(idx_wishlist_variant). WishlistNotification is unique on (AlertID,
+CustomerID), so a batch that fails half way is simply delivered again; the
+alerts are deleted once every shard has them.
+
+Runs every WISHLIST_ALERT_SECONDS in one app process (MySQL GET_LOCK), or
+once from the command line:
+    python wishlist_alerts.py
+"""
+import threading
+import time
+
+import metrics
+from config import WISHLIST_ALERT_SECONDS, WISHLIST_ALERT_BATCH
+from db import get_dedicated_connection
+from sharding import each_customer_shard
+
+_LOCK_NAME = "marketplace_wishlist_alerts"
+
+_FAN_OUT_SQL = """
+    INSERT IGNORE INTO WishlistNotification (AlertID, CustomerID, VariantID, Kind, OldValue, NewValue)
+    SELECT %s, CustomerID, VariantID, %s, %s, %s
+    FROM Wishlist
+    WHERE VariantID = %s
+"""
+
+
+def fan_out(conn, limit=WISHLIST_ALERT_BATCH):
+    """Deliver up to `limit` queued alerts to every shard. Returns the number of alerts handled."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT AlertID, VariantID, Kind, OldValue, NewValue
+            FROM VariantAlert
+            ORDER BY AlertID
+            LIMIT %s
+        """, (limit,))
+        alerts = cursor.fetchall()
+        conn.commit()
+        if not alerts:
+            return 0
+
+        queued = 0
+        for shard_conn in each_customer_shard():
+            shard_cursor = shard_conn.cursor()
+            try:
+                for alert_id, variant_id, kind, old_value, new_value in alerts:
+                    shard_cursor.execute(_FAN_OUT_SQL, (alert_id, kind, old_value, new_value, variant_id))
+                    queued += shard_cursor.rowcount
+                shard_conn.commit()
+            finally:
+                shard_cursor.close()
+
+        ids = [a[0] for a in alerts]
+        cursor.execute(f"DELETE FROM VariantAlert WHERE AlertID IN ({','.join(['%s'] * len(ids))})", ids)
+        conn.commit()
+        metrics.incr("wishlist_alerts.alerts", len(alerts))
+        metrics.incr("wishlist_alerts.notifications", queued)
+        return len(alerts)
+    finally:
+        cursor.close()
+
+
+def drain(conn):
+    """Fan out every queued alert. Returns the number handled."""
+    total = 0
+    while True:
+        handled = fan_out(conn)
+        total += handled
+        if handled < WISHLIST_ALERT_BATCH:
+            return total
+
+
+class Alerter:
+    def __init__(self):
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            conn = None
+            try:
+                conn = get_dedicated_connection()
+                cursor = conn.cursor()
+                # only one process fans out; others keep polling for the lock
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+                if cursor.fetchone()[0] == 1:
+                    cursor.close()
+                    while True:
+                        drain(conn)
+                        time.sleep(WISHLIST_ALERT_SECONDS)
+                cursor.close()
+            except Exception as e:
+                metrics.incr("wishlist_alerts.failed")
+                print("Wishlist alert error:", e)
+            finally:
+                if conn:
+                    try:
+                        conn.close()    # also releases the named lock
+                    except Exception:
+                        pass
+            time.sleep(WISHLIST_ALERT_SECONDS)
+
+
+alerter = Alerter()
+
+
+if __name__ == "__main__":
+    conn = get_dedicated_connection()
+    try:
+        print(f"{drain(conn)} alert(s) fanned out")
+    finally:
+        conn.close()